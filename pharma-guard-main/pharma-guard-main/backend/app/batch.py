@@ -0,0 +1,306 @@
+"""
+Bulk CLI — runs the PGx engine over a directory (or manifest) of VCF files
+without going through the HTTP API.
+
+Files are parsed and assessed in a process pool; each worker loads the
+knowledge-base snapshot once at start-up and keeps it for every file it
+handles. Results are written as one row per (file, drug), in NDJSON or CSV,
+with failed files reported as a single "error" row. LLM explanations are not
+generated here.
+
+Runs are resumable: after each file's rows are flushed, "<offset>\\t<path>" is
+appended to "<out>.progress". Re-running the same command truncates the
+output to the last recorded offset (dropping a file that was half-written
+when the run stopped) and skips every file already listed. The log starts
+with a "# {...}" header of the run parameters (format, drugs, output path,
+size limit); a resume with different ones is refused, since its rows would
+not match those already written.
+
+Run from backend/:
+    python -m app.batch /archive/vcfs --drugs ALL --out results.ndjson
+    python -m app.batch --manifest files.txt --drugs CODEINE,WARFARIN --out results.csv --format csv
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from app.models.schemas import ClinicalRecommendation, QualityMetrics, RiskResult
+from app.services.pipeline import CONFIDENCE_BASIS, VCF_EXTENSIONS, NoVariantsError, analyze_vcf_path
+from app.services.tabix import TabixError
+from app.services.vcf_parser import VCFTooLargeError
+from app.utils import knowledge_base
+
+FORMATS = ("ndjson", "csv")
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "0")) or os.cpu_count() or 1   # worker processes
+IN_FLIGHT_PER_WORKER = 4     # queued files per worker; bounds parent memory
+PROGRESS_EVERY = 500         # files between progress lines
+
+
+
+class RunMismatchError(RuntimeError):
+    """Raised when resuming a run whose progress log was written with other parameters."""
+
+
+CSV_COLUMNS = [
+    "file", "status", "error", "patient_id", "drug", "risk_label", "confidence_score", "severity",
+    "primary_gene", "diplotype", "phenotype", "detected_variants", "action", "dosing_guidance",
+    "alternative_drugs", "monitoring_required", "cpic_guideline", "variants_detected", "genes_analyzed",
+    "knowledge_base_version",
+]
+
+
+# ─── INPUTS ──────────────────────────────────────────────────────────────────
+
+def discover(inputs: List[str], manifest: Optional[str] = None) -> List[str]:
+    """VCF paths under the given files/directories and in the manifest, sorted and de-duplicated."""
+    paths: Set[str] = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                paths.update(os.path.join(root, name) for name in names if name.endswith(VCF_EXTENSIONS))
+        else:
+            paths.add(item)
+    if manifest:
+        base = os.path.dirname(manifest)
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    paths.add(os.path.join(base, line))
+    return sorted(os.path.normpath(p) for p in paths)
+
+
+def parse_drugs(drugs: str) -> List[str]:
+    kb = knowledge_base.current()
+    drug_list = [d.strip().upper() for d in drugs.split(",") if d.strip()]
+    if drug_list == ["ALL"]:
+        return list(kb.supported_drugs)
+    unsupported = [d for d in drug_list if d not in kb.drug_gene_map]
+    if not drug_list or unsupported:
+        raise ValueError(f"Unsupported drug(s): {unsupported}. Supported: {kb.supported_drugs}")
+    return drug_list
+
+
+# ─── WORKERS ─────────────────────────────────────────────────────────────────
+
+def _warm_worker() -> None:
+    knowledge_base.current()
+
+
+def _ndjson_rows(rows: List[dict]) -> str:
+    return "".join(json.dumps(row, separators=(",", ":")) + "\n" for row in rows)
+
+
+def _csv_rows(rows: List[dict]) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    for row in rows:
+        if row["status"] != "ok":
+            writer.writerow([row["file"], row["status"], row["error"]] + [""] * (len(CSV_COLUMNS) - 3))
+            continue
+        risk, profile = row["risk_assessment"], row["pharmacogenomic_profile"]
+        rec, metrics = row["clinical_recommendation"], row["quality_metrics"]
+        writer.writerow([
+            row["file"], "ok", "", row["patient_id"], row["drug"],
+            risk["risk_label"], risk["confidence_score"], risk["severity"],
+            profile["primary_gene"], profile["diplotype"], profile["phenotype"],
+            ";".join(v["rsid"] for v in profile["detected_variants"]),
+            rec["action"], rec["dosing_guidance"], ";".join(rec["alternative_drugs"]),
+            rec["monitoring_required"], rec["cpic_guideline"],
+            metrics["variants_detected"], ";".join(metrics["genes_analyzed"]), metrics["knowledge_base_version"],
+        ])
+    return out.getvalue()
+
+
+ENCODERS = {"ndjson": _ndjson_rows, "csv": _csv_rows}
+
+
+def analyze_file(path: str, drug_list: List[str], output_format: str, max_bytes: Optional[int]) -> Tuple[str, bool]:
+    """Analyze one VCF (worker side); returns (its rows, already encoded; ok)."""
+    try:
+        analysis = analyze_vcf_path(path, drug_list, max_bytes)
+    except VCFTooLargeError:
+        rows = [{"file": path, "status": "error", "error": "File exceeds size limit"}]
+    except NoVariantsError as e:
+        rows = [{"file": path, "status": "error", "error": str(e)}]
+    except (TabixError, OSError, EOFError, UnicodeDecodeError) as e:
+        rows = [{"file": path, "status": "error", "error": f"Could not read VCF: {e}"}]
+    except Exception as e:
+        # One malformed file must not stop a night-long run
+        rows = [{"file": path, "status": "error", "error": f"Analysis failed: {e}"}]
+    else:
+        timestamp = datetime.now(timezone.utc).isoformat()
+        quality_metrics = QualityMetrics(
+            vcf_parsing_success=True,
+            variants_detected=analysis.variants_detected,
+            genes_analyzed=analysis.genes_analyzed,
+            confidence_basis=CONFIDENCE_BASIS,
+            knowledge_base_version=analysis.kb_version,
+        )
+        rows = [
+            {"file": path, "status": "ok", **RiskResult(
+                patient_id=analysis.patient_id,
+                drug=drug,
+                timestamp=timestamp,
+                risk_assessment=risk,
+                pharmacogenomic_profile=profile,
+                clinical_recommendation=ClinicalRecommendation(**clinical_rec),
+                quality_metrics=quality_metrics,
+            ).model_dump()}
+            for drug, risk, profile, clinical_rec in analysis.drug_results
+        ]
+    return ENCODERS[output_format](rows), rows[0]["status"] == "ok"
+
+
+# ─── OUTPUT & RESUME ─────────────────────────────────────────────────────────
+
+def _read_progress(progress_path: str) -> Tuple[Optional[dict], int, Set[str]]:
+    """
+    (run parameters header, offset after the last completed file, completed
+    paths) from the progress log. A torn last line (the run stopped
+    mid-write) is cut off the log.
+    """
+    header, offset, done = None, 0, set()
+    if not os.path.exists(progress_path):
+        return header, offset, done
+    with open(progress_path, "r+b") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            f.truncate(complete)
+    for line in data[:complete].decode().splitlines():
+        if line.startswith("# "):
+            header = json.loads(line[2:])
+            continue
+        recorded, _, path = line.partition("\t")
+        offset = int(recorded)
+        done.add(path)
+    return header, offset, done
+
+
+def _check_resume(progress_path: str, header: Optional[dict], params: dict, resuming: bool) -> None:
+    if header is None:
+        if resuming:
+            raise RunMismatchError(f"{progress_path} has no run header; pass --overwrite to start over")
+        return
+    changed = [f"{key} {header.get(key)!r} → {value!r}" for key, value in params.items() if header.get(key) != value]
+    if changed:
+        raise RunMismatchError(
+            f"{progress_path} belongs to a run with other parameters ({'; '.join(changed)}); "
+            "pass --overwrite to start over"
+        )
+
+
+def _schedule(
+    pool: ProcessPoolExecutor, paths: Iterator[str], args: tuple, limit: int
+) -> Iterator[Tuple[str, Tuple[str, bool]]]:
+    """(path, analyze_file result) in completion order, with at most `limit` files in flight."""
+    pending: Dict[Future, str] = {}
+    for path in paths:
+        pending[pool.submit(analyze_file, path, *args)] = path
+        if len(pending) >= limit:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    for future in list(pending):
+        yield pending.pop(future), future.result()
+
+
+def run(
+    paths: List[str],
+    drug_list: List[str],
+    out: str,
+    output_format: str = "ndjson",
+    workers: int = BATCH_WORKERS,
+    max_bytes: Optional[int] = None,
+    overwrite: bool = False,
+) -> Dict[str, int]:
+    """Analyze every path not already recorded in out's progress log; returns counts."""
+    progress_path = out + ".progress"
+    if overwrite:
+        for stale in (out, progress_path):
+            if os.path.exists(stale):
+                os.remove(stale)
+    if os.path.exists(out) and os.path.getsize(out) > 0 and not os.path.exists(progress_path):
+        raise FileExistsError(f"{out} exists without a progress log; pass --overwrite to replace it")
+    params = {"format": output_format, "drugs": drug_list, "out": os.path.abspath(out), "max_bytes": max_bytes}
+    header, offset, done = _read_progress(progress_path)
+    _check_resume(progress_path, header, params, resuming=bool(done))
+
+    todo = [p for p in paths if p not in done]
+    counts = {"files": len(paths), "skipped": len(paths) - len(todo), "processed": 0, "errors": 0}
+    print(f"[BATCH] {len(todo)} of {len(paths)} files to process with {workers} workers.")
+
+    start = time.perf_counter()
+    with open(out, "a+b") as output, open(progress_path, "a") as progress:
+        if header is None:
+            progress.write(f"# {json.dumps(params)}\n")
+            progress.flush()
+        output.truncate(offset)   # drop rows of a file that was cut off mid-write
+        output.seek(offset)
+        if offset == 0 and output_format == "csv":
+            output.write((",".join(CSV_COLUMNS) + "\n").encode())
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker) as pool:
+            args = (drug_list, output_format, max_bytes)
+            for path, (rows, ok) in _schedule(pool, iter(todo), args, workers * IN_FLIGHT_PER_WORKER):
+                output.write(rows.encode())
+                output.flush()
+                progress.write(f"{output.tell()}\t{path}\n")
+                progress.flush()
+                counts["processed"] += 1
+                counts["errors"] += not ok
+                if counts["processed"] % PROGRESS_EVERY == 0:
+                    rate = counts["processed"] / (time.perf_counter() - start)
+                    print(f"[BATCH] {counts['processed']}/{len(todo)} files ({counts['errors']} errors), {rate:.1f} files/s")
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"[BATCH] Done: {counts['processed']} processed, {counts['skipped']} already done, "
+        f"{counts['errors']} errors in {elapsed:.1f}s."
+    )
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.batch", description=__doc__.split("\n")[1])
+    parser.add_argument("inputs", nargs="*", help="VCF files or directories (searched recursively)")
+    parser.add_argument("--manifest", help="text file listing VCF paths, one per line")
+    parser.add_argument("--drugs", default="ALL", help="comma-separated drug names, or ALL (default)")
+    parser.add_argument("--out", required=True, help="output file; also the resume checkpoint")
+    parser.add_argument("--format", dest="output_format", choices=FORMATS, default=None,
+                        help="output format (default: from --out extension, else ndjson)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--max-size-mb", type=float, default=0, help="skip files larger than this (0 = no limit)")
+    parser.add_argument("--overwrite", action="store_true", help="start over instead of resuming")
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.manifest:
+        parser.error("give at least one input path or --manifest")
+    try:
+        drug_list = parse_drugs(args.drugs)
+    except ValueError as e:
+        parser.error(str(e))
+    output_format = args.output_format or ("csv" if args.out.endswith(".csv") else "ndjson")
+
+    paths = discover(args.inputs, args.manifest)
+    try:
+        run(
+            paths, drug_list, args.out, output_format, max(1, args.workers),
+            int(args.max_size_mb * 1024 * 1024) or None, args.overwrite,
+        )
+    except (FileExistsError, RunMismatchError) as e:
+        print(f"[BATCH] {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
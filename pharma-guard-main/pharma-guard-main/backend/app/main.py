@@ -1,14 +1,59 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
+import asyncio
+import gc
 import os
 
-load_dotenv()
+# Local development reads backend/.env; deployments set the environment directly
+# and skip python-dotenv altogether. Must run before the routers below read config.
+ENV_FILE = os.getenv("ENV_FILE", os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
+if os.path.isfile(ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app.utils import knowledge_base
+    from app.routers.health import set_state
+    from app.routers.knowledge_base import KB_WATCH_INTERVAL, watch_knowledge_base
+    from app.services import metrics
+    from app.services.executor import get_analysis_executor
+    from app.services.explanation_cache import get_explanation_cache
+    from app.services.parse_cache import get_parse_cache
+    from app.services.pipeline import warm_up
+    knowledge_base.current()       # load (or unpickle) the KB snapshot before serving
+    # Open both caches (and purge expired SQLite rows) here, not on the event loop of a first request
+    await run_in_threadpool(get_explanation_cache)
+    await run_in_threadpool(get_parse_cache)
+    await run_in_threadpool(warm_up)   # also loads the thread-pool backend requests use
+    # Everything built so far lives for the whole process: keep it out of GC
+    # passes so collections neither rescan it nor dirty its copy-on-write pages
+    gc.freeze()
+    await get_analysis_executor().warm_up()
+    watcher = asyncio.create_task(watch_knowledge_base(KB_WATCH_INTERVAL)) if KB_WATCH_INTERVAL > 0 else None
+    flusher = asyncio.create_task(metrics.flush_periodically()) if metrics.METRICS_DIR else None
+    set_state("ready")
+    yield
+    set_state("stopping")
+    if watcher is not None:
+        watcher.cancel()
+    from app.services.executor import shutdown_analysis_executor
+    from app.services.llm_client import shutdown_llm_client
+    shutdown_analysis_executor()
+    await shutdown_llm_client()
+    if flusher is not None:
+        flusher.cancel()
+        await run_in_threadpool(metrics.flush)   # final totals; retired into retired.json once this worker exits
+
 
 app = FastAPI(
     title="PharmaGuard API",
     description="Pharmacogenomic Risk Prediction System — RIFT 2026 Hackathon",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -19,9 +64,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-from app.routers import analysis, health
+from app.services.metrics import MetricsMiddleware
+app.add_middleware(MetricsMiddleware)
+
+from app.routers import analysis, health, knowledge_base, metrics
+app.include_router(metrics.router, tags=["metrics"])
 app.include_router(health.router, prefix="/api", tags=["health"])
 app.include_router(analysis.router, prefix="/api", tags=["analysis"])
+app.include_router(knowledge_base.router, prefix="/api", tags=["knowledge base"])
 
 @app.get("/")
 async def root():
@@ -29,5 +79,7 @@ async def root():
         "service": "PharmaGuard",
         "docs": "/docs",
         "health": "/api/health",
+        "ready": "/api/ready",
+        "metrics": "/metrics",
         "analyze": "POST /api/analyze",
     }
@@ -1,6 +1,5 @@
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
 
 
 class DetectedVariant(BaseModel):
@@ -20,11 +19,18 @@ class RiskAssessment(BaseModel):
     severity: str    # none | low | moderate | high | critical
 
 
+class GeneResult(BaseModel):
+    gene: str
+    diplotype: str
+    phenotype: str
+
+
 class PharmacogenomicProfile(BaseModel):
-    primary_gene: str
+    primary_gene: str   # the gene that drove the assessment
     diplotype: str
     phenotype: str   # PM | IM | NM | RM | URM | Unknown
     detected_variants: List[DetectedVariant]
+    gene_results: List[GeneResult] = []   # every gene of a multi-gene drug
 
 
 class ClinicalRecommendation(BaseModel):
@@ -47,6 +53,7 @@ class QualityMetrics(BaseModel):
     variants_detected: int
     genes_analyzed: List[str]
     confidence_basis: str
+    knowledge_base_version: str = ""
 
 
 class AnalysisResponse(BaseModel):
@@ -63,3 +70,65 @@ class AnalysisResponse(BaseModel):
 class AnalysisRequest(BaseModel):
     drug: str
     patient_id: Optional[str] = "PATIENT_001"
+
+
+class SampleAnalysis(BaseModel):
+    sample_id: str
+    results: List[AnalysisResponse]
+
+
+class BatchFileResult(BaseModel):
+    filename: str
+    status: str      # ok | error
+    error: Optional[str] = None
+    results: List[AnalysisResponse] = []
+
+
+# ─── COMPACT SHAPE (compact=true) ────────────────────────────────────────────
+# Patient-level fields are hoisted out of the per-drug entries.
+
+class DrugResult(BaseModel):
+    drug: str
+    risk_assessment: RiskAssessment
+    pharmacogenomic_profile: PharmacogenomicProfile
+    clinical_recommendation: ClinicalRecommendation
+    llm_generated_explanation: LLMExplanation
+
+
+class CompactAnalysisResponse(BaseModel):
+    patient_id: str
+    timestamp: str
+    quality_metrics: QualityMetrics
+    results: List[DrugResult]
+
+
+class CompactBatchFileResult(BaseModel):
+    filename: str
+    status: str      # ok | error
+    error: Optional[str] = None
+    report: Optional[CompactAnalysisResponse] = None
+
+
+# ─── STREAMING (/analyze/stream) ─────────────────────────────────────────────
+# One event per NDJSON line / SSE message. "risk" events carry each drug's
+# AnalysisResponse without its explanation; "explanation" events fill it in
+# (matched by index) as the explanations arrive.
+
+class RiskResult(BaseModel):
+    patient_id: str
+    drug: str
+    timestamp: str
+    risk_assessment: RiskAssessment
+    pharmacogenomic_profile: PharmacogenomicProfile
+    clinical_recommendation: ClinicalRecommendation
+    quality_metrics: QualityMetrics
+
+
+class StreamEvent(BaseModel):
+    event: str                     # risk | explanation | done | error
+    index: Optional[int] = None    # position of the drug in the request
+    drug: Optional[str] = None
+    result: Optional[RiskResult] = None
+    llm_generated_explanation: Optional[LLMExplanation] = None
+    count: Optional[int] = None    # done: number of drugs
+    detail: Optional[str] = None   # error
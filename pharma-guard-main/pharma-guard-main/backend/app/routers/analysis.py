@@ -1,105 +1,599 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import List
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, TypeVar, Union
 from datetime import datetime, timezone
-import json
-
-from app.models.schemas import AnalysisResponse, QualityMetrics
-from app.services.vcf_parser import parse_vcf
-from app.services.pgx_engine import analyze_drug, get_mechanism
-from app.services.llm_service import generate_explanation
-from app.utils.knowledge_base import (
-    SUPPORTED_DRUGS, DRUG_GENE_MAP, get_clinical_rec, SUPPORTED_GENES
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from pydantic import TypeAdapter
+
+from app.models.schemas import (
+    AnalysisResponse, BatchFileResult, ClinicalRecommendation, CompactAnalysisResponse,
+    CompactBatchFileResult, DrugResult, LLMExplanation, PharmacogenomicProfile, QualityMetrics,
+    RiskAssessment, RiskResult, SampleAnalysis, StreamEvent
 )
+from app.services.vcf_parser import DEFAULT_CHUNK_SIZE, VCFTooLargeError
+from app.services.pipeline import (
+    CONFIDENCE_BASIS, VCF_EXTENSIONS, FileAnalysis, NoVariantsError, ParsedVCF, analyze_cohort_path, analyze_cohort_stream, analyze_parsed,
+    analyze_vcf_path, analyze_vcf_stream
+)
+from app.services import metrics
+from app.services.parse_cache import cache_key, content_hash, get_parse_cache
+from app.services.executor import ExecutorSaturated, get_analysis_executor
+from app.services.tabix import TabixError
+from app.services.llm_service import generate_explanations, iter_explanations
+from app.utils import knowledge_base
+from app.utils.knowledge_base import KnowledgeBase
 
 router = APIRouter()
 
+# Upload cap in MB; set MAX_VCF_SIZE_MB=0 to disable. Parsing is streamed, so
+# memory use does not grow with this limit.
+MAX_VCF_SIZE_MB = float(os.getenv("MAX_VCF_SIZE_MB", "5"))
+MAX_VCF_BYTES = int(MAX_VCF_SIZE_MB * 1024 * 1024)
 
-@router.post("/analyze", response_model=List[AnalysisResponse])
-async def analyze(
-    vcf_file: UploadFile = File(...),
-    drugs: str = Form(...),
-):
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "500"))
+PANEL_ALL = "ALL"   # drugs=ALL analyzes every supported drug
+VCF_HASH_HEADER = "X-VCF-Hash"
+VCF_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+# Responses are assembled from already-validated models, so they are written
+# straight to JSON by pydantic-core instead of being re-validated through
+# response_model (which still documents the shape).
+_FULL = TypeAdapter(List[AnalysisResponse])
+_COMPACT = TypeAdapter(CompactAnalysisResponse)
+_FULL_SAMPLES = TypeAdapter(List[SampleAnalysis])
+_COMPACT_SAMPLES = TypeAdapter(List[CompactAnalysisResponse])
+_FULL_BATCH = TypeAdapter(List[BatchFileResult])
+_COMPACT_BATCH = TypeAdapter(List[CompactBatchFileResult])
+
+T = TypeVar("T")
+
+
+def _validate_upload(vcf_file: UploadFile, index_file: Optional[UploadFile]) -> None:
+    if not vcf_file.filename.endswith(VCF_EXTENSIONS):
+        raise HTTPException(400, "File must be a .vcf, .vcf.gz or .vcf.bgz file")
+    if index_file is not None and not index_file.filename.endswith(".tbi"):
+        raise HTTPException(400, "Index must be a .tbi tabix index")
+
+    if MAX_VCF_BYTES and vcf_file.size is not None and vcf_file.size > MAX_VCF_BYTES:
+        raise HTTPException(400, f"File exceeds {MAX_VCF_SIZE_MB:g}MB limit")
+
+
+def _observe_upload(request: Request) -> None:
+    """Upload stage: request start (MetricsMiddleware) → endpoint start."""
+    started_at = request.scope.get("state", {}).get("started_at")
+    if started_at is not None:
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started_at, stage="upload")
+
+
+def _spool_upload(upload: UploadFile, path: str) -> None:
+    """Copy an upload to disk in chunks so worker processes can open it."""
+    upload.file.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(upload.file, out, DEFAULT_CHUNK_SIZE)
+
+
+async def _run_analysis(
+    stream_job: Callable[..., T],
+    path_job: Callable[..., T],
+    vcf_file: UploadFile,
+    index_file: Optional[UploadFile],
+    drug_list: List[str],
+    kb: KnowledgeBase,
+) -> T:
     """
-    Analyze a VCF file for pharmacogenomic risk across one or more drugs.
-    
-    - vcf_file: .vcf file upload
-    - drugs: comma-separated drug names (e.g. "CODEINE,WARFARIN")
+    Run parsing + PGx analysis in the analysis executor, off the event loop.
+    Thread workers read the upload stream directly; process workers get a
+    spooled copy on disk. Maps saturation to 503 and read errors to 400/422.
     """
-    # ── 1. Read & validate VCF ────────────────────────────────────────────────
-    if not vcf_file.filename.endswith(".vcf"):
-        raise HTTPException(400, "File must be a .vcf file")
+    executor = get_analysis_executor()
+    max_bytes = MAX_VCF_BYTES or None
+    try:
+        if executor.kind == "process":
+            with tempfile.TemporaryDirectory(prefix="pharmaguard_") as workdir:
+                path = os.path.join(workdir, "upload.vcf")
+                await run_in_threadpool(_spool_upload, vcf_file, path)
+                if index_file is not None:
+                    await run_in_threadpool(_spool_upload, index_file, path + ".tbi")
+                return await executor.run(path_job, path, drug_list, max_bytes, kb.fingerprint)
+
+        vcf_file.file.seek(0)
+        index = index_file.file if index_file is not None else None
+        return await executor.run(stream_job, vcf_file.file, drug_list, max_bytes, index, kb.fingerprint)
+    except ExecutorSaturated as e:
+        raise _saturated(e)
+    except NoVariantsError as e:
+        raise HTTPException(422, str(e))
+    except VCFTooLargeError:
+        raise HTTPException(400, f"File exceeds {MAX_VCF_SIZE_MB:g}MB limit")
+    except (TabixError, OSError, EOFError) as e:
+        raise HTTPException(400, f"Could not read compressed VCF or index: {e}")
+
+
+async def _analyze_parsed(parsed: ParsedVCF, drug_list: List[str]) -> FileAnalysis:
+    """analyze_parsed for a parse-cache hit, in the analysis executor like a fresh parse."""
+    try:
+        return await get_analysis_executor().run(analyze_parsed, parsed, drug_list)
+    except ExecutorSaturated as e:
+        raise _saturated(e)
 
-    raw = await vcf_file.read()
-    if len(raw) > 5 * 1024 * 1024:
-        raise HTTPException(400, "File exceeds 5MB limit")
 
-    content = raw.decode("utf-8", errors="replace")
-    variants, patient_id, parse_success = parse_vcf(content)
+def _saturated(e: ExecutorSaturated) -> HTTPException:
+    return HTTPException(503, "Analysis queue is full, retry later", headers={"Retry-After": str(e.retry_after)})
 
-    if not parse_success:
-        raise HTTPException(422, "Could not parse any pharmacogenomic variants from VCF file. Check file format.")
 
-    # ── 2. Parse drugs list ───────────────────────────────────────────────────
+def _hash_headers(vcf_hash: Optional[str]) -> Dict[str, str]:
+    return {VCF_HASH_HEADER: vcf_hash} if vcf_hash else {}
+
+
+def _parse_drug_list(drugs: str, kb: KnowledgeBase) -> List[str]:
     drug_list = [d.strip().upper() for d in drugs.split(",") if d.strip()]
     if not drug_list:
         raise HTTPException(400, "At least one drug name required")
+    if drug_list == [PANEL_ALL]:
+        return list(kb.supported_drugs)
 
-    unsupported = [d for d in drug_list if d not in SUPPORTED_DRUGS]
+    unsupported = [d for d in drug_list if d not in kb.drug_gene_map]
     if unsupported:
-        raise HTTPException(400, f"Unsupported drug(s): {unsupported}. Supported: {SUPPORTED_DRUGS}")
+        raise HTTPException(400, f"Unsupported drug(s): {unsupported}. Supported: {kb.supported_drugs}")
+    return drug_list
 
-    # ── 3. Analyze each drug ──────────────────────────────────────────────────
-    results = []
-    genes_analyzed = list(set(v.gene for v in variants if v.gene in SUPPORTED_GENES))
 
-    for drug in drug_list:
-        risk, profile = analyze_drug(drug, variants)
-        clinical_rec = get_clinical_rec(drug, profile.phenotype)
+def _explanation_request(
+    drug: str, risk: RiskAssessment, profile: PharmacogenomicProfile, clinical_rec: dict
+) -> Dict[str, str]:
+    return dict(
+        drug=drug,
+        gene=profile.primary_gene,
+        phenotype=profile.phenotype,
+        diplotype=profile.diplotype,
+        risk_label=risk.risk_label,
+        severity=risk.severity,
+        dosing_guidance=clinical_rec["dosing_guidance"],
+    )
 
-        # ── 4. LLM explanation ────────────────────────────────────────────────
-        explanation = await generate_explanation(
-            drug=drug,
-            gene=profile.primary_gene,
-            phenotype=profile.phenotype,
-            diplotype=profile.diplotype,
-            risk_label=risk.risk_label,
-            severity=risk.severity,
-            dosing_guidance=clinical_rec["dosing_guidance"],
+
+def _explanation_key(
+    drug: str, risk: RiskAssessment, profile: PharmacogenomicProfile, clinical_rec: dict
+) -> Tuple[str, ...]:
+    """Everything the explanation is generated from; equal keys may share one explanation."""
+    return tuple(_explanation_request(drug, risk, profile, clinical_rec).values())
+
+
+async def _explain_all(
+    items: List[Tuple[str, RiskAssessment, PharmacogenomicProfile, dict]]
+) -> List[LLMExplanation]:
+    """Explanations for (drug, risk, profile, clinical_rec) items, generated concurrently."""
+    with metrics.timed("explain"):
+        return await generate_explanations([_explanation_request(*item) for item in items])
+
+
+# Every part below is already a validated model or a KB dict, so the response
+# objects are built with model_construct (no re-validation).
+
+def _clinical_recommendation(clinical_rec: dict) -> ClinicalRecommendation:
+    return ClinicalRecommendation.model_construct(
+        action=clinical_rec["action"],
+        dosing_guidance=clinical_rec["dosing_guidance"],
+        alternative_drugs=clinical_rec["alternative_drugs"],
+        monitoring_required=clinical_rec["monitoring_required"],
+        cpic_guideline=clinical_rec["cpic_guideline"],
+    )
+
+
+def _drug_result(
+    drug: str,
+    risk: RiskAssessment,
+    profile: PharmacogenomicProfile,
+    clinical_rec: dict,
+    explanation: LLMExplanation,
+) -> DrugResult:
+    return DrugResult.model_construct(
+        drug=drug,
+        risk_assessment=risk,
+        pharmacogenomic_profile=profile,
+        clinical_recommendation=_clinical_recommendation(clinical_rec),
+        llm_generated_explanation=explanation,
+    )
+
+
+def _quality_metrics(variants_detected: int, genes_analyzed: List[str], kb_version: str) -> QualityMetrics:
+    return QualityMetrics.model_construct(
+        vcf_parsing_success=True,
+        variants_detected=variants_detected,
+        genes_analyzed=genes_analyzed,
+        confidence_basis=CONFIDENCE_BASIS,
+        knowledge_base_version=kb_version,
+    )
+
+
+def _report(patient_id: str, quality_metrics: QualityMetrics, results: List[DrugResult]) -> CompactAnalysisResponse:
+    return CompactAnalysisResponse.model_construct(
+        patient_id=patient_id,
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        quality_metrics=quality_metrics,
+        results=results,
+    )
+
+
+def _expand(report: CompactAnalysisResponse) -> List[AnalysisResponse]:
+    """Compact report → the full per-drug shape (patient fields repeated per drug)."""
+    return [
+        AnalysisResponse.model_construct(
+            patient_id=report.patient_id,
+            drug=r.drug,
+            timestamp=report.timestamp,
+            risk_assessment=r.risk_assessment,
+            pharmacogenomic_profile=r.pharmacogenomic_profile,
+            clinical_recommendation=r.clinical_recommendation,
+            llm_generated_explanation=r.llm_generated_explanation,
+            quality_metrics=report.quality_metrics,
         )
+        for r in report.results
+    ]
+
+
+def _json(adapter: TypeAdapter, content, headers: Optional[Dict[str, str]] = None) -> Response:
+    with metrics.timed("serialize"):
+        body = adapter.dump_json(content)
+    return Response(body, media_type="application/json", headers=headers)
+
 
-        # ── 5. Build response ─────────────────────────────────────────────────
-        from app.models.schemas import ClinicalRecommendation
-        result = AnalysisResponse(
-            patient_id=patient_id,
+def _report_response(
+    report: CompactAnalysisResponse, compact: bool, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    if compact:
+        return _json(_COMPACT, report, headers)
+    return _json(_FULL, _expand(report), headers)
+
+
+async def _file_report(analysis: FileAnalysis) -> CompactAnalysisResponse:
+    """Explanations (all drugs concurrently) and the report for one file."""
+    items = analysis.drug_results
+    explanations = await _explain_all(items)
+    return _report(
+        analysis.patient_id,
+        _quality_metrics(analysis.variants_detected, analysis.genes_analyzed, analysis.kb_version),
+        [_drug_result(*item, explanation) for item, explanation in zip(items, explanations)],
+    )
+
+
+def _encode_event(event: StreamEvent, stream_format: str) -> bytes:
+    data = event.model_dump_json(exclude_none=True)
+    if stream_format == "sse":
+        return f"event: {event.event}\ndata: {data}\n\n".encode()
+    return (data + "\n").encode()
+
+
+async def _stream_events(analysis: FileAnalysis, stream_format: str) -> AsyncIterator[bytes]:
+    """
+    Every drug's risk result at once, then each explanation as it arrives
+    (cache hits first, then in completion order), then "done".
+    """
+    items = analysis.drug_results
+    quality_metrics = _quality_metrics(analysis.variants_detected, analysis.genes_analyzed, analysis.kb_version)
+    timestamp = datetime.now(timezone.utc).isoformat()
+    for i, (drug, risk, profile, clinical_rec) in enumerate(items):
+        result = RiskResult.model_construct(
+            patient_id=analysis.patient_id,
             drug=drug,
-            timestamp=datetime.now(timezone.utc).isoformat(),
+            timestamp=timestamp,
             risk_assessment=risk,
             pharmacogenomic_profile=profile,
-            clinical_recommendation=ClinicalRecommendation(
-                action=clinical_rec["action"],
-                dosing_guidance=clinical_rec["dosing_guidance"],
-                alternative_drugs=clinical_rec["alternative_drugs"],
-                monitoring_required=clinical_rec["monitoring_required"],
-                cpic_guideline=clinical_rec["cpic_guideline"],
-            ),
-            llm_generated_explanation=explanation,
-            quality_metrics=QualityMetrics(
-                vcf_parsing_success=parse_success,
-                variants_detected=len(variants),
-                genes_analyzed=genes_analyzed,
-                confidence_basis="CPIC guidelines + pharmacogenomic star-allele database",
-            ),
+            clinical_recommendation=_clinical_recommendation(clinical_rec),
+            quality_metrics=quality_metrics,
+        )
+        yield _encode_event(StreamEvent(event="risk", index=i, drug=drug, result=result), stream_format)
+
+    explain_started = time.perf_counter()
+    try:
+        async for i, explanation in iter_explanations([_explanation_request(*item) for item in items]):
+            yield _encode_event(
+                StreamEvent(event="explanation", index=i, drug=items[i][0], llm_generated_explanation=explanation),
+                stream_format,
+            )
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - explain_started, stage="explain")
+    except Exception as e:
+        # Headers are already sent: report in-band and end the stream
+        print(f"[STREAM] Explanation generation failed ({e}).")
+        yield _encode_event(StreamEvent(event="error", detail="Explanation generation failed"), stream_format)
+        return
+    yield _encode_event(StreamEvent(event="done", count=len(items)), stream_format)
+
+
+async def _analyze_upload(
+    vcf_file: UploadFile, index_file: Optional[UploadFile], drug_list: List[str], kb: KnowledgeBase
+) -> Tuple[FileAnalysis, Optional[str]]:
+    """
+    Parse (analysis executor) unless the parse cache has the file; returns
+    (analysis, vcf_hash). Admission is checked before the file is hashed, so
+    an overloaded server does no work for a request it will reject. Indexed
+    uploads skip the cache (and hash None): they are read by region only.
+    """
+    try:
+        get_analysis_executor().admit()
+    except ExecutorSaturated as e:
+        raise _saturated(e)
+    if index_file is not None:
+        return await _run_analysis(
+            analyze_vcf_stream, analyze_vcf_path, vcf_file, index_file, drug_list, kb
+        ), None
+
+    with metrics.timed("hash"):
+        vcf_hash = await run_in_threadpool(content_hash, vcf_file.file)
+    key = cache_key(vcf_hash, kb.fingerprint)
+    cache = get_parse_cache()
+    parsed = await run_in_threadpool(cache.get, key)
+    if parsed is not None:
+        return await _analyze_parsed(parsed, drug_list), vcf_hash
+
+    analysis = await _run_analysis(
+        analyze_vcf_stream, analyze_vcf_path, vcf_file, index_file, drug_list, kb
+    )
+    await run_in_threadpool(cache.put, key, analysis.parsed, len(analysis.parsed.variants))
+    return analysis, vcf_hash
+
+
+@router.post("/analyze", response_model=Union[List[AnalysisResponse], CompactAnalysisResponse])
+async def analyze(
+    request: Request,
+    vcf_file: UploadFile = File(...),
+    drugs: str = Form(...),
+    index_file: Optional[UploadFile] = File(None),
+    compact: bool = Form(False),
+):
+    """
+    Analyze a VCF file for pharmacogenomic risk across one or more drugs.
+
+    The parse is cached under the SHA-256 of the file (returned in the
+    X-VCF-Hash header): re-uploading the same file skips parsing, and
+    /analyze/cached accepts just the hash with a new drug list. Uploads with
+    an index_file are not hashed or cached.
+
+    - vcf_file: .vcf, .vcf.gz or .vcf.bgz file upload
+    - drugs: comma-separated drug names (e.g. "CODEINE,WARFARIN"), or "ALL"
+      for a full-panel report; per-gene results are computed once and shared
+    - index_file: optional .tbi tabix index for a bgzipped vcf_file; only the
+      pharmacogene regions are then read
+    - compact: return one CompactAnalysisResponse with patient_id, timestamp
+      and quality_metrics hoisted out of the per-drug entries
+    """
+    # ── 1. Validate upload & drugs list ───────────────────────────────────────
+    _observe_upload(request)
+    kb = knowledge_base.current()
+    _validate_upload(vcf_file, index_file)
+    drug_list = _parse_drug_list(drugs, kb)
+
+    # ── 2. Parse VCF (analysis executor) unless cached, analyze each drug ────
+    analysis, vcf_hash = await _analyze_upload(vcf_file, index_file, drug_list, kb)
+
+    # ── 3. LLM explanations (all drugs concurrently) & response ───────────────
+    report = await _file_report(analysis)
+    return _report_response(report, compact, _hash_headers(vcf_hash))
+
+
+@router.post("/analyze/stream", response_class=StreamingResponse)
+async def analyze_stream(
+    request: Request,
+    vcf_file: UploadFile = File(...),
+    drugs: str = Form(...),
+    index_file: Optional[UploadFile] = File(None),
+    stream_format: str = Form("ndjson", alias="format"),
+):
+    """
+    /analyze as a stream of StreamEvent objects, as NDJSON (format=ndjson,
+    default) or server-sent events (format=sse). A "risk" event per drug
+    (the AnalysisResponse minus its explanation) is sent as soon as parsing
+    is done, then an "explanation" event per drug as each one arrives, then
+    "done". Upload and parse errors are still plain HTTP errors.
+    """
+    _observe_upload(request)
+    kb = knowledge_base.current()
+    stream_format = stream_format.strip().lower()
+    if stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(400, f"format must be one of {sorted(STREAM_MEDIA_TYPES)}")
+    _validate_upload(vcf_file, index_file)
+    drug_list = _parse_drug_list(drugs, kb)
+
+    analysis, vcf_hash = await _analyze_upload(vcf_file, index_file, drug_list, kb)
+    headers = {**_hash_headers(vcf_hash), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(
+        _stream_events(analysis, stream_format), media_type=STREAM_MEDIA_TYPES[stream_format], headers=headers
+    )
+
+
+@router.post("/analyze/cached", response_model=Union[List[AnalysisResponse], CompactAnalysisResponse])
+async def analyze_cached(
+    vcf_hash: str = Form(...),
+    drugs: str = Form(...),
+    compact: bool = Form(False),
+):
+    """
+    Analyze a previously uploaded VCF again, by the SHA-256 hex digest of its
+    bytes (the X-VCF-Hash header of /analyze), without re-uploading it.
+    Returns 404 once the parse has been evicted, expired or invalidated by a
+    knowledge-base reload; upload the file again then.
+    """
+    kb = knowledge_base.current()
+    vcf_hash = vcf_hash.strip().lower()
+    if not VCF_HASH_RE.match(vcf_hash):
+        raise HTTPException(400, "vcf_hash must be a SHA-256 hex digest")
+    drug_list = _parse_drug_list(drugs, kb)
+
+    parsed = await run_in_threadpool(get_parse_cache().get, cache_key(vcf_hash, kb.fingerprint))
+    if parsed is None:
+        raise HTTPException(404, "No cached parse for this vcf_hash; upload the file to /api/analyze")
+    report = await _file_report(await _analyze_parsed(parsed, drug_list))
+    return _report_response(report, compact, {VCF_HASH_HEADER: vcf_hash})
+
+
+@router.post("/analyze/cohort", response_model=Union[List[SampleAnalysis], List[CompactAnalysisResponse]])
+async def analyze_cohort(
+    request: Request,
+    vcf_file: UploadFile = File(...),
+    drugs: str = Form(...),
+    index_file: Optional[UploadFile] = File(None),
+    compact: bool = Form(False),
+):
+    """
+    Analyze every sample of a multi-sample (joint-called) VCF.
+
+    Genotypes of the pharmacogene records are parsed into a per-sample dosage
+    matrix and diplotypes are called for all samples in one batched pass.
+    Explanations are generated once per distinct explanation request (drug,
+    gene, diplotype, phenotype, risk, severity, dosing guidance).
+    With compact=true each sample is one CompactAnalysisResponse.
+    """
+    _observe_upload(request)
+    kb = knowledge_base.current()
+    _validate_upload(vcf_file, index_file)
+    drug_list = _parse_drug_list(drugs, kb)
+    cohort = await _run_analysis(
+        analyze_cohort_stream, analyze_cohort_path, vcf_file, index_file, drug_list, kb
+    )
+
+    # One explanation per distinct outcome, generated concurrently
+    distinct = {}
+    for drug in drug_list:
+        for risk, profile, clinical_rec in cohort.drug_results[drug]:
+            key = _explanation_key(drug, risk, profile, clinical_rec)
+            if key not in distinct:
+                distinct[key] = (drug, risk, profile, clinical_rec)
+    explanations = dict(zip(distinct, await _explain_all(list(distinct.values()))))
+
+    reports = []
+    for j, sample_id in enumerate(cohort.samples):
+        quality_metrics = _quality_metrics(cohort.carried_counts[j], cohort.genes_analyzed, cohort.kb_version)
+        results = []
+        for drug in drug_list:
+            risk, profile, clinical_rec = cohort.drug_results[drug][j]
+            key = _explanation_key(drug, risk, profile, clinical_rec)
+            results.append(_drug_result(drug, risk, profile, clinical_rec, explanations[key]))
+        reports.append(_report(sample_id, quality_metrics, results))
+
+    if compact:
+        return _json(_COMPACT_SAMPLES, reports)
+    return _json(_FULL_SAMPLES, [
+        SampleAnalysis.model_construct(sample_id=report.patient_id, results=_expand(report)) for report in reports
+    ])
+
+
+async def _analyze_batch_file(
+    position: int,
+    upload: UploadFile,
+    index_file: Optional[UploadFile],
+    drug_list: List[str],
+    workdir: str,
+    kb: KnowledgeBase,
+    slots: asyncio.Semaphore,
+) -> CompactBatchFileResult:
+    """
+    Analyze one file of a batch in the analysis executor; errors stay
+    per-file, except ExecutorSaturated, which fails the whole batch.
+    """
+    filename = upload.filename
+    try:
+        _validate_upload(upload, index_file)
+        async with slots:
+            path = os.path.join(workdir, f"{position}.vcf")
+            await run_in_threadpool(_spool_upload, upload, path)
+            if index_file is not None:
+                await run_in_threadpool(_spool_upload, index_file, path + ".tbi")
+            analysis = await get_analysis_executor().run(
+                analyze_vcf_path, path, drug_list, MAX_VCF_BYTES or None, kb.fingerprint
+            )
+    except ExecutorSaturated:
+        raise
+    except HTTPException as e:
+        return CompactBatchFileResult(filename=filename, status="error", error=e.detail)
+    except VCFTooLargeError:
+        return CompactBatchFileResult(
+            filename=filename, status="error", error=f"File exceeds {MAX_VCF_SIZE_MB:g}MB limit"
+        )
+    except NoVariantsError as e:
+        return CompactBatchFileResult(filename=filename, status="error", error=str(e))
+    except (TabixError, OSError, EOFError) as e:
+        return CompactBatchFileResult(
+            filename=filename, status="error", error=f"Could not read compressed VCF or index: {e}"
         )
-        results.append(result)
+    except Exception as e:
+        # e.g. a crashed worker: fail this file, not the batch
+        return CompactBatchFileResult(filename=filename, status="error", error=f"Analysis failed: {e}")
+
+    return CompactBatchFileResult.model_construct(
+        filename=filename, status="ok", error=None, report=await _file_report(analysis)
+    )
+
+
+@router.post("/analyze/batch", response_model=Union[List[BatchFileResult], List[CompactBatchFileResult]])
+async def analyze_batch(
+    request: Request,
+    vcf_files: List[UploadFile] = File(...),
+    drugs: str = Form(...),
+    index_files: Optional[List[UploadFile]] = File(None),
+    compact: bool = Form(False),
+):
+    """
+    Analyze many VCF files against one shared drug list.
+
+    - vcf_files: one or more .vcf / .vcf.gz / .vcf.bgz uploads
+    - drugs: comma-separated drug names applied to every file
+    - index_files: optional .tbi indexes, matched to VCFs by name ("<vcf name>.tbi")
 
-    return results
+    Files are parsed and analyzed in the analysis executor, at most one per
+    worker at a time, so a large batch never fills the admission queue on its
+    own; if the queue is full anyway the batch is answered 503 + Retry-After.
+    Each file gets its own result entry; a bad file is reported with status
+    "error" instead of failing the whole batch. With compact=true each entry
+    carries one CompactAnalysisResponse ("report") instead of per-drug "results".
+    """
+    _observe_upload(request)
+    kb = knowledge_base.current()
+    drug_list = _parse_drug_list(drugs, kb)
+    if len(vcf_files) > MAX_BATCH_FILES:
+        raise HTTPException(400, f"Batch exceeds {MAX_BATCH_FILES} file limit")
+
+    indexes: Dict[str, UploadFile] = {
+        f.filename[:-len(".tbi")]: f for f in (index_files or []) if f.filename.endswith(".tbi")
+    }
+    slots = asyncio.Semaphore(get_analysis_executor().max_workers)
+    with tempfile.TemporaryDirectory(prefix="pharmaguard_batch_") as workdir:
+        jobs = [
+            asyncio.ensure_future(
+                _analyze_batch_file(i, upload, indexes.get(upload.filename), drug_list, workdir, kb, slots)
+            )
+            for i, upload in enumerate(vcf_files)
+        ]
+        try:
+            files = await asyncio.gather(*jobs)
+        except ExecutorSaturated as e:
+            for job in jobs:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+            raise _saturated(e)
+    if compact:
+        return _json(_COMPACT_BATCH, files)
+    return _json(_FULL_BATCH, [
+        BatchFileResult.model_construct(
+            filename=f.filename, status=f.status, error=f.error,
+            results=_expand(f.report) if f.report is not None else [],
+        )
+        for f in files
+    ])
 
 
 @router.get("/drugs")
 async def list_drugs():
-    return {"supported_drugs": SUPPORTED_DRUGS}
+    return {"supported_drugs": knowledge_base.current().supported_drugs}
 
 
 @router.get("/genes")
 async def list_genes():
-    return {"supported_genes": SUPPORTED_GENES}
+    return {"supported_genes": knowledge_base.current().supported_genes}
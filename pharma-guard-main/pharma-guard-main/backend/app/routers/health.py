@@ -1,8 +1,23 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
 from datetime import datetime
 
+from app.services.executor import get_analysis_executor
+from app.services.explanation_cache import get_explanation_cache
+from app.services.llm_client import get_llm_client
+from app.services.parse_cache import get_parse_cache
+from app.utils import knowledge_base
+
 router = APIRouter()
 
+# "starting" until the lifespan hook has loaded and warmed everything, "stopping" once shutdown begins
+_state = "starting"
+
+
+def set_state(state: str) -> None:
+    global _state
+    _state = state
+
+
 @router.get("/health")
 async def health():
     return {
@@ -10,4 +25,24 @@ async def health():
         "service": "PharmaGuard API",
         "timestamp": datetime.utcnow().isoformat(),
         "version": "1.0.0",
+        "analysis_executor": get_analysis_executor().stats(),
+        "explanation_cache": get_explanation_cache().stats(),
+        "parse_cache": get_parse_cache().stats(),
+        "llm_client": get_llm_client().stats(),
+        "knowledge_base": knowledge_base.current().info(),
     }
+
+
+@router.get("/live")
+async def live():
+    """Liveness: the process is up and serving the event loop. Never touches app state."""
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+async def ready(response: Response):
+    """Readiness: 200 once start-up has finished, 503 while starting or shutting down."""
+    if _state != "ready":
+        response.status_code = 503
+        return {"status": _state}
+    return {"status": "ready", "knowledge_base_version": knowledge_base.current().version}
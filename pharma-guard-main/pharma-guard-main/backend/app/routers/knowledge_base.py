@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
+import asyncio
+import os
+
+from app.utils import knowledge_base
+
+router = APIRouter()
+
+# POST /kb/reload requires a matching X-Admin-Token header; unset disables the endpoint
+KB_ADMIN_TOKEN = os.getenv("KB_ADMIN_TOKEN", "")
+# Seconds between data-file checks by the background watcher; 0 disables it
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "0"))
+
+
+@router.get("/kb")
+async def kb_info():
+    return knowledge_base.current().info()
+
+
+@router.post("/kb/reload")
+async def kb_reload(x_admin_token: Optional[str] = Header(None)):
+    """
+    Reload the knowledge base from its data files and swap it in atomically.
+    Requests already running finish on the snapshot they started with.
+    Only this worker reloads; use KB_WATCH_INTERVAL, or SIGHUP to the gunicorn
+    master, to refresh every worker. Disabled unless KB_ADMIN_TOKEN is set.
+    """
+    if not KB_ADMIN_TOKEN:
+        raise HTTPException(403, "Knowledge base reload is disabled (KB_ADMIN_TOKEN is not set)")
+    if x_admin_token != KB_ADMIN_TOKEN:
+        raise HTTPException(403, "Invalid admin token")
+    try:
+        kb, changed = await run_in_threadpool(knowledge_base.reload)
+    except (OSError, ValueError, KeyError) as e:
+        # Broken data files: keep serving the current snapshot
+        raise HTTPException(400, f"Knowledge base reload failed: {e}")
+    return {"reloaded": changed, **kb.info()}
+
+
+async def watch_knowledge_base(interval: float) -> None:
+    """Reload whenever the data files' fingerprint changes (runs until cancelled)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            fingerprint = await run_in_threadpool(knowledge_base.data_fingerprint)
+            if fingerprint != knowledge_base.current().fingerprint:
+                await run_in_threadpool(knowledge_base.reload)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[KB] Reload failed, keeping current snapshot ({e}).")
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import Iterable
+
+from app.services import metrics
+from app.services.executor import get_analysis_executor
+from app.services.explanation_cache import get_explanation_cache
+from app.services.llm_client import get_llm_client
+from app.services.parse_cache import get_parse_cache
+from app.utils import knowledge_base
+
+router = APIRouter()
+
+CIRCUIT_STATES = ("closed", "half-open", "open")
+
+
+def _component_metrics() -> Iterable[metrics.Collected]:
+    """Values the executor, caches, LLM client and KB already track, read at scrape time."""
+    executor = get_analysis_executor().stats()
+    yield "pharmaguard_executor_jobs", "gauge", "Analysis-executor jobs by state.", [
+        ({"state": "running"}, executor["running"]), ({"state": "queued"}, executor["queued"]),
+    ]
+    yield "pharmaguard_executor_jobs_total", "counter", "Analysis-executor jobs by outcome.", [
+        ({"outcome": "completed"}, executor["completed"]), ({"outcome": "rejected"}, executor["rejected"]),
+    ]
+
+    lookups, entries = [], []
+    for name, cache in (("explanation", get_explanation_cache()), ("parse", get_parse_cache())):
+        stats = cache.stats()
+        for result in ("memory_hits", "disk_hits", "misses"):
+            lookups.append(({"cache": name, "result": result}, stats[result]))
+        entries.append(({"cache": name}, stats["entries"]))
+    yield "pharmaguard_cache_lookups_total", "counter", "Cache lookups by cache and result.", lookups
+    yield "pharmaguard_cache_entries", "gauge", "Entries held in the in-process cache tier.", entries
+
+    client = get_llm_client().stats()
+    yield "pharmaguard_llm_http_requests_total", "counter", "HTTP attempts to the chat API by kind.", [
+        ({"kind": "request"}, client["requests"]), ({"kind": "retry"}, client["retries"]),
+    ]
+    state = client["circuit"]["state"]
+    yield "pharmaguard_llm_circuit_state", "gauge", "LLM circuit breaker state (1 = current).", [
+        ({"state": s}, 1 if s == state else 0) for s in CIRCUIT_STATES
+    ]
+
+    kb = knowledge_base.current()
+    yield "pharmaguard_knowledge_base_info", "gauge", "Active knowledge-base snapshot.", [
+        ({"version": kb.version, "fingerprint": kb.fingerprint}, 1),
+    ]
+
+
+metrics.register_collector(_component_metrics)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus text exposition of this worker's metrics (or all workers', with METRICS_DIR)."""
+    # With METRICS_DIR a scrape reads every worker's file: keep that off the event loop
+    return Response(await run_in_threadpool(metrics.render), media_type=metrics.CONTENT_TYPE)
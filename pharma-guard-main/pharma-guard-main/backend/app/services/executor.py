@@ -0,0 +1,151 @@
+"""
+Analysis executor — runs CPU-bound parsing / PGx work off the asyncio event loop.
+
+A thread or process pool with a bounded admission queue: once every worker is
+busy and the queue is full, new work is rejected with ExecutorSaturated so the
+API can answer 503 + Retry-After instead of letting latency grow unbounded.
+"""
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+import asyncio
+import os
+import threading
+import time
+
+from app.services import metrics
+
+ANALYSIS_EXECUTOR = os.getenv("ANALYSIS_EXECUTOR", "thread")          # thread | process
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "0")) or os.cpu_count() or 1
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "32"))      # waiting jobs beyond busy workers
+ANALYSIS_RETRY_AFTER = int(os.getenv("ANALYSIS_RETRY_AFTER", "2"))     # seconds, sent when saturated
+
+_executor: Optional["BoundedExecutor"] = None
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised when all workers are busy and the admission queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Analysis queue is full")
+        self.retry_after = retry_after
+
+
+def _timed_call(fn: Callable, args: Tuple, enqueued_at: float) -> Tuple[float, Any]:
+    # Runs inside the worker: report how long the job waited for a free worker
+    return time.time() - enqueued_at, fn(*args)
+
+
+def _noop() -> None:
+    pass
+
+
+def _captured_call(fn: Callable, args: Tuple, enqueued_at: float) -> Tuple[float, Any, list]:
+    # Process workers: ship the job's metric updates back to the parent
+    metrics.start_capture()
+    try:
+        waited, result = _timed_call(fn, args, enqueued_at)
+    finally:
+        captured = metrics.end_capture()
+    return waited, result, captured
+
+
+class BoundedExecutor:
+    """Thread/process pool with bounded admission and queue-wait statistics."""
+
+    def __init__(self, kind: str, max_workers: int, max_queue: int, retry_after: int = 2):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._pool: Executor = (
+            ProcessPoolExecutor(max_workers=max_workers) if kind == "process"
+            else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        )
+        self.pending = 0              # submitted and not yet finished by the pool
+        self._lock = threading.Lock()  # pending is released from pool threads
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def admit(self) -> None:
+        """Raise ExecutorSaturated if a job submitted now would be rejected."""
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise ExecutorSaturated(self.retry_after)
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        """
+        Run fn(*args) in the pool. Raises ExecutorSaturated immediately when
+        max_workers + max_queue jobs are already in flight. A job counts as
+        in flight until the pool is done with it: cancelling the awaiting
+        request drops a queued job, but one already running keeps its slot
+        until it finishes.
+        """
+        self.admit()
+        call = _captured_call if self.kind == "process" else _timed_call
+        future = self._pool.submit(call, fn, args, time.time())
+        with self._lock:
+            self.pending += 1
+        future.add_done_callback(self._release)   # from a pool thread when done (now, if already done)
+        if self.kind == "process":
+            waited, result, captured = await asyncio.wrap_future(future)
+            metrics.replay(captured)
+        else:
+            waited, result = await asyncio.wrap_future(future)
+
+        metrics.STAGE_SECONDS.observe(waited, stage="queue_wait")
+        self.completed += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return result
+
+    def _release(self, future: Future) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    async def warm_up(self) -> None:
+        """
+        Start every worker now instead of on the first request. Process
+        workers are forked from this process, so they inherit the loaded
+        knowledge base copy-on-write rather than each loading their own
+        (fork is the default start method on Linux).
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _noop) for _ in range(self.max_workers)))
+
+    def stats(self) -> dict:
+        running = min(self.pending, self.max_workers)
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "running": running,
+            "queued": self.pending - running,
+            "queue_capacity": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": round(self.wait_total / self.completed, 6) if self.completed else 0.0,
+            "max_wait_seconds": round(self.wait_max, 6),
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_analysis_executor() -> BoundedExecutor:
+    """Process-wide executor configured from ANALYSIS_* environment variables."""
+    global _executor
+    if _executor is None:
+        _executor = BoundedExecutor(
+            ANALYSIS_EXECUTOR, ANALYSIS_WORKERS, ANALYSIS_QUEUE_SIZE, ANALYSIS_RETRY_AFTER
+        )
+    return _executor
+
+
+def shutdown_analysis_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
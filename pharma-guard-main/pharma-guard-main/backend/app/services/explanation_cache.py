@@ -0,0 +1,188 @@
+"""
+Explanation Cache — content-addressed store for clinical explanations.
+
+Explanations depend only on what the prompt is built from (drug, gene,
+diplotype, phenotype, risk label, severity, dosing guidance) and on the model
+that wrote them, a tiny domain, so they are cached in two tiers:
+  1. an in-process LRU (EXPLANATION_CACHE_SIZE entries)
+  2. an optional SQLite file (EXPLANATION_CACHE_PATH) shared by all workers
+
+Entries expire after EXPLANATION_CACHE_TTL seconds (0 = never). The model
+version is part of the key, so changing LLM_MODEL or PROMPT_VERSION makes
+old entries unreachable; they age out of the LRU and are purged from SQLite.
+
+Lookups and stores may wait on another worker's SQLite lock (up to the 5s
+busy timeout), so async callers run them in a thread.
+"""
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.models.schemas import LLMExplanation
+
+EXPLANATION_CACHE_SIZE = int(os.getenv("EXPLANATION_CACHE_SIZE", "1024"))
+EXPLANATION_CACHE_PATH = os.getenv("EXPLANATION_CACHE_PATH", "")        # empty = memory only
+EXPLANATION_CACHE_TTL = float(os.getenv("EXPLANATION_CACHE_TTL", "604800"))  # 7 days
+
+_cache: Optional["ExplanationCache"] = None
+
+
+def cache_key(
+    model_version: str, drug: str, gene: str, diplotype: str, phenotype: str, risk_label: str,
+    severity: str, dosing_guidance: str,
+) -> str:
+    # Severity and dosing guidance are part of the prompt: a combination rule can
+    # change them for the same single-gene outcome (CYP2C9 PM with VKORC1 NM vs PM)
+    raw = "\x1f".join((model_version, drug, gene, diplotype, phenotype, risk_label, severity, dosing_guidance))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ExplanationCache:
+    """Two-tier (LRU + optional SQLite) explanation cache with TTL and counters."""
+
+    def __init__(self, max_entries: int = 1024, path: str = "", ttl: float = 0.0):
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl = ttl
+        self._lru: "OrderedDict[str, Tuple[float, LLMExplanation]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.expired = 0
+
+    # ─── SQLITE TIER ──────────────────────────────────────────────────────────
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        # Connections must not cross a fork; reopen in each worker process
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS explanations "
+                "(key TEXT PRIMARY KEY, created_at REAL NOT NULL, payload TEXT NOT NULL)"
+            )
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, LLMExplanation]]:
+        db = self._connection()
+        if db is None:
+            return None
+        try:
+            row = db.execute(
+                "SELECT created_at, payload FROM explanations WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[CACHE] SQLite read failed ({e}).")
+            return None
+        if row is None:
+            return None
+        return row[0], LLMExplanation(**json.loads(row[1]))
+
+    def _disk_put(self, key: str, created_at: float, explanation: LLMExplanation) -> None:
+        db = self._connection()
+        if db is None:
+            return
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO explanations (key, created_at, payload) VALUES (?, ?, ?)",
+                (key, created_at, json.dumps(explanation.model_dump())),
+            )
+        except sqlite3.Error as e:
+            print(f"[CACHE] SQLite write failed ({e}).")
+
+    # ─── PUBLIC API ───────────────────────────────────────────────────────────
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return not self.ttl or time.time() - created_at < self.ttl
+
+    def get(self, key: str) -> Optional[LLMExplanation]:
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if self._is_fresh(entry[0]):
+                    self._lru.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._lru[key]
+                self.expired += 1
+
+            entry = self._disk_get(key)
+            if entry is not None and self._is_fresh(entry[0]):
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry[1]
+            if entry is not None:
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def get_many(self, keys: List[str]) -> List[Optional[LLMExplanation]]:
+        """get() for each key, for one thread hop per request instead of one per drug."""
+        return [self.get(key) for key in keys]
+
+    def put(self, key: str, explanation: LLMExplanation) -> None:
+        entry = (time.time(), explanation)
+        with self._lock:
+            self._remember(key, entry)
+            self._disk_put(key, *entry)
+            self.stores += 1
+
+    def _remember(self, key: str, entry: Tuple[float, LLMExplanation]) -> None:
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        """Drop expired SQLite rows (including those of retired model versions)."""
+        db = self._connection()
+        if db is None or not self.ttl:
+            return 0
+        with self._lock:
+            return db.execute(
+                "DELETE FROM explanations WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+            db = self._connection()
+            if db is not None:
+                db.execute("DELETE FROM explanations")
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "capacity": self.max_entries,
+            "persistent": bool(self.path),
+            "ttl_seconds": self.ttl,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "expired": self.expired,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def get_explanation_cache() -> ExplanationCache:
+    """Process-wide cache configured from EXPLANATION_CACHE_* environment variables."""
+    global _cache
+    if _cache is None:
+        _cache = ExplanationCache(EXPLANATION_CACHE_SIZE, EXPLANATION_CACHE_PATH, EXPLANATION_CACHE_TTL)
+        _cache.purge_expired()
+    return _cache
@@ -0,0 +1,244 @@
+"""
+LLM Client — long-lived, pooled HTTP client for the OpenAI chat completions API.
+
+One httpx.AsyncClient (keep-alive pool of LLM_POOL_SIZE connections) is shared
+by every explanation for the lifetime of the app. Transient failures (network
+errors, 429, 5xx) are retried with full-jitter exponential backoff, and a
+circuit breaker stops calling the API for LLM_BREAKER_COOLDOWN seconds after
+LLM_BREAKER_THRESHOLD consecutive failed calls so requests fall back to
+rule-based text immediately instead of failing slowly.
+
+Callers pass their total time budget; it is split over the attempts, so a
+hung first attempt still leaves time for the retries. LLM_READ_TIMEOUT caps
+a single attempt.
+
+httpx (and the async backends it pulls in) is imported when the first call
+is made, not at start-up: without an OPENAI_API_KEY it is never needed.
+"""
+from typing import TYPE_CHECKING, List, Optional
+import asyncio
+import os
+import random
+import time
+
+if TYPE_CHECKING:
+    import httpx
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "3"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.25"))    # seconds
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "2"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_client: Optional["LLMClient"] = None
+
+
+class LLMError(RuntimeError):
+    """Raised when a chat completion could not be obtained."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling the API while the circuit breaker is open."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"LLM circuit open, retrying in {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    closed → open after `threshold` consecutive failures; open → half-open
+    once `cooldown` seconds have passed. Half-open lets a single trial call
+    through, and everyone else fails fast until it ends; its success closes
+    the circuit, its failure re-opens it for another cooldown.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self.short_circuited = 0
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def check(self) -> bool:
+        """
+        Raise CircuitOpenError if calls are currently blocked. Returns True if
+        the caller is the half-open trial; it must call end_trial() when done.
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "open" or self.trial_in_flight:
+            self.short_circuited += 1
+            raise CircuitOpenError(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)))
+        self.trial_in_flight = True
+        return True
+
+    def end_trial(self) -> None:
+        # Also on cancellation: a trial that never reported must not block the circuit
+        self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half-open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                print(f"[LLM] Circuit opened after {self.failures} failures, cooling down {self.cooldown}s.")
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "short_circuited": self.short_circuited,
+            "trial_in_flight": self.trial_in_flight,
+        }
+
+
+class LLMClient:
+    """Pooled chat-completions client with retry and a circuit breaker."""
+
+    def __init__(
+        self,
+        base_url: str = OPENAI_BASE_URL,
+        pool_size: int = LLM_POOL_SIZE,
+        connect_timeout: float = LLM_CONNECT_TIMEOUT,
+        read_timeout: float = LLM_READ_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+        self.requests = 0
+        self.retries = 0
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._http: Optional["httpx.AsyncClient"] = None
+
+    def _http_client(self) -> "httpx.AsyncClient":
+        if self._http is None:
+            import httpx
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            )
+        return self._http
+
+    def _backoff(self, attempt: int, response: Optional["httpx.Response"]) -> float:
+        if response is not None and response.headers.get("retry-after", "").isdigit():
+            return min(float(response.headers["retry-after"]), self.backoff_max)
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _attempt_timeout(self, deadline: Optional[float], attempts_left: int) -> Optional[float]:
+        # An equal share of the remaining budget, so later attempts still get time
+        if deadline is None:
+            return None
+        return min(self.read_timeout, (deadline - time.monotonic()) / attempts_left)
+
+    async def chat(
+        self, api_key: str, model: str, messages: List[dict], temperature: float, max_tokens: int,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Return the first choice's message content, retrying transient failures.
+        timeout is the whole call's budget in seconds (all attempts and backoff).
+        """
+        trial = self.breaker.check()
+        try:
+            return await self._chat(api_key, model, messages, temperature, max_tokens, timeout)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    async def _chat(
+        self, api_key: str, model: str, messages: List[dict], temperature: float, max_tokens: int,
+        timeout: Optional[float],
+    ) -> str:
+        import httpx
+        http = self._http_client()
+        payload = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        headers = {"Authorization": f"Bearer {api_key}"}
+        deadline = time.monotonic() + timeout if timeout else None
+
+        error = "no attempt made"
+        for attempt in range(self.max_retries + 1):
+            response = None
+            attempt_timeout = self._attempt_timeout(deadline, self.max_retries + 1 - attempt)
+            self.requests += 1
+            try:
+                response = await http.post(
+                    "/chat/completions", json=payload, headers=headers,
+                    timeout=httpx.USE_CLIENT_DEFAULT if attempt_timeout is None else httpx.Timeout(
+                        attempt_timeout, connect=min(self.connect_timeout, attempt_timeout)
+                    ),
+                )
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response.json()["choices"][0]["message"]["content"]
+                error = f"HTTP {response.status_code}"
+                if response.status_code not in RETRYABLE_STATUS:
+                    break
+            if attempt == self.max_retries:
+                break
+            delay = self._backoff(attempt, response)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                break   # no budget left for another attempt
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+        self.breaker.record_failure()
+        raise LLMError(f"Chat completion failed ({error})")
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "retries": self.retries, "circuit": self.breaker.stats()}
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+
+
+def get_llm_client() -> LLMClient:
+    """Process-wide client configured from LLM_* / OPENAI_BASE_URL environment variables."""
+    global _client
+    if _client is None:
+        _client = LLMClient()
+    return _client
+
+
+async def shutdown_llm_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
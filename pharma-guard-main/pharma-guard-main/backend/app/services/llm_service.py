@@ -5,10 +5,45 @@ Strategy:
   1. If OPENAI_API_KEY is set in environment → use OpenAI GPT-4o
   2. Otherwise → generate rich rule-based explanations from knowledge_base
      (no API key required, still clinically meaningful)
+
+Explanations for several drugs are generated concurrently (LLM_CONCURRENCY)
+and every OpenAI call is bounded by LLM_TIMEOUT seconds; a slow or failed
+call falls back to the rule-based text for that drug only. With
+LLM_BATCH_MODE enabled, all drugs of a patient share one structured prompt.
+iter_explanations yields each explanation as soon as it is ready, for
+streaming responses.
+Results are served from the explanation cache when possible (see
+explanation_cache); the model version is part of the cache key. OpenAI is
+called through the shared, pooled client in llm_client, whose circuit
+breaker short-circuits to rule-based text while the API is failing.
 """
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+import asyncio
+import json
 import os
+from fastapi.concurrency import run_in_threadpool
 from app.models.schemas import LLMExplanation
-from app.utils.knowledge_base import MECHANISMS, RISK_RULES
+from app.services import metrics
+from app.services.explanation_cache import cache_key, get_explanation_cache
+from app.services.llm_client import CircuitOpenError, get_llm_client
+from app.utils import knowledge_base
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "6"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "8"))
+LLM_BATCH_MODE = os.getenv("LLM_BATCH_MODE", "false").lower() in ("1", "true", "yes")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+# Bump when prompts or rule-based templates change to invalidate cached text
+PROMPT_VERSION = "2"
+RULE_BASED_VERSION = "2"
+
+PHENOTYPE_LABELS = {
+    "PM": "Poor Metabolizer", "IM": "Intermediate Metabolizer",
+    "NM": "Normal Metabolizer", "URM": "Ultra-Rapid Metabolizer",
+    "RM": "Rapid Metabolizer", "Unknown": "Undetermined Metabolizer",
+}
+
+EXPLANATION_FIELDS = ("summary", "mechanism", "variant_impact", "clinical_significance")
 
 
 def _rule_based_explanation(
@@ -18,20 +53,13 @@ def _rule_based_explanation(
     Generate a structured clinical explanation using embedded knowledge.
     No API key needed.
     """
-    mechanism = MECHANISMS.get(gene, f"{gene} plays a role in drug metabolism.")
-    drug_rules = RISK_RULES.get(drug, {})
-    rule = drug_rules.get(phenotype, drug_rules.get("Unknown", ("Unknown", 0.5, "moderate", "")))
+    kb = knowledge_base.current()
+    mechanism = kb.mechanisms.get(gene, f"{gene} plays a role in drug metabolism.")
+    gene_rules = kb.risk_rules.get(drug, {}).get(gene, {})
+    rule = gene_rules.get(phenotype, gene_rules.get("Unknown", ("Unknown", 0.5, "moderate", "")))
     _, _, _, rule_detail = rule
 
-    phenotype_labels = {
-        "PM": "Poor Metabolizer",
-        "IM": "Intermediate Metabolizer",
-        "NM": "Normal Metabolizer",
-        "URM": "Ultra-Rapid Metabolizer",
-        "RM": "Rapid Metabolizer",
-        "Unknown": "Undetermined Metabolizer",
-    }
-    phenotype_long = phenotype_labels.get(phenotype, phenotype)
+    phenotype_long = PHENOTYPE_LABELS.get(phenotype, phenotype)
 
     summary = (
         f"This patient carries the {diplotype} diplotype in {gene}, "
@@ -73,21 +101,234 @@ async def generate_explanation(
     dosing_guidance: str,
 ) -> LLMExplanation:
     """
-    Try OpenAI first, fall back to rule-based explanation.
+    Serve from the explanation cache, else try OpenAI first and fall back to
+    the rule-based explanation.
     """
-    api_key = os.getenv("OPENAI_API_KEY", "")
+    kwargs = dict(
+        drug=drug, gene=gene, phenotype=phenotype, diplotype=diplotype,
+        risk_label=risk_label, severity=severity, dosing_guidance=dosing_guidance,
+    )
+    return (await generate_explanations([kwargs], concurrency=1))[0]
+
+
+async def generate_explanations(
+    requests: List[Dict[str, str]], concurrency: Optional[int] = None
+) -> List[LLMExplanation]:
+    """
+    Explain each kwargs dict (generate_explanation arguments). Cached entries
+    are returned directly; misses run concurrently, at most `concurrency`
+    (default LLM_CONCURRENCY) in flight, and are cached unless they are a
+    fallback after an OpenAI failure. Results keep input order.
+    In LLM_BATCH_MODE, misses are answered by one prompt per round of
+    distinct drugs (see _generate_batched).
+    """
+    results: List[Optional[LLMExplanation]] = [None] * len(requests)
+    async for i, explanation in iter_explanations(requests, concurrency):
+        results[i] = explanation
+    return results
+
+
+async def iter_explanations(
+    requests: List[Dict[str, str]], concurrency: Optional[int] = None
+) -> AsyncIterator[Tuple[int, LLMExplanation]]:
+    """
+    generate_explanations as (index, explanation) pairs in the order they
+    become available: cache hits first, then misses as they complete (a whole
+    round at a time in LLM_BATCH_MODE). Closing the iterator early cancels
+    the calls still in flight.
+    """
+    api_key = _openai_api_key()
+    cache = get_explanation_cache()
+    version = _model_version(api_key)
+    keys = [
+        cache_key(
+            version, r["drug"], r["gene"], r["diplotype"], r["phenotype"], r["risk_label"],
+            r["severity"], r["dosing_guidance"],
+        )
+        for r in requests
+    ]
+    missing = []
+    # The SQLite tier can block on another worker's lock: never on the event loop
+    found = await run_in_threadpool(cache.get_many, keys)
+    for i, cached in enumerate(found):
+        if cached is None:
+            missing.append(i)
+        else:
+            metrics.EXPLANATIONS.inc(source="cache")
+            yield i, cached
+    if not missing:
+        return
 
-    if api_key and api_key not in ("", "your_openai_api_key_here", "sk-..."):
+    semaphore = asyncio.Semaphore(concurrency or LLM_CONCURRENCY)
+    pending = [requests[i] for i in missing]
+    if LLM_BATCH_MODE and api_key and len(pending) > 1:
+        jobs = _generate_batched(api_key, pending, semaphore)
+    else:
+        async def bounded(k: int) -> List[Tuple[int, Tuple[LLMExplanation, bool]]]:
+            async with semaphore:
+                return [(k, await _generate_uncached(api_key, pending[k]))]
+
+        jobs = [bounded(k) for k in range(len(pending))]
+
+    tasks = [asyncio.ensure_future(job) for job in jobs]
+    try:
+        for done in asyncio.as_completed(tasks):
+            for k, (explanation, cacheable) in await done:
+                if cacheable:
+                    await run_in_threadpool(cache.put, keys[missing[k]], explanation)
+                metrics.EXPLANATIONS.inc(source=("llm" if cacheable else "fallback") if api_key else "rule_based")
+                yield missing[k], explanation
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _generate_uncached(api_key: str, kwargs: Dict[str, str]) -> Tuple[LLMExplanation, bool]:
+    """Returns (explanation, cacheable); fallbacks after an OpenAI failure are not cacheable."""
+    if api_key:
+        drug = kwargs["drug"]
         try:
-            return await _openai_explanation(
-                api_key, drug, gene, phenotype, diplotype,
-                risk_label, severity, dosing_guidance
-            )
+            with metrics.LLM_IN_FLIGHT.track():
+                explanation = await asyncio.wait_for(
+                    _openai_explanation(
+                        api_key, drug, kwargs["gene"], kwargs["phenotype"], kwargs["diplotype"],
+                        kwargs["risk_label"], kwargs["severity"], kwargs["dosing_guidance"]
+                    ),
+                    timeout=LLM_TIMEOUT,
+                )
+            metrics.LLM_CALLS.inc(mode="single", outcome="ok")
+            return explanation, True
+        except CircuitOpenError:
+            metrics.LLM_CALLS.inc(mode="single", outcome="circuit_open")
+        except asyncio.TimeoutError:
+            metrics.LLM_CALLS.inc(mode="single", outcome="timeout")
+            get_llm_client().breaker.record_failure()
+            print(f"[LLM] OpenAI call for {drug} timed out after {LLM_TIMEOUT}s, falling back to rule-based.")
         except Exception as e:
+            metrics.LLM_CALLS.inc(mode="single", outcome="error")
             print(f"[LLM] OpenAI call failed ({e}), falling back to rule-based.")
+        return _rule_based_for(kwargs), False
+
+    # No key — rule-based text is the intended output
+    return _rule_based_for(kwargs), True
+
+
+def _model_version(api_key: str) -> str:
+    # Explanations quote knowledge-base rules, so a KB change invalidates them too
+    kb = knowledge_base.current().fingerprint
+    if api_key:
+        return f"{LLM_MODEL}/prompt-{PROMPT_VERSION}/kb-{kb}"
+    return f"rule-based/{RULE_BASED_VERSION}/kb-{kb}"
+
+
+def _openai_api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if api_key in ("your_openai_api_key_here", "sk-..."):
+        return ""
+    return api_key
+
+
+def _rule_based_for(kwargs: Dict[str, str]) -> LLMExplanation:
+    return _rule_based_explanation(
+        kwargs["drug"], kwargs["gene"], kwargs["phenotype"], kwargs["diplotype"], kwargs["risk_label"]
+    )
+
+
+def _generate_batched(
+    api_key: str, requests: List[Dict[str, str]], semaphore: asyncio.Semaphore
+) -> List[Awaitable[List[Tuple[int, Tuple[LLMExplanation, bool]]]]]:
+    """
+    Answer many explanation requests with one structured prompt per round;
+    returns one awaitable per round giving (request index, (explanation,
+    cacheable)) for its members. The response is keyed by drug, so each round
+    holds distinct drugs (cohort runs can have several outcomes per drug).
+    Drugs missing from a response, or a failed/timed-out round, fall back to
+    (uncacheable) rule-based text.
+    """
+    rounds: List[List[int]] = []
+    for i, kwargs in enumerate(requests):
+        for members in rounds:
+            if all(requests[j]["drug"] != kwargs["drug"] for j in members):
+                members.append(i)
+                break
+        else:
+            rounds.append([i])
+
+    async def run_round(members: List[int]) -> List[Tuple[int, Tuple[LLMExplanation, bool]]]:
+        batch = [requests[i] for i in members]
+        explained: Dict[str, LLMExplanation] = {}
+        async with semaphore:
+            try:
+                with metrics.LLM_IN_FLIGHT.track():
+                    explained = await asyncio.wait_for(
+                        _openai_batch_explanation(api_key, batch), timeout=LLM_TIMEOUT
+                    )
+                metrics.LLM_CALLS.inc(mode="batch", outcome="ok")
+            except CircuitOpenError:
+                metrics.LLM_CALLS.inc(mode="batch", outcome="circuit_open")
+            except asyncio.TimeoutError:
+                metrics.LLM_CALLS.inc(mode="batch", outcome="timeout")
+                get_llm_client().breaker.record_failure()
+                print(f"[LLM] Batched OpenAI call timed out after {LLM_TIMEOUT}s, falling back to rule-based.")
+            except Exception as e:
+                metrics.LLM_CALLS.inc(mode="batch", outcome="error")
+                print(f"[LLM] Batched OpenAI call failed ({e}), falling back to rule-based.")
+        results = []
+        for i in members:
+            explanation = explained.get(requests[i]["drug"])
+            results.append((i, (explanation, True) if explanation else (_rule_based_for(requests[i]), False)))
+        return results
+
+    return [run_round(members) for members in rounds]
+
+
+def _parse_explanation(data: dict) -> LLMExplanation:
+    return LLMExplanation(**{field: str(data.get(field, "")) for field in EXPLANATION_FIELDS})
+
+
+def _load_json_reply(text: str) -> dict:
+    # Strip markdown fences if present
+    text = text.strip().replace("```json", "").replace("```", "").strip()
+    return json.loads(text)
+
+
+async def _openai_batch_explanation(api_key: str, requests: List[Dict[str, str]]) -> Dict[str, LLMExplanation]:
+    """One chat completion explaining every (drug, gene, diplotype, phenotype) of a patient."""
+    rows = "\n".join(
+        f"- {r['drug']}: gene {r['gene']}, diplotype {r['diplotype']}, "
+        f"phenotype {PHENOTYPE_LABELS.get(r['phenotype'], r['phenotype'])} ({r['phenotype']}), "
+        f"risk {r['risk_label']}, severity {r['severity']}, dosing guidance: {r['dosing_guidance']}"
+        for r in requests
+    )
+    prompt = f"""You are a clinical pharmacogenomics specialist. Generate a structured clinical explanation for each drug below.
+
+Patient Drug Assessments:
+{rows}
+
+Respond ONLY with valid JSON (no markdown, no extra text): one object keyed by the exact drug name, each value of the form
+{{
+  "summary": "2-3 sentence plain-language summary for the prescribing physician",
+  "mechanism": "Biological mechanism explaining how this gene variant affects drug metabolism (1-2 sentences)",
+  "variant_impact": "Specific impact of this diplotype on the drug's pharmacokinetics (1-2 sentences)",
+  "clinical_significance": "Clinical significance and what action the physician should take (1-2 sentences)"
+}}"""
+
+    content = await get_llm_client().chat(
+        api_key,
+        model=LLM_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.3,
+        max_tokens=400 * len(requests),
+        timeout=LLM_TIMEOUT,
+    )
 
-    # No key or failure — use rule-based
-    return _rule_based_explanation(drug, gene, phenotype, diplotype, risk_label)
+    data = _load_json_reply(content)
+    drugs = {r["drug"] for r in requests}
+    return {
+        drug: _parse_explanation(entry)
+        for drug, entry in data.items()
+        if drug in drugs and isinstance(entry, dict)
+    }
 
 
 async def _openai_explanation(
@@ -95,24 +336,13 @@ async def _openai_explanation(
     drug: str, gene: str, phenotype: str, diplotype: str,
     risk_label: str, severity: str, dosing_guidance: str
 ) -> LLMExplanation:
-    from openai import AsyncOpenAI
-    import json
-
-    client = AsyncOpenAI(api_key=api_key)
-
-    phenotype_labels = {
-        "PM": "Poor Metabolizer", "IM": "Intermediate Metabolizer",
-        "NM": "Normal Metabolizer", "URM": "Ultra-Rapid Metabolizer",
-        "RM": "Rapid Metabolizer", "Unknown": "Undetermined Metabolizer",
-    }
-
     prompt = f"""You are a clinical pharmacogenomics specialist. Generate a structured clinical explanation.
 
 Patient Data:
 - Drug: {drug}
 - Gene: {gene}
 - Diplotype: {diplotype}
-- Phenotype: {phenotype_labels.get(phenotype, phenotype)} ({phenotype})
+- Phenotype: {PHENOTYPE_LABELS.get(phenotype, phenotype)} ({phenotype})
 - Risk Label: {risk_label}
 - Severity: {severity}
 - Dosing Guidance: {dosing_guidance}
@@ -125,21 +355,13 @@ Respond ONLY with valid JSON (no markdown, no extra text):
   "clinical_significance": "Clinical significance and what action the physician should take (1-2 sentences)"
 }}"""
 
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini",
+    content = await get_llm_client().chat(
+        api_key,
+        model=LLM_MODEL,
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3,
         max_tokens=500,
+        timeout=LLM_TIMEOUT,
     )
 
-    text = response.choices[0].message.content.strip()
-    # Strip markdown fences if present
-    text = text.replace("```json", "").replace("```", "").strip()
-    data = json.loads(text)
-
-    return LLMExplanation(
-        summary=data.get("summary", ""),
-        mechanism=data.get("mechanism", ""),
-        variant_impact=data.get("variant_impact", ""),
-        clinical_significance=data.get("clinical_significance", ""),
-    )
+    return _parse_explanation(_load_json_reply(content))
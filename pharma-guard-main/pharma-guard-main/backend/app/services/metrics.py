@@ -0,0 +1,479 @@
+"""
+Metrics — in-process counters, gauges and histograms, rendered in the
+Prometheus text exposition format by GET /metrics (routers/metrics.py).
+
+Plain Python with one lock per metric; an observation is a bisect into the
+bucket bounds and a few additions, cheap enough to leave on in production.
+
+Stage timings (pharmaguard_stage_duration_seconds{stage=...}):
+  upload      request start → endpoint start (body receive + multipart parse)
+  hash        SHA-256 of the upload (parse-cache key)
+  queue_wait  waiting for a free analysis-executor worker
+  parse       VCF parsing and per-gene diplotype calls
+  analyze     drug assessment off the gene calls
+  explain     LLM / rule-based explanations for every drug of a request
+  serialize   response encoding
+
+Work run in analysis-executor *processes* is recorded in the worker between
+start_capture() and end_capture() and replayed in the parent, so thread and
+process mode report the same series. Values other components already keep
+(executor queue, cache hit counters, circuit state) are read at scrape time
+through register_collector instead of being counted twice.
+
+Several server processes (gunicorn workers) behind one socket are
+aggregated through METRICS_DIR: each writes its series to <pid>.json there
+(every METRICS_FLUSH_INTERVAL seconds and on each scrape), and whichever
+worker answers /metrics sums the counters and histograms of all of them.
+When a worker exits, the gunicorn master calls retire(pid), which folds its
+counters and histograms into retired.json and deletes its file, so totals
+never drop when a worker is replaced, the directory holds one file per live
+worker, and a reused pid never inherits an old file. Gauges and collector
+values describe one process, so they are reported per live worker with a
+worker="<pid>" label. Reading and writing the files is blocking I/O; async
+callers run render() and flush() in a thread. Without METRICS_DIR /metrics
+covers only the process that answers it.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import asyncio
+import json
+import os
+import threading
+import time
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")                  # shared by a server's workers; empty = this process
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+RETIRED_FILE = "retired.json"   # in METRICS_DIR: summed series of workers that have exited
+
+# Seconds; spans cached lookups (sub-ms) to LLM round trips and large uploads
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = Tuple[str, ...]
+# (name, type, help, [(labels, value), ...]) as returned by a collector
+Collected = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+_registry: List["_Metric"] = []
+_by_name: Dict[str, "_Metric"] = {}
+_collectors: List[Callable[[], Iterable[Collected]]] = []
+_captured: Optional[List[Tuple[str, LabelKey, float]]] = None
+_flush_lock = threading.Lock()   # a scrape thread and the periodic flusher share <pid>.json.tmp
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+        _by_name[name] = self
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _record(self, value: float, labels: Dict[str, str]) -> None:
+        key = self._key(labels)
+        if _captured is not None:
+            _captured.append((self.name, key, value))
+        else:
+            self._apply(key, value)
+
+    def _apply(self, key: LabelKey, value: float) -> None:
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[LabelKey, object]:
+        raise NotImplementedError
+
+    def merge(self, snapshots: Iterable[Dict[LabelKey, object]]) -> Dict[LabelKey, object]:
+        raise NotImplementedError
+
+    def samples(self, values: Optional[Dict[LabelKey, object]] = None) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, values: Optional[Dict[LabelKey, object]] = None) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples(values)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._record(amount, labels)
+
+    def _apply(self, key: LabelKey, value: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def snapshot(self) -> Dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, snapshots: Iterable[Dict[LabelKey, float]]) -> Dict[LabelKey, float]:
+        merged: Dict[LabelKey, float] = {}
+        for values in snapshots:
+            for key, value in values.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def samples(self, values: Optional[Dict[LabelKey, float]] = None) -> List[str]:
+        items = sorted((self.snapshot() if values is None else values).items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(Counter):
+    """Up/down value; never captured (worker-side gauges mean nothing to the parent)."""
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._apply(self._key(labels), amount)
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self._apply(self._key(labels), -amount)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, List[float]] = {}   # per-bucket counts..., +Inf count, sum
+
+    def observe(self, value: float, **labels: str) -> None:
+        self._record(value, labels)
+
+    def _apply(self, key: LabelKey, value: float) -> None:
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return int(sum(series[:-1])) if series else 0
+
+    def snapshot(self) -> Dict[LabelKey, List[float]]:
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def merge(self, snapshots: Iterable[Dict[LabelKey, List[float]]]) -> Dict[LabelKey, List[float]]:
+        merged: Dict[LabelKey, List[float]] = {}
+        for values in snapshots:
+            for key, series in values.items():
+                total = merged.get(key)
+                merged[key] = list(series) if total is None else [a + b for a, b in zip(total, series)]
+        return merged
+
+    def samples(self, values: Optional[Dict[LabelKey, List[float]]] = None) -> List[str]:
+        items = sorted((self.snapshot() if values is None else values).items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# ─── METRICS ─────────────────────────────────────────────────────────────────
+
+HTTP_REQUESTS = Counter(
+    "pharmaguard_http_requests_total", "HTTP requests by endpoint, method and status.",
+    ("endpoint", "method", "status"),
+)
+HTTP_SECONDS = Histogram(
+    "pharmaguard_http_request_duration_seconds", "HTTP request latency, including streamed bodies.", ("endpoint",)
+)
+HTTP_IN_FLIGHT = Gauge("pharmaguard_http_requests_in_flight", "HTTP requests being served.")
+STAGE_SECONDS = Histogram(
+    "pharmaguard_stage_duration_seconds", "Time spent per analysis stage (see app/services/metrics.py).", ("stage",)
+)
+VARIANTS_PARSED = Counter("pharmaguard_variants_parsed_total", "Pharmacogene variants retained from VCF records.")
+RECORDS_SKIPPED = Counter(
+    "pharmaguard_vcf_records_skipped_total",
+    "VCF data records not retained: off_target (outside pharmacogene loci), malformed, unresolved.",
+    ("reason",),
+)
+DRUG_ASSESSMENTS = Counter("pharmaguard_drug_assessments_total", "Per-drug risk assessments computed.")
+LLM_CALLS = Counter(
+    "pharmaguard_llm_calls_total", "OpenAI explanation calls by mode (single | batch) and outcome.", ("mode", "outcome")
+)
+LLM_IN_FLIGHT = Gauge("pharmaguard_llm_calls_in_flight", "OpenAI explanation calls awaiting a reply.")
+EXPLANATIONS = Counter(
+    "pharmaguard_explanations_total",
+    "Explanations served by source: cache, llm, rule_based (no API key), fallback (rule-based after an LLM failure).",
+    ("source",),
+)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Observe the duration of the block as pharmaguard_stage_duration_seconds{stage}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+# ─── WORKER CAPTURE ──────────────────────────────────────────────────────────
+
+def start_capture() -> None:
+    """Buffer counter/histogram updates instead of applying them (single-threaded workers only)."""
+    global _captured
+    _captured = []
+
+
+def end_capture() -> List[Tuple[str, LabelKey, float]]:
+    global _captured
+    captured, _captured = _captured or [], None
+    return captured
+
+
+def replay(captured: Iterable[Tuple[str, LabelKey, float]]) -> None:
+    for name, key, value in captured:
+        _by_name[name]._apply(key, value)
+
+
+# ─── EXPOSITION ──────────────────────────────────────────────────────────────
+
+def register_collector(collector: Callable[[], Iterable[Collected]]) -> None:
+    """Add a callable producing metrics at scrape time."""
+    _collectors.append(collector)
+
+
+def _local_gauges() -> List[Collected]:
+    """Registry gauges and collector output: values that describe this process only."""
+    collected: List[Collected] = [
+        (m.name, m.kind, m.help, [(dict(zip(m.labels, key)), v) for key, v in sorted(m.snapshot().items())])
+        for m in _registry if isinstance(m, Gauge)
+    ]
+    for collector in _collectors:
+        collected.extend(collector())
+    return collected
+
+
+def _render_collected(collected: Iterable[Collected]) -> List[str]:
+    lines: List[str] = []
+    for name, kind, help, values in collected:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in values:
+            lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return lines
+
+
+def render() -> str:
+    if METRICS_DIR:
+        return _render_shared()
+    lines: List[str] = []
+    for metric in _registry:
+        if not isinstance(metric, Gauge):
+            lines.extend(metric.render())
+    lines.extend(_render_collected(_local_gauges()))
+    return "\n".join(lines) + "\n"
+
+
+# ─── MULTI-PROCESS ───────────────────────────────────────────────────────────
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def flush() -> None:
+    """Write this process's series to METRICS_DIR for the other workers' scrapes."""
+    if not METRICS_DIR:
+        return
+    data = {
+        "pid": os.getpid(),
+        "series": {
+            m.name: [[list(key), value] for key, value in m.snapshot().items()]
+            for m in _registry if not isinstance(m, Gauge)
+        },
+        "gauges": _local_gauges(),
+    }
+    with _flush_lock:
+        _write_snapshot(_snapshot_path(os.getpid()), data)
+
+
+def _write_snapshot(path: str, data: dict) -> None:
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)   # atomic: a concurrent scrape never reads a partial file
+    except OSError as e:
+        print(f"[METRICS] Could not write {path} ({e}).")
+
+
+async def flush_periodically(interval: float = METRICS_FLUSH_INTERVAL) -> None:
+    """Keep this worker's METRICS_DIR file current (runs until cancelled)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        await loop.run_in_executor(None, flush)
+
+
+def retire(pid: int) -> None:
+    """
+    Fold an exited worker's counters and histograms into RETIRED_FILE and
+    remove its <pid>.json. Called by the gunicorn master (child_exit), one
+    worker at a time, so RETIRED_FILE has a single writer.
+    """
+    if not METRICS_DIR:
+        return
+    path = _snapshot_path(pid)
+    try:
+        with open(path) as f:
+            worker = json.load(f)
+    except FileNotFoundError:
+        return   # exited before its first flush
+    except (OSError, ValueError) as e:
+        print(f"[METRICS] Dropping unreadable {path} ({e}).")
+        worker = {"series": {}}
+    retired_path = os.path.join(METRICS_DIR, RETIRED_FILE)
+    try:
+        with open(retired_path) as f:
+            retired = json.load(f)
+    except (OSError, ValueError):
+        retired = {"pid": None, "series": {}, "gauges": []}
+    for metric in _registry:
+        if isinstance(metric, Gauge):
+            continue
+        merged = metric.merge(
+            {tuple(key): value for key, value in s["series"].get(metric.name, [])} for s in (retired, worker)
+        )
+        retired["series"][metric.name] = [[list(key), value] for key, value in merged.items()]
+    _write_snapshot(retired_path, retired)
+    try:
+        os.remove(path)
+    except OSError as e:
+        print(f"[METRICS] Could not remove {path} ({e}).")
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load_snapshots() -> List[dict]:
+    snapshots = []
+    for filename in sorted(os.listdir(METRICS_DIR)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"[METRICS] Skipping unreadable {filename} ({e}).")
+    return snapshots
+
+
+def _render_shared() -> str:
+    flush()
+    snapshots = _load_snapshots()
+    lines: List[str] = []
+    for metric in _registry:
+        if isinstance(metric, Gauge):
+            continue
+        values = metric.merge(
+            {tuple(key): value for key, value in s["series"].get(metric.name, [])} for s in snapshots
+        )
+        lines.extend(metric.render(values))
+
+    # Per-process values: one series per live worker, grouped under one HELP/TYPE
+    gauges: Dict[str, Collected] = {}
+    for s in snapshots:
+        pid = s["pid"]   # None for RETIRED_FILE
+        if pid is None or (pid != os.getpid() and not _is_alive(pid)):
+            continue
+        for name, kind, help, values in s["gauges"]:
+            entry = gauges.setdefault(name, (name, kind, help, []))
+            entry[3].extend(({**labels, "worker": str(s["pid"])}, value) for labels, value in values)
+    lines.extend(_render_collected(gauges.values()))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request. The endpoint label is the
+    matched endpoint's function name ("unmatched" for 404s), which keeps the
+    label set bounded. Also stamps scope["state"]["started_at"] for the
+    upload stage.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+        scope.setdefault("state", {})["started_at"] = start
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            HTTP_REQUESTS.inc(endpoint=endpoint, method=scope["method"], status=str(status))
+            HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
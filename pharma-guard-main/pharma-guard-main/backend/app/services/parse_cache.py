@@ -0,0 +1,201 @@
+"""
+Parse Cache — parsed VCFs keyed by the SHA-256 of the uploaded bytes.
+
+Clinicians often re-upload the same patient file to ask about other drugs.
+The parse result (variants, patient ID and per-gene diplotype calls) depends
+only on the file content and the knowledge-base snapshot, so it is cached in
+two tiers:
+  1. an in-process LRU bounded by PARSE_CACHE_SIZE entries and
+     PARSE_CACHE_MAX_VARIANTS retained variants in total
+  2. an optional SQLite file (PARSE_CACHE_PATH) shared by all workers
+
+Entries expire after PARSE_CACHE_TTL seconds (0 = never). They hold patient
+genotypes, so keep the TTL short and the SQLite file private. Keys include
+the KB fingerprint, so a reload makes old parses unreachable.
+
+Tabix-indexed uploads are not cached: hashing the whole file would cost
+more than the region reads it would save. Lookups and stores may touch
+SQLite, so async callers run them in a thread.
+"""
+from collections import OrderedDict
+from typing import Any, BinaryIO, Optional, Tuple
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", "256"))
+PARSE_CACHE_MAX_VARIANTS = int(os.getenv("PARSE_CACHE_MAX_VARIANTS", "1000000"))
+PARSE_CACHE_PATH = os.getenv("PARSE_CACHE_PATH", "")        # empty = memory only
+PARSE_CACHE_TTL = float(os.getenv("PARSE_CACHE_TTL", "3600"))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_cache: Optional["ParseCache"] = None
+
+
+def content_hash(stream: BinaryIO) -> str:
+    """SHA-256 hex digest of a seekable stream's bytes; leaves it rewound."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def cache_key(vcf_hash: str, kb_fingerprint: str) -> str:
+    return f"{vcf_hash}:{kb_fingerprint}"
+
+
+class ParseCache:
+    """
+    Two-tier (LRU + optional SQLite) cache of parse results with TTL. Values
+    are pickled to disk; each is stored with its size (retained variants).
+    """
+
+    def __init__(self, max_entries: int = 256, max_variants: int = 0, path: str = "", ttl: float = 0.0):
+        self.max_entries = max_entries
+        self.max_variants = max_variants
+        self.path = path
+        self.ttl = ttl
+        self._lru: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._variants = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    # ─── SQLITE TIER ──────────────────────────────────────────────────────────
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        # Connections must not cross a fork; reopen in each worker process
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS parses "
+                "(key TEXT PRIMARY KEY, created_at REAL NOT NULL, size INTEGER NOT NULL, payload BLOB NOT NULL)"
+            )
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, Any, int]]:
+        db = self._connection()
+        if db is None:
+            return None
+        try:
+            row = db.execute("SELECT created_at, payload, size FROM parses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            return row[0], pickle.loads(row[1]), row[2]
+        except (sqlite3.Error, pickle.UnpicklingError, AttributeError, ImportError, TypeError, EOFError) as e:
+            print(f"[PARSE_CACHE] SQLite read failed ({e}).")
+            return None
+
+    def _disk_put(self, key: str, created_at: float, value: Any, size: int) -> None:
+        db = self._connection()
+        if db is None:
+            return
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO parses (key, created_at, size, payload) VALUES (?, ?, ?, ?)",
+                (key, created_at, size, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)),
+            )
+        except sqlite3.Error as e:
+            print(f"[PARSE_CACHE] SQLite write failed ({e}).")
+
+    # ─── PUBLIC API ───────────────────────────────────────────────────────────
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return not self.ttl or time.time() - created_at < self.ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if self._is_fresh(entry[0]):
+                    self._lru.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                self._forget(key)
+
+            entry = self._disk_get(key)
+            if entry is not None and self._is_fresh(entry[0]):
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any, size: int = 1) -> None:
+        entry = (time.time(), value, size)
+        with self._lock:
+            self._remember(key, entry)
+            self._disk_put(key, *entry)
+            self.stores += 1
+
+    def _remember(self, key: str, entry: Tuple[float, Any, int]) -> None:
+        if self.max_variants and entry[2] > self.max_variants:
+            return   # larger than the whole budget: disk tier only
+        if key in self._lru:
+            self._forget(key)
+        self._lru[key] = entry
+        self._variants += entry[2]
+        while len(self._lru) > self.max_entries or (self.max_variants and self._variants > self.max_variants):
+            self._forget(next(iter(self._lru)))
+            self.evictions += 1
+
+    def _forget(self, key: str) -> None:
+        self._variants -= self._lru.pop(key)[2]
+
+    def purge_expired(self) -> int:
+        """Drop expired SQLite rows."""
+        db = self._connection()
+        if db is None or not self.ttl:
+            return 0
+        with self._lock:
+            return db.execute("DELETE FROM parses WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+            self._variants = 0
+            db = self._connection()
+            if db is not None:
+                db.execute("DELETE FROM parses")
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "capacity": self.max_entries,
+            "variants": self._variants,
+            "max_variants": self.max_variants,
+            "persistent": bool(self.path),
+            "ttl_seconds": self.ttl,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def get_parse_cache() -> ParseCache:
+    """Process-wide cache configured from PARSE_CACHE_* environment variables."""
+    global _cache
+    if _cache is None:
+        _cache = ParseCache(PARSE_CACHE_SIZE, PARSE_CACHE_MAX_VARIANTS, PARSE_CACHE_PATH, PARSE_CACHE_TTL)
+        _cache.purge_expired()
+    return _cache
@@ -1,78 +1,200 @@
 """
 PGx Engine — maps variants → diplotype → phenotype → risk assessment.
-All rules come from knowledge_base.py (no external API required).
+All rules come from knowledge_base.py (no external API required), read through
+the precompiled tables in decision_tables.py.
+
+A drug is evaluated over every gene the knowledge base links it to (primary
+gene first, then modifiers such as VKORC1 for warfarin); decision_tables.combine
+turns the per-gene decisions into one assessment.
+
+assess_panel analyzes many drugs against one patient: variants are grouped by
+gene in a single pass and each gene is called once (GeneCall), then every drug
+is read off those calls, so a full panel costs O(variants + drugs).
 """
-from typing import List, Tuple
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 from app.models.schemas import (
-    DetectedVariant, RiskAssessment, PharmacogenomicProfile
+    DetectedVariant, GeneResult, RiskAssessment, PharmacogenomicProfile
 )
-from app.utils.knowledge_base import (
-    DRUG_GENE_MAP, SUPPORTED_GENES,
-    get_allele_function, diplotype_to_phenotype,
-    RISK_RULES, get_clinical_rec, MECHANISMS
+from app.utils import knowledge_base
+from app.utils.decision_tables import Verdict, clinical_rec_for, combine, diplotype_code
+from app.utils.knowledge_base import KnowledgeBase
+from app.services.vcf_parser import (
+    AnyVariant, GenotypeMatrix, as_detected_variant, call_diplotypes, diplotype_from_gene_variants,
+    group_by_gene
 )
-from app.services.vcf_parser import determine_diplotype, get_gene_variants
 
+# Dosage code → genotype reported for a sample in cohort mode
+DOSAGE_GENOTYPE = {1: "0/1", 2: "1/1"}
 
-def analyze_drug(drug: str, variants: List[DetectedVariant]) -> Tuple[
+
+def analyze_drug(drug: str, variants: List[AnyVariant], kb: Optional[KnowledgeBase] = None) -> Tuple[
     RiskAssessment, PharmacogenomicProfile
 ]:
     """
     Given a drug name and list of variants, compute risk and profile.
+    kb defaults to the active knowledge-base snapshot.
     """
+    risk, profile, _ = assess_drug(drug, variants, kb)
+    return risk, profile
+
+
+def assess_drug(drug: str, variants: List[AnyVariant], kb: Optional[KnowledgeBase] = None) -> Tuple[
+    RiskAssessment, PharmacogenomicProfile, dict
+]:
+    """analyze_drug plus the clinical recommendation that goes with the verdict."""
+    kb = kb or knowledge_base.current()
     drug_upper = drug.upper()
-    primary_gene = DRUG_GENE_MAP.get(drug_upper, "")
+    calls = call_genes(variants, kb.drug_genes.get(drug_upper, ()), kb)
+    return _assess(kb, drug_upper, calls, variants, {})
+
+
+def assess_panel(
+    drugs: List[str],
+    variants: List[AnyVariant],
+    kb: Optional[KnowledgeBase] = None,
+    calls: Optional[Dict[str, "GeneCall"]] = None,
+) -> List[Tuple[str, RiskAssessment, PharmacogenomicProfile, dict]]:
+    """
+    assess_drug for many drugs: (drug, risk, profile, clinical_rec) per drug,
+    with each gene's diplotype and phenotype computed once and shared, as are
+    the DetectedVariant models of variants reported for several drugs.
+    calls may supply precomputed gene calls (e.g. from a cached parse).
+    """
+    kb = kb or knowledge_base.current()
+    if calls is None:
+        genes = {gene for drug in drugs for gene in kb.drug_genes.get(drug.upper(), ())}
+        calls = call_genes(variants, genes, kb)
+    models: Dict[int, DetectedVariant] = {}
+    return [(drug,) + _assess(kb, drug.upper(), calls, variants, models) for drug in drugs]
+
+
+class GeneCall(NamedTuple):
+    diplotype: str
+    code: int                         # allele-function pair code of the diplotype
+    variants: List[AnyVariant]   # the gene's detected variants
+
+
+def call_genes(variants: List[AnyVariant], genes: Iterable[str], kb: KnowledgeBase) -> Dict[str, GeneCall]:
+    """Group variants by gene in one pass and call each requested gene's diplotype."""
+    groups = group_by_gene(variants)
+    calls = {}
+    for gene in genes:
+        gene_vars = groups.get(gene, [])
+        diplotype = diplotype_from_gene_variants(gene_vars, gene, kb)
+        calls[gene] = GeneCall(diplotype, diplotype_code(kb, gene, diplotype), gene_vars)
+    return calls
 
-    if not primary_gene:
+
+def _detected(variant: AnyVariant, models: Dict[int, DetectedVariant]) -> DetectedVariant:
+    # One model per record per analysis (keyed by identity), shared by every drug reporting it
+    model = models.get(id(variant))
+    if model is None:
+        model = models[id(variant)] = as_detected_variant(variant)
+    return model
+
+
+def _assess(
+    kb: KnowledgeBase, drug_upper: str, calls: Dict[str, GeneCall], variants: List[AnyVariant],
+    models: Dict[int, DetectedVariant],
+) -> Tuple[RiskAssessment, PharmacogenomicProfile, dict]:
+    genes = kb.drug_genes.get(drug_upper)
+    if not genes:
         # Unknown drug fallback
-        risk = RiskAssessment(
-            risk_label="Unknown",
-            confidence_score=0.0,
-            severity="none",
-        )
-        profile = PharmacogenomicProfile(
-            primary_gene="Unknown",
-            diplotype="*1/*1",
-            phenotype="Unknown",
-            detected_variants=[],
-        )
-        return risk, profile
-
-    # Get variants for this gene
-    gene_variants = get_gene_variants(variants, primary_gene)
-
-    # Determine diplotype
-    diplotype = determine_diplotype(variants, primary_gene)
-
-    # Parse diplotype to get allele functions
-    parts = diplotype.split("/")
-    a1, a2 = parts[0], parts[1] if len(parts) > 1 else "*1"
-    func1 = get_allele_function(a1)
-    func2 = get_allele_function(a2)
-
-    # Get phenotype
-    phenotype = diplotype_to_phenotype(primary_gene, func1, func2)
-
-    # Get risk from rules
-    drug_rules = RISK_RULES.get(drug_upper, {})
-    rule = drug_rules.get(phenotype, drug_rules.get("Unknown", ("Unknown", 0.5, "moderate", "")))
-    risk_label, confidence, severity, _ = rule
-
-    risk = RiskAssessment(
-        risk_label=risk_label,
-        confidence_score=confidence,
-        severity=severity,
+        risk, profile = _unknown_drug_result()
+        return risk, profile, clinical_rec_for(kb, drug_upper, profile.phenotype)
+
+    gene_calls = [calls[gene] for gene in genes]
+    verdict = combine(kb, drug_upper, [
+        kb.tables.gene_decisions[(drug_upper, gene)][call.code] for gene, call in zip(genes, gene_calls)
+    ])
+
+    # Variants for all of the drug's genes
+    gene_variants = [v for call in gene_calls for v in call.variants]
+    diplotypes = [call.diplotype for call in gene_calls]
+    detected = [_detected(v, models) for v in (gene_variants if gene_variants else variants[:2])]
+    profile = _profile(genes, diplotypes, verdict, detected)
+    return verdict.decision.risk, profile, verdict.decision.clinical_rec
+
+
+def _profile(
+    genes: Tuple[str, ...], diplotypes: List[str], verdict: Verdict, detected: List[DetectedVariant]
+) -> PharmacogenomicProfile:
+    gene_results = []
+    if len(genes) > 1:
+        gene_results = [
+            GeneResult(gene=gene, diplotype=diplotype, phenotype=decision.phenotype)
+            for gene, diplotype, decision in zip(genes, diplotypes, verdict.per_gene)
+        ]
+    return PharmacogenomicProfile(
+        primary_gene=genes[verdict.driver],
+        diplotype=diplotypes[verdict.driver],
+        phenotype=verdict.decision.phenotype,
+        detected_variants=detected,
+        gene_results=gene_results,
     )
 
-    profile = PharmacogenomicProfile(
-        primary_gene=primary_gene,
-        diplotype=diplotype,
-        phenotype=phenotype,
-        detected_variants=gene_variants if gene_variants else variants[:2],
+
+def _unknown_drug_result() -> Tuple[RiskAssessment, PharmacogenomicProfile]:
+    return (
+        RiskAssessment(risk_label="Unknown", confidence_score=0.0, severity="none"),
+        PharmacogenomicProfile(
+            primary_gene="Unknown", diplotype="*1/*1", phenotype="Unknown", detected_variants=[]
+        ),
     )
 
-    return risk, profile
+
+def analyze_drug_cohort(
+    drug: str,
+    matrix: GenotypeMatrix,
+    kb: Optional[KnowledgeBase] = None,
+    gene_calls: Optional[Dict[str, List[str]]] = None,
+) -> List[Tuple[RiskAssessment, PharmacogenomicProfile, dict]]:
+    """
+    Cohort version of assess_drug: one (risk, profile, clinical_rec) per sample
+    in the matrix. Diplotypes are called in one batched pass per gene, and
+    phenotype/risk are read from the decision tables by allele-function pair
+    code; multi-gene verdicts are memoized on the tuple of pair codes.
+    gene_calls, if given, memoizes call_diplotypes per gene across drugs.
+    """
+    kb = kb or knowledge_base.current()
+    drug_upper = drug.upper()
+    genes = kb.drug_genes.get(drug_upper)
+    if not genes:
+        unknown = clinical_rec_for(kb, drug_upper, "Unknown")
+        return [_unknown_drug_result() + (unknown,) for _ in matrix.samples]
+
+    rows = [i for gene in genes for i in matrix.gene_rows(gene)]
+    gene_calls = {} if gene_calls is None else gene_calls
+    for gene in genes:
+        if gene not in gene_calls:
+            gene_calls[gene] = call_diplotypes(matrix, gene, kb)
+    calls = [gene_calls[gene] for gene in genes]
+    tables = [kb.tables.gene_decisions[(drug_upper, gene)] for gene in genes]
+    verdicts: Dict[Tuple[int, ...], Verdict] = {}
+    carried_models: Dict[Tuple[int, int], DetectedVariant] = {}   # (row, dosage) → model, shared by samples
+    results = []
+    for j in range(len(matrix.samples)):
+        diplotypes = [called[j] for called in calls]
+        codes = tuple(diplotype_code(kb, gene, d) for gene, d in zip(genes, diplotypes))
+        verdict = verdicts.get(codes)
+        if verdict is None:
+            verdict = verdicts[codes] = combine(kb, drug_upper, [t[c] for t, c in zip(tables, codes)])
+
+        carried = []
+        for i in rows:
+            dosage = matrix.dosages[i][j]
+            if dosage > 0:
+                model = carried_models.get((i, dosage))
+                if model is None:
+                    model = carried_models[(i, dosage)] = matrix.variants[i].to_model().model_copy(
+                        update={"genotype": DOSAGE_GENOTYPE[dosage]}
+                    )
+                carried.append(model)
+        profile = _profile(genes, diplotypes, verdict, carried)
+        results.append((verdict.decision.risk, profile, verdict.decision.clinical_rec))
+    return results
 
 
-def get_mechanism(gene: str) -> str:
-    return MECHANISMS.get(gene, f"{gene} is a pharmacogenomically relevant gene affecting drug metabolism.")
+def get_mechanism(gene: str, kb: Optional[KnowledgeBase] = None) -> str:
+    mechanisms = (kb or knowledge_base.current()).mechanisms
+    return mechanisms.get(gene, f"{gene} is a pharmacogenomically relevant gene affecting drug metabolism.")
@@ -0,0 +1,174 @@
+"""
+Pipeline — parse + PGx analysis for one VCF file, runnable in worker processes.
+
+Everything here is synchronous and works on file paths and plain values so it
+can be shipped to a ProcessPoolExecutor; LLM explanations stay in the caller.
+Jobs take the fingerprint of the knowledge-base snapshot the request started
+under (see knowledge_base.resolve) and report the version they actually used.
+
+Single-sample analysis is split into parse_vcf_upload → ParsedVCF (cacheable,
+see parse_cache.py) and analyze_parsed, which assesses drugs off the parsed
+gene calls without touching the file again.
+"""
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+import io
+import os
+
+from app.models.schemas import PharmacogenomicProfile, RiskAssessment
+from app.services import metrics
+from app.services.pgx_engine import GeneCall, analyze_drug_cohort, assess_panel, call_genes
+from app.services.vcf_parser import (
+    Variant, open_vcf_lines, parse_vcf_cohort, parse_vcf_lines
+)
+from app.utils import knowledge_base
+
+VCF_EXTENSIONS = (".vcf", ".vcf.gz", ".vcf.bgz")
+CONFIDENCE_BASIS = "CPIC guidelines + pharmacogenomic star-allele database"
+
+
+class ParsedVCF(NamedTuple):
+    patient_id: str
+    variants: List[Variant]
+    gene_calls: Dict[str, GeneCall]   # every supported gene of the snapshot
+    kb_fingerprint: str
+
+
+class FileAnalysis(NamedTuple):
+    patient_id: str
+    variants_detected: int
+    genes_analyzed: List[str]
+    drug_results: List[Tuple[str, RiskAssessment, PharmacogenomicProfile, dict]]   # (..., clinical_rec)
+    kb_version: str
+    parsed: Optional[ParsedVCF] = None   # set when freshly parsed, for the parse cache
+
+
+class CohortAnalysis(NamedTuple):
+    samples: List[str]
+    genes_analyzed: List[str]
+    carried_counts: List[int]   # variants carried (dosage > 0) per sample
+    drug_results: Dict[str, List[Tuple[RiskAssessment, PharmacogenomicProfile, dict]]]
+    kb_version: str
+
+
+class NoVariantsError(ValueError):
+    """Raised when a VCF yields no pharmacogenomic variants."""
+
+    def __init__(self, message: str = "Could not parse any pharmacogenomic variants from VCF file. Check file format."):
+        super().__init__(message)
+
+
+def analyze_vcf_stream(
+    stream: BinaryIO,
+    drug_list: List[str],
+    max_bytes: Optional[int] = None,
+    index: Optional[BinaryIO] = None,
+    kb_fingerprint: Optional[str] = None,
+) -> FileAnalysis:
+    """Parse a (plain/gzip/bgzip) VCF stream and assess every drug off shared per-gene calls."""
+    parsed = parse_vcf_upload(stream, max_bytes, index, kb_fingerprint)
+    return analyze_parsed(parsed, drug_list)._replace(parsed=parsed)
+
+
+def parse_vcf_upload(
+    stream: BinaryIO,
+    max_bytes: Optional[int] = None,
+    index: Optional[BinaryIO] = None,
+    kb_fingerprint: Optional[str] = None,
+) -> ParsedVCF:
+    """Parse a single-sample VCF stream and call every supported gene."""
+    kb = knowledge_base.resolve(kb_fingerprint)
+    with metrics.timed("parse"):
+        variants, patient_id, success = parse_vcf_lines(open_vcf_lines(stream, max_bytes, index=index, kb=kb), kb)
+        if not success:
+            raise NoVariantsError()
+        return ParsedVCF(patient_id, variants, call_genes(variants, kb.supported_genes, kb), kb.fingerprint)
+
+
+def analyze_parsed(parsed: ParsedVCF, drug_list: List[str]) -> FileAnalysis:
+    """Assess drugs against an already parsed VCF (fresh or from the parse cache)."""
+    kb = knowledge_base.resolve(parsed.kb_fingerprint)
+    if kb.fingerprint != parsed.kb_fingerprint:
+        # Snapshot no longer resolvable; call genes against the one we have
+        parsed = parsed._replace(
+            gene_calls=call_genes(parsed.variants, kb.supported_genes, kb), kb_fingerprint=kb.fingerprint
+        )
+    variants = parsed.variants
+    genes_analyzed = sorted(set(v.gene for v in variants if v.gene in kb.gene_drug_map))
+    with metrics.timed("analyze"):
+        drug_results = assess_panel(drug_list, variants, kb, parsed.gene_calls)
+    metrics.DRUG_ASSESSMENTS.inc(len(drug_results))
+    return FileAnalysis(parsed.patient_id, len(variants), genes_analyzed, drug_results, kb.version)
+
+
+def analyze_cohort_stream(
+    stream: BinaryIO,
+    drug_list: List[str],
+    max_bytes: Optional[int] = None,
+    index: Optional[BinaryIO] = None,
+    kb_fingerprint: Optional[str] = None,
+) -> CohortAnalysis:
+    """Parse a multi-sample VCF stream and run analyze_drug_cohort for each drug."""
+    kb = knowledge_base.resolve(kb_fingerprint)
+    with metrics.timed("parse"):
+        matrix = parse_vcf_cohort(open_vcf_lines(stream, max_bytes, index=index, kb=kb), kb)
+    if not matrix.variants:
+        raise NoVariantsError()
+
+    genes_analyzed = sorted(set(v.gene for v in matrix.variants if v.gene in kb.gene_drug_map))
+    carried_counts = [0] * len(matrix.samples)
+    for row in matrix.dosages:
+        for j, dosage in enumerate(row):
+            if dosage > 0:
+                carried_counts[j] += 1
+    gene_calls: Dict[str, List[str]] = {}   # diplotypes per gene, shared across drugs
+    with metrics.timed("analyze"):
+        drug_results = {drug: analyze_drug_cohort(drug, matrix, kb, gene_calls) for drug in drug_list}
+    metrics.DRUG_ASSESSMENTS.inc(len(drug_list) * len(matrix.samples))
+    return CohortAnalysis(matrix.samples, genes_analyzed, carried_counts, drug_results, kb.version)
+
+
+def _run_on_path(job, path: str, drug_list: List[str], max_bytes: Optional[int], kb_fingerprint: Optional[str]):
+    index_path = path + ".tbi"
+    with open(path, "rb") as stream:
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as index:
+                return job(stream, drug_list, max_bytes, index, kb_fingerprint)
+        return job(stream, drug_list, max_bytes, None, kb_fingerprint)
+
+
+def analyze_vcf_path(
+    path: str, drug_list: List[str], max_bytes: Optional[int] = None, kb_fingerprint: Optional[str] = None
+) -> FileAnalysis:
+    """
+    analyze_vcf_stream for a file on disk (a sibling .tbi is used if present).
+    Takes only picklable arguments, for worker processes.
+    """
+    return _run_on_path(analyze_vcf_stream, path, drug_list, max_bytes, kb_fingerprint)
+
+
+def analyze_cohort_path(
+    path: str, drug_list: List[str], max_bytes: Optional[int] = None, kb_fingerprint: Optional[str] = None
+) -> CohortAnalysis:
+    """analyze_cohort_stream for a file on disk, for worker processes."""
+    return _run_on_path(analyze_cohort_stream, path, drug_list, max_bytes, kb_fingerprint)
+
+
+def warm_up() -> None:
+    """
+    Analyze a tiny VCF (one defining variant per gene of the active snapshot)
+    so first-use costs are paid at start-up rather than by the first request.
+    The run's metric updates are discarded.
+    """
+    kb = knowledge_base.current()
+    records: Dict[str, str] = {}
+    for gene, _, rsid, chrom, pos, ref, alt in kb.star_definitions:
+        records.setdefault(gene, f"{chrom}\t{pos}\t{rsid}\t{ref}\t{alt}\t.\tPASS\t.\tGT\t0/1")
+    if not records:
+        return
+    vcf = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tWARM_UP\n"
+    vcf += "\n".join(records.values()) + "\n"
+    metrics.start_capture()
+    try:
+        analyze_vcf_stream(io.BytesIO(vcf.encode()), kb.supported_drugs)
+    finally:
+        metrics.end_capture()
@@ -0,0 +1,351 @@
+"""
+Tabix / BGZF support — random access into bgzip-compressed, tabix-indexed VCFs.
+
+Pure-Python implementation of the BGZF block format and the .tbi index
+(no htslib/pysam needed), so the parser can seek straight to pharmacogene
+loci instead of decompressing a whole genome. A small writer is included
+for producing indexed files (tests, synthetic benchmark data).
+"""
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+import gzip
+import io
+import struct
+import zlib
+
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+BGZF_BLOCK_DATA = 0xFF00  # uncompressed bytes per block, as in htslib
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+TABIX_MAGIC = b"TBI\x01"
+LINEAR_SHIFT = 14  # 16 kb linear-index windows
+
+
+class TabixError(ValueError):
+    """Raised for malformed BGZF blocks or tabix indexes."""
+
+
+def _peek(stream: BinaryIO, size: int) -> bytes:
+    pos = stream.tell()
+    head = stream.read(size)
+    stream.seek(pos)
+    return head
+
+
+def is_gzip(stream: BinaryIO) -> bool:
+    """True if a seekable stream starts with the gzip magic bytes."""
+    return _peek(stream, 2) == b"\x1f\x8b"
+
+
+def is_bgzf(stream: BinaryIO) -> bool:
+    """True if a seekable stream starts with a BGZF block (gzip + 'BC' extra field)."""
+    head = _peek(stream, 16)
+    return len(head) == 16 and head[:4] == BGZF_MAGIC and head[12:14] == b"BC"
+
+
+# ─── BGZF READING ─────────────────────────────────────────────────────────────
+def _read_block(stream: BinaryIO) -> Optional[bytes]:
+    """Decompress the BGZF block at the current position (None at EOF)."""
+    header = stream.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != BGZF_MAGIC:
+        raise TabixError("Not a BGZF block")
+
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = stream.read(xlen)
+    bsize = None
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack("<H", extra[i + 2:i + 4])[0]
+        if extra[i:i + 2] == b"BC" and slen == 2:
+            bsize = struct.unpack("<H", extra[i + 4:i + 6])[0]
+        i += 4 + slen
+    if bsize is None:
+        raise TabixError("BGZF block is missing its BSIZE field")
+
+    body = stream.read(bsize + 1 - 12 - xlen)
+    try:
+        return zlib.decompress(body[:-8], -15)
+    except zlib.error as e:
+        raise TabixError(f"Corrupt BGZF block: {e}")
+
+
+def iter_lines_at(stream: BinaryIO, voffset: int) -> Iterator[str]:
+    """
+    Yield decoded lines starting at a BGZF virtual offset
+    (compressed block offset << 16 | offset within the block).
+    """
+    stream.seek(voffset >> 16)
+    skip = voffset & 0xFFFF
+    buffer = b""
+    while True:
+        data = _read_block(stream)
+        if data is None:
+            break
+        if skip:
+            data, skip = data[skip:], 0
+        buffer += data
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for raw in lines:
+            yield raw.decode("utf-8", errors="replace")
+
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
+
+# ─── TABIX INDEX ──────────────────────────────────────────────────────────────
+def _reg2bin(beg: int, end: int) -> int:
+    """UCSC/tabix bin for a 0-based half-open interval."""
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return 4681 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return 585 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return 73 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return 9 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return 1 + (beg >> 26)
+    return 0
+
+
+def _reg2bins(beg: int, end: int) -> List[int]:
+    """All bins that may hold records overlapping [beg, end)."""
+    end -= 1
+    bins = [0]
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return bins
+
+
+class TabixIndex:
+    """Parsed .tbi index: per-sequence binning and linear indexes."""
+
+    def __init__(
+        self,
+        names: List[str],
+        bins: List[Dict[int, List[Tuple[int, int]]]],
+        linear: List[List[int]],
+        meta_char: str = "#",
+    ):
+        self.names = names
+        self.tids = {name: tid for tid, name in enumerate(names)}
+        self.bins = bins
+        self.linear = linear
+        self.meta_char = meta_char
+
+    @classmethod
+    def load(cls, stream: BinaryIO) -> "TabixIndex":
+        try:
+            data = gzip.GzipFile(fileobj=stream, mode="rb").read()
+        except (OSError, EOFError) as e:
+            raise TabixError(f"Could not decompress tabix index: {e}")
+        if data[:4] != TABIX_MAGIC:
+            raise TabixError("Not a tabix (.tbi) index")
+
+        try:
+            n_ref, _fmt, _col_seq, _col_beg, _col_end, meta, _skip, l_nm = struct.unpack_from("<8i", data, 4)
+            off = 36
+            names = [n.decode() for n in data[off:off + l_nm].split(b"\x00") if n]
+            off += l_nm
+
+            bins: List[Dict[int, List[Tuple[int, int]]]] = []
+            linear: List[List[int]] = []
+            for _ in range(n_ref):
+                (n_bin,) = struct.unpack_from("<i", data, off)
+                off += 4
+                ref_bins: Dict[int, List[Tuple[int, int]]] = {}
+                for _ in range(n_bin):
+                    bin_id, n_chunk = struct.unpack_from("<Ii", data, off)
+                    off += 8
+                    flat = struct.unpack_from(f"<{2 * n_chunk}Q", data, off)
+                    off += 16 * n_chunk
+                    ref_bins[bin_id] = list(zip(flat[::2], flat[1::2]))
+                (n_intv,) = struct.unpack_from("<i", data, off)
+                off += 4
+                linear.append(list(struct.unpack_from(f"<{n_intv}Q", data, off)))
+                off += 8 * n_intv
+                bins.append(ref_bins)
+        except struct.error as e:
+            raise TabixError(f"Truncated tabix index: {e}")
+
+        return cls(names, bins, linear, meta_char=chr(meta))
+
+    def resolve(self, chrom: str) -> Optional[str]:
+        """Sequence name as stored in the index, tolerating chr-prefix mismatches."""
+        bare = chrom[3:] if chrom.startswith("chr") else chrom
+        for name in (chrom, bare, "chr" + bare):
+            if name in self.tids:
+                return name
+        return None
+
+    def query_offset(self, name: str, beg: int, end: int) -> Optional[int]:
+        """
+        Smallest virtual offset at which a record overlapping the 0-based
+        half-open interval [beg, end) on `name` can start, or None.
+        """
+        tid = self.tids[name]
+        linear = self.linear[tid]
+        min_off = linear[min(beg >> LINEAR_SHIFT, len(linear) - 1)] if linear else 0
+
+        best = None
+        ref_bins = self.bins[tid]
+        for b in _reg2bins(beg, end):
+            for cbeg, cend in ref_bins.get(b, ()):
+                if cend > min_off and (best is None or cbeg < best):
+                    best = cbeg
+        if best is None:
+            return None
+        return max(best, min_off)
+
+
+def _merge_regions(regions: Iterable[Tuple[str, int, int]]) -> List[Tuple[str, int, int]]:
+    merged: List[Tuple[str, int, int]] = []
+    for chrom, start, end in sorted(regions):
+        if merged and merged[-1][0] == chrom and start <= merged[-1][2] + 1:
+            merged[-1] = (chrom, merged[-1][1], max(end, merged[-1][2]))
+        else:
+            merged.append((chrom, start, end))
+    return merged
+
+
+def fetch_regions(
+    stream: BinaryIO,
+    index: TabixIndex,
+    regions: Iterable[Tuple[str, int, int]],
+) -> Iterator[str]:
+    """
+    Yield the header lines of a bgzipped VCF followed by the data lines that
+    overlap the given regions (chrom, 1-based start, 1-based inclusive end).
+    """
+    for line in iter_lines_at(stream, 0):
+        if not line.startswith(index.meta_char):
+            break
+        yield line
+
+    for chrom, start, end in _merge_regions(regions):
+        name = index.resolve(chrom)
+        if name is None:
+            continue
+        voffset = index.query_offset(name, start - 1, end)
+        if voffset is None:
+            continue
+
+        # Records are coordinate-sorted: read forward until we leave the region
+        for line in iter_lines_at(stream, voffset):
+            if not line or line.startswith(index.meta_char):
+                continue
+            fields = line.split("\t", 4)
+            if len(fields) < 4 or fields[0] != name:
+                break
+            try:
+                pos = int(fields[1])
+            except ValueError:
+                continue
+            if pos > end:
+                break
+            if pos + max(len(fields[3]), 1) - 1 >= start:
+                yield line
+
+
+# ─── WRITING (bgzip + tabix -p vcf) ──────────────────────────────────────────
+def _compress_block(data: bytes, level: int = 6) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    bsize = 18 + len(cdata) + 8 - 1
+    header = BGZF_MAGIC + b"\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + struct.pack("<H", bsize)
+    return header + cdata + struct.pack("<II", zlib.crc32(data) & 0xFFFFFFFF, len(data))
+
+
+class BGZFWriter:
+    """Minimal BGZF writer that tracks virtual offsets for indexing."""
+
+    def __init__(self, out: BinaryIO, level: int = 6):
+        self.out = out
+        self.level = level
+        self.block_offset = 0
+        self.buffer = b""
+
+    def tell(self) -> int:
+        return (self.block_offset << 16) | len(self.buffer)
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        while len(self.buffer) >= BGZF_BLOCK_DATA:
+            self._flush_block(self.buffer[:BGZF_BLOCK_DATA])
+            self.buffer = self.buffer[BGZF_BLOCK_DATA:]
+
+    def _flush_block(self, data: bytes) -> None:
+        block = _compress_block(data, self.level)
+        self.out.write(block)
+        self.block_offset += len(block)
+
+    def close(self) -> None:
+        if self.buffer:
+            self._flush_block(self.buffer)
+            self.buffer = b""
+        self.out.write(BGZF_EOF)
+
+
+def write_bgzf_vcf(lines: Iterable[str], out: BinaryIO) -> bytes:
+    """
+    Write coordinate-sorted VCF lines to `out` as BGZF and return the
+    matching .tbi index (itself BGZF-compressed), like bgzip + tabix -p vcf.
+    """
+    writer = BGZFWriter(out)
+    names: List[str] = []
+    bins: List[Dict[int, List[List[int]]]] = []
+    linear: List[List[int]] = []
+
+    for line in lines:
+        start = writer.tell()
+        writer.write(line.rstrip("\n").encode() + b"\n")
+        if line.startswith("#"):
+            continue
+        end_voffset = writer.tell()
+
+        fields = line.split("\t", 4)
+        chrom, beg = fields[0], int(fields[1]) - 1
+        end = beg + max(len(fields[3]), 1)
+        if not names or names[-1] != chrom:
+            names.append(chrom)
+            bins.append({})
+            linear.append([])
+
+        chunks = bins[-1].setdefault(_reg2bin(beg, end), [])
+        if chunks and chunks[-1][1] == start:
+            chunks[-1][1] = end_voffset
+        else:
+            chunks.append([start, end_voffset])
+
+        windows = linear[-1]
+        last_window = (end - 1) >> LINEAR_SHIFT
+        while len(windows) <= last_window:
+            windows.append(0)
+        for w in range(beg >> LINEAR_SHIFT, last_window + 1):
+            if windows[w] == 0:
+                windows[w] = start
+    writer.close()
+
+    for windows in linear:
+        for w in range(1, len(windows)):
+            if windows[w] == 0:
+                windows[w] = windows[w - 1]
+
+    names_blob = b"".join(n.encode() + b"\x00" for n in names)
+    parts = [TABIX_MAGIC, struct.pack("<8i", len(names), 2, 1, 2, 0, ord("#"), 0, len(names_blob)), names_blob]
+    for ref_bins, windows in zip(bins, linear):
+        parts.append(struct.pack("<i", len(ref_bins)))
+        for bin_id, chunks in sorted(ref_bins.items()):
+            parts.append(struct.pack("<Ii", bin_id, len(chunks)))
+            for cbeg, cend in chunks:
+                parts.append(struct.pack("<QQ", cbeg, cend))
+        parts.append(struct.pack("<i", len(windows)))
+        parts.append(struct.pack(f"<{len(windows)}Q", *windows))
+
+    index_out = io.BytesIO()
+    index_writer = BGZFWriter(index_out)
+    index_writer.write(b"".join(parts))
+    index_writer.close()
+    return index_out.getvalue()
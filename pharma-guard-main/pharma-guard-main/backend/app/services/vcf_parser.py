@@ -1,135 +1,509 @@
 """
 VCF Parser — parses VCF 4.2 files and extracts pharmacogenomic variants.
+
+Files are consumed line by line (see VCFReader / iter_lines), so memory stays
+bounded by the chunk size plus the retained pharmacogenomic variants, not by
+the size of the upload. gzip/bgzip input is decompressed on the fly, and a
+tabix index lets the reader seek straight to the pharmacogene loci.
+
+Parsed records are compact Variant objects (__slots__, with chromosome, gene,
+star allele and genotype strings interned), not pydantic models. A
+DetectedVariant is only materialized for the variants that end up in a
+response (see Variant.to_model), and is not kept on the record, so cached
+parses hold the compact records alone.
 """
-from typing import List, Dict, Tuple
-import re
+from array import array
+from sys import intern
+from typing import Any, BinaryIO, Iterable, Iterator, List, Dict, Optional, Tuple, Union
+import gzip
+import os
 from app.models.schemas import DetectedVariant
+from app.services import metrics
+from app.services.tabix import TabixIndex, fetch_regions, is_bgzf, is_gzip
+from app.utils import knowledge_base
+from app.utils.knowledge_base import KnowledgeBase
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MB reads from the upload stream
+
+
+class VCFTooLargeError(ValueError):
+    """Raised when a streamed VCF exceeds the configured byte limit."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"VCF exceeds {max_bytes} byte limit")
+        self.max_bytes = max_bytes
+
 
+class _LimitedReader:
+    """Binary file wrapper that raises VCFTooLargeError past max_bytes."""
 
-def parse_vcf(content: str) -> Tuple[List[DetectedVariant], str, bool]:
+    def __init__(self, stream: BinaryIO, max_bytes: int):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.total = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.total += len(data)
+        if self.total > self.max_bytes:
+            raise VCFTooLargeError(self.max_bytes)
+        return data
+
+
+def iter_lines(stream: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
     """
-    Parse VCF file content and return (variants, patient_id, success).
+    Incrementally read a binary stream and yield decoded text lines.
     """
-    variants: List[DetectedVariant] = []
-    patient_id = "PATIENT_001"
-    success = False
+    buffer = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for raw in lines:
+            yield raw.decode("utf-8", errors="replace")
 
-    lines = content.strip().splitlines()
-    header_cols = None
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
 
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
 
-        # Extract patient ID from sample column header
-        if line.startswith("#CHROM"):
-            parts = line.split("\t")
-            header_cols = parts
-            if len(parts) > 9:
-                patient_id = parts[9].strip()
-            continue
+class Variant:
+    """
+    Compact internal variant record with the fields of DetectedVariant.
+    Treat as read-only: records are shared between drugs and cached parses.
+    """
+
+    __slots__ = ("rsid", "gene", "star_allele", "chromosome", "position", "ref", "alt", "genotype")
 
-        if line.startswith("#"):
-            continue
+    def __init__(
+        self, rsid: str, gene: str, star_allele: str, chromosome: str,
+        position: int, ref: str, alt: str, genotype: str,
+    ):
+        self.rsid = rsid
+        self.gene = intern(gene)
+        self.star_allele = intern(star_allele)
+        self.chromosome = intern(chromosome)
+        self.position = position
+        self.ref = ref
+        self.alt = alt
+        self.genotype = intern(genotype)
 
-        # Parse variant line
+    def _fields(self) -> Tuple:
+        return (self.rsid, self.gene, self.star_allele, self.chromosome,
+                self.position, self.ref, self.alt, self.genotype)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Variant) and self._fields() == other._fields()
+
+    def __hash__(self) -> int:
+        return hash(self._fields())
+
+    def __repr__(self) -> str:
+        return f"Variant({self.gene} {self.star_allele} {self.chromosome}:{self.position} {self.genotype})"
+
+    # pickle (process workers, parse cache) as a plain field tuple
+    def __getstate__(self):
+        return self._fields()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def to_model(self) -> DetectedVariant:
+        """
+        A new DetectedVariant for this record. Not memoized here: records
+        outlive requests in the parse cache; callers share models per analysis.
+        """
+        # Fields were validated while parsing
+        return DetectedVariant.model_construct(
+            rsid=self.rsid, gene=self.gene, star_allele=self.star_allele, chromosome=self.chromosome,
+            position=self.position, ref=self.ref, alt=self.alt, genotype=self.genotype,
+        )
+
+
+AnyVariant = Union[Variant, DetectedVariant]   # the engine also accepts hand-built models
+
+
+def as_detected_variant(variant: AnyVariant) -> DetectedVariant:
+    return variant if isinstance(variant, DetectedVariant) else variant.to_model()
+
+
+class VCFReader:
+    """
+    Streaming VCF reader: iterate to get Variant records one at a time.
+    patient_id is populated as soon as the #CHROM header line has been read.
+
+    Records are screened on CHROM/POS against the pharmacogene region index
+    (or on ID against the star-allele rsID table) before any further
+    tokenization. A record the screen rejects is still accepted if it carries
+    a GENE tag, whether or not the header declares the field, so annotated
+    calls outside the indexed loci are not lost. Records without a STAR tag
+    get their star allele from the knowledge base's defining-variant table.
+
+    kb defaults to the active knowledge-base snapshot. Once iteration ends,
+    skipped holds the counts of data records not yielded, by reason.
+    """
+
+    def __init__(self, lines: Iterable[str], kb: Optional[KnowledgeBase] = None):
+        self.lines = lines
+        self.kb = kb or knowledge_base.current()
+        self.patient_id = "PATIENT_001"
+        self.samples: List[str] = []
+        self.skipped = {"off_target": 0, "malformed": 0, "unresolved": 0}
+
+    def __iter__(self) -> Iterator[Any]:
+        gene_at = self.kb.gene_at
+        star_by_rsid = self.kb.star_by_rsid
+        off_target = malformed = unresolved = 0   # locals: kept off the per-line path
+        try:
+            for line in self.lines:
+                line = line.strip()
+                if not line:
+                    continue
+
+                if line[0] == "#":
+                    # Extract patient ID from sample column header
+                    if line.startswith("#CHROM"):
+                        parts = line.split("\t")
+                        self.samples = [p.strip() for p in parts[9:]]
+                        if self.samples:
+                            self.patient_id = self.samples[0]
+                    continue
+
+                # Cheap prefix split: CHROM, POS and ID only
+                prefix = line.split("\t", 3)
+                if len(prefix) < 4:
+                    malformed += 1
+                    continue
+                try:
+                    region_gene = gene_at(prefix[0], int(prefix[1]))
+                except ValueError:
+                    malformed += 1
+                    continue
+                # Substring test on the unsplit rest only for records the screen rejects
+                if region_gene is None and prefix[2] not in star_by_rsid and "GENE=" not in prefix[3]:
+                    off_target += 1
+                    continue
+
+                record = self._parse(line, region_gene)
+                if record is not None:
+                    yield record
+                else:
+                    unresolved += 1
+        finally:
+            self.skipped = {"off_target": off_target, "malformed": malformed, "unresolved": unresolved}
+
+    def _parse(self, line: str, region_gene: Optional[str]) -> Any:
+        return _parse_record(line, region_gene, self.kb)
+
+
+class GenotypeMatrix:
+    """
+    Multi-sample genotypes for the retained pharmacogene records: one
+    Variant per site plus a (variants × samples) dosage matrix, one
+    compact array('b') row per site (see genotype_dosage for the codes).
+    """
+
+    def __init__(self, samples: List[str], variants: List[Variant], dosages: List[array]):
+        self.samples = samples
+        self.variants = variants
+        self.dosages = dosages
+
+    def gene_rows(self, gene: str) -> List[int]:
+        return [i for i, v in enumerate(self.variants) if v.gene == gene]
+
+
+class CohortReader(VCFReader):
+    """VCFReader that yields (site, dosage row) pairs across every sample column."""
+
+    def _parse(self, line: str, region_gene: Optional[str]) -> Any:
         parts = line.split("\t")
         if len(parts) < 9:
-            continue
-
-        chrom, pos, vid, ref, alt, qual, filt, info = parts[:8]
-        fmt = parts[8] if len(parts) > 8 else "GT"
-        sample = parts[9] if len(parts) > 9 else "0/0"
-
-        # Parse FORMAT/sample for genotype
-        fmt_fields = fmt.split(":")
-        sample_fields = sample.split(":")
-        genotype = "0/0"
-        if "GT" in fmt_fields:
-            gt_idx = fmt_fields.index("GT")
-            if gt_idx < len(sample_fields):
-                genotype = sample_fields[gt_idx]
-
-        # Skip homozygous reference (not a variant of interest)
-        if genotype in ("0/0", "0|0"):
-            # Still include for known PGx positions even if ref
-            pass
-
-        # Parse INFO field
-        info_dict: Dict[str, str] = {}
-        for item in info.split(";"):
-            if "=" in item:
-                k, v = item.split("=", 1)
-                info_dict[k.strip()] = v.strip()
-
-        gene = info_dict.get("GENE", "")
-        star = info_dict.get("STAR", "*1")
-        rsid = info_dict.get("RS", vid if vid != "." else f"pos{pos}")
-
-        if not gene:
-            continue
+            return None
+        variant = _record_from_parts(parts, region_gene, self.kb)
+        if variant is None:
+            return None
+        return variant, _dosage_row(parts[8], parts[9:])
+
+
+def parse_vcf(content: str, kb: Optional[KnowledgeBase] = None) -> Tuple[List[Variant], str, bool]:
+    """
+    Parse VCF file content and return (variants, patient_id, success).
+    """
+    return parse_vcf_lines(content.splitlines(), kb)
+
+
+def parse_vcf_lines(
+    lines: Iterable[str], kb: Optional[KnowledgeBase] = None
+) -> Tuple[List[Variant], str, bool]:
+    """parse_vcf over an iterable of lines (e.g. from open_vcf_lines)."""
+    reader = VCFReader(lines, kb)
+    variants = list(reader)
+    _count_records(reader, len(variants))
+    return variants, reader.patient_id, len(variants) > 0
 
+
+def _count_records(reader: VCFReader, retained: int) -> None:
+    metrics.VARIANTS_PARSED.inc(retained)
+    for reason, n in reader.skipped.items():
+        if n:
+            metrics.RECORDS_SKIPPED.inc(n, reason=reason)
+
+
+def parse_vcf_cohort(lines: Iterable[str], kb: Optional[KnowledgeBase] = None) -> GenotypeMatrix:
+    """
+    Parse a (joint-called) multi-sample VCF into a GenotypeMatrix.
+    Use open_vcf_lines to feed it from a plain/gzip/bgzip stream.
+    """
+    reader = CohortReader(lines, kb)
+    variants: List[Variant] = []
+    dosages: List[array] = []
+    for variant, row in reader:
+        variants.append(variant)
+        dosages.append(row)
+    _count_records(reader, len(variants))
+    return GenotypeMatrix(reader.samples or [reader.patient_id], variants, dosages)
+
+
+def open_vcf_lines(
+    stream: BinaryIO,
+    max_bytes: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    index: Optional[BinaryIO] = None,
+    kb: Optional[KnowledgeBase] = None,
+) -> Iterator[str]:
+    """
+    Yield text lines from a seekable plain, gzip or bgzip VCF stream.
+    With a tabix index over bgzip input, only the header and the records in
+    the knowledge base's pharmacogene regions are read. max_bytes applies to
+    the raw (compressed) bytes. Raises TabixError for a malformed index.
+    """
+    if index is not None and is_bgzf(stream):
+        tbi = TabixIndex.load(index)
+        return fetch_regions(stream, tbi, (kb or knowledge_base.current()).regions.values())
+
+    raw: BinaryIO = _LimitedReader(stream, max_bytes) if max_bytes else stream
+    if is_gzip(stream):
+        # GzipFile reads multi-member (bgzip) files transparently
+        raw = gzip.GzipFile(fileobj=raw, mode="rb")
+    return iter_lines(raw, chunk_size=chunk_size)
+
+
+def parse_vcf_stream(
+    stream: BinaryIO,
+    max_bytes: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    index: Optional[BinaryIO] = None,
+    kb: Optional[KnowledgeBase] = None,
+) -> Tuple[List[Variant], str, bool]:
+    """
+    Parse a binary VCF stream (e.g. UploadFile.file) without loading it whole.
+    Returns (variants, patient_id, success) like parse_vcf.
+    """
+    kb = kb or knowledge_base.current()
+    return parse_vcf_lines(open_vcf_lines(stream, max_bytes, chunk_size, index, kb), kb)
+
+
+def parse_vcf_file(path: str, max_bytes: Optional[int] = None) -> Tuple[List[Variant], str, bool]:
+    """
+    Parse a VCF on disk (.vcf, .vcf.gz). A tabix index next to the file
+    (path + ".tbi") is picked up automatically.
+    """
+    index_path = path + ".tbi"
+    with open(path, "rb") as stream:
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as index:
+                return parse_vcf_stream(stream, max_bytes=max_bytes, index=index)
+        return parse_vcf_stream(stream, max_bytes=max_bytes)
+
+
+def _parse_record(
+    line: str, region_gene: Optional[str] = None, kb: Optional[KnowledgeBase] = None
+) -> Optional[Variant]:
+    """
+    Parse a single VCF data line into a Variant, or None if the
+    record is malformed or cannot be assigned to a gene. An explicit GENE
+    INFO tag takes precedence over the coordinate-derived region_gene.
+    """
+    parts = line.split("\t")
+    if len(parts) < 9:
+        return None
+    return _record_from_parts(parts, region_gene, kb or knowledge_base.current())
+
+
+def _record_from_parts(
+    parts: List[str], region_gene: Optional[str], kb: KnowledgeBase
+) -> Optional[Variant]:
+    """Build the Variant for a split data line (genotype from the first sample)."""
+    chrom, pos, vid, ref, alt, qual, filt, info = parts[:8]
+    fmt = parts[8] if len(parts) > 8 else "GT"
+    sample = parts[9] if len(parts) > 9 else "0/0"
+
+    # Parse FORMAT/sample for genotype
+    fmt_fields = fmt.split(":")
+    sample_fields = sample.split(":")
+    genotype = "0/0"
+    if "GT" in fmt_fields:
+        gt_idx = fmt_fields.index("GT")
+        if gt_idx < len(sample_fields):
+            genotype = sample_fields[gt_idx]
+
+    # Parse INFO field
+    info_dict: Dict[str, str] = {}
+    for item in info.split(";"):
+        if "=" in item:
+            k, v = item.split("=", 1)
+            info_dict[k.strip()] = v.strip()
+
+    gene = info_dict.get("GENE", "")
+    star = info_dict.get("STAR", "")
+    rsid = info_dict.get("RS", vid if vid != "." else f"pos{pos}")
+
+    if not star:
         try:
-            variant = DetectedVariant(
-                rsid=rsid,
-                gene=gene,
-                star_allele=star,
-                chromosome=chrom,
-                position=int(pos),
-                ref=ref,
-                alt=alt,
-                genotype=genotype,
-            )
-            variants.append(variant)
-        except Exception:
-            continue
-
-    success = len(variants) > 0
-    return variants, patient_id, success
-
-
-def get_gene_variants(variants: List[DetectedVariant], gene: str) -> List[DetectedVariant]:
+            defn = kb.lookup_star_allele(chrom, int(pos), ref, alt, vid)
+        except ValueError:
+            defn = None
+        if defn is not None:
+            def_gene, star, def_rsid = defn
+            gene = gene or def_gene
+            if "RS" not in info_dict:
+                rsid = def_rsid
+    gene = gene or region_gene or ""
+    star = star or "*1"
+
+    if not gene:
+        return None
+
+    try:
+        position = int(pos)
+    except ValueError:
+        return None
+    return Variant(rsid, gene, star, chrom, position, ref, alt, genotype)
+
+
+def genotype_dosage(gt: str) -> int:
+    """
+    Diploid call → dosage code used for diplotype calling:
+    0 = 0/0, 2 = 1/1, 1 = any other diploid call, -1 = not a diploid call.
+    """
+    parts = gt.replace("|", "/").split("/")
+    if len(parts) != 2:
+        return -1
+    if parts[0] == "0" and parts[1] == "0":
+        return 0
+    if parts[0] == "1" and parts[1] == "1":
+        return 2
+    return 1
+
+
+def _dosage_row(fmt: str, samples: List[str]) -> array:
+    fmt_fields = fmt.split(":")
+    if "GT" not in fmt_fields:
+        return array("b", [0]) * len(samples)
+    gt_idx = fmt_fields.index("GT")
+
+    # Joint-called files repeat a handful of GT strings; memoize per row
+    codes: Dict[str, int] = {}
+    row = array("b", bytes(len(samples)))
+    for j, sample in enumerate(samples):
+        fields = sample.split(":", gt_idx + 1)
+        gt = fields[gt_idx] if gt_idx < len(fields) else "0/0"
+        code = codes.get(gt)
+        if code is None:
+            code = codes[gt] = genotype_dosage(gt)
+        row[j] = code
+    return row
+
+
+def get_gene_variants(variants: List[AnyVariant], gene: str) -> List[AnyVariant]:
     return [v for v in variants if v.gene == gene]
 
 
-def determine_diplotype(variants: List[DetectedVariant], gene: str) -> str:
+def group_by_gene(variants: List[AnyVariant]) -> Dict[str, List[AnyVariant]]:
+    """Variants bucketed by gene in one pass, keeping file order within a gene."""
+    groups: Dict[str, List[AnyVariant]] = {}
+    for v in variants:
+        groups.setdefault(v.gene, []).append(v)
+    return groups
+
+
+ALLELE_RANK = {"nonfunctional": 3, "decreased": 2, "increased": 1, "normal": 0}
+
+
+def allele_rank(kb: KnowledgeBase, gene: str, star: str) -> int:
+    """Impact rank used to pick the most non-wildtype allele on each strand."""
+    return ALLELE_RANK[kb.get_allele_function(gene, star)]
+
+
+def determine_diplotype(variants: List[AnyVariant], gene: str, kb: Optional[KnowledgeBase] = None) -> str:
     """
     Infer diplotype from detected variants for a given gene.
     Simplified: takes up to two star alleles (het = one of each, hom = both same).
     """
-    gene_vars = get_gene_variants(variants, gene)
+    return diplotype_from_gene_variants(get_gene_variants(variants, gene), gene, kb)
+
+
+def diplotype_from_gene_variants(
+    gene_vars: List[AnyVariant], gene: str, kb: Optional[KnowledgeBase] = None
+) -> str:
+    """determine_diplotype for variants already filtered to the gene."""
+    kb = kb or knowledge_base.current()
     if not gene_vars:
         return "*1/*1"  # Assume wildtype if no variants detected
 
     alleles = []
     for v in gene_vars:
-        gt = v.genotype.replace("|", "/")
-        parts = gt.split("/")
         # Heterozygous: one ref allele (*1) and one alt allele (star)
-        if len(parts) == 2:
-            if parts[0] == "0" and parts[1] == "1":
-                alleles.append(("*1", v.star_allele))
-            elif parts[0] == "1" and parts[1] == "1":
-                alleles.append((v.star_allele, v.star_allele))
-            elif parts[0] == "0" and parts[1] == "0":
-                alleles.append(("*1", "*1"))
-            else:
-                alleles.append(("*1", v.star_allele))
+        dosage = genotype_dosage(v.genotype)
+        if dosage == 0:
+            alleles.append(("*1", "*1"))
+        elif dosage == 1:
+            alleles.append(("*1", v.star_allele))
+        elif dosage == 2:
+            alleles.append((v.star_allele, v.star_allele))
 
     if not alleles:
         return "*1/*1"
 
-    # Merge alleles: pick the highest-impact pair
-    left_alleles = [a[0] for a in alleles]
-    right_alleles = [a[1] for a in alleles]
-    
-    # Pick the most non-wildtype allele on each side
-    def rank(a):
-        from app.utils.knowledge_base import STAR_ALLELE_FUNCTION
-        f = STAR_ALLELE_FUNCTION.get(a, "normal")
-        return {"nonfunctional": 3, "decreased": 2, "increased": 1, "normal": 0}.get(f, 0)
-
-    left = max(left_alleles, key=rank)
-    right = max(right_alleles, key=rank)
+    # Merge alleles: pick the most non-wildtype allele on each side
+    left = max((a[0] for a in alleles), key=lambda star: allele_rank(kb, gene, star))
+    right = max((a[1] for a in alleles), key=lambda star: allele_rank(kb, gene, star))
     return f"{left}/{right}"
+
+
+def call_diplotypes(matrix: GenotypeMatrix, gene: str, kb: Optional[KnowledgeBase] = None) -> List[str]:
+    """
+    Batched determine_diplotype: one diplotype per sample, computed by
+    sweeping the gene's dosage rows across all samples at once.
+    """
+    kb = kb or knowledge_base.current()
+    n = len(matrix.samples)
+    rows = matrix.gene_rows(gene)
+    if not rows:
+        return ["*1/*1"] * n
+
+    # -1 = no allele seen yet, so the first candidate always wins (like max())
+    left_rank = array("b", [-1]) * n
+    right_rank = array("b", [-1]) * n
+    left = ["*1"] * n
+    right = ["*1"] * n
+    for i in rows:
+        star = matrix.variants[i].star_allele
+        star_rank = allele_rank(kb, gene, star)
+        for j, dosage in enumerate(matrix.dosages[i]):
+            if dosage < 0:
+                continue
+            if dosage == 2:
+                if star_rank > left_rank[j]:
+                    left_rank[j], left[j] = star_rank, star
+            elif left_rank[j] < 0:
+                left_rank[j], left[j] = 0, "*1"
+            if dosage >= 1:
+                if star_rank > right_rank[j]:
+                    right_rank[j], right[j] = star_rank, star
+            elif right_rank[j] < 0:
+                right_rank[j], right[j] = 0, "*1"
+
+    return [f"{l}/{r}" for l, r in zip(left, right)]
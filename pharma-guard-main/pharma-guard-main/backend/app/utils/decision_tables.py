@@ -0,0 +1,145 @@
+"""
+Decision Tables — the knowledge base compiled into dense lookup tables.
+
+When a KnowledgeBase snapshot is built, every (gene, allele-function pair) is
+resolved to a phenotype and every (drug, gene, phenotype) to its risk
+assessment and clinical recommendation, so the per-drug hot path is a couple
+of integer-indexed reads:
+
+    allele_codes[(gene, star)] → allele function code
+    pair code = code(a1) * N_FUNCTIONS + code(a2)
+    gene_decisions[(drug, gene)][pair code] → Decision(phenotype, risk, clinical_rec)
+
+Multi-gene drugs combine their per-gene decisions in combine(): a matching
+combination rule (e.g. warfarin with CYP2C9 PM and VKORC1 PM) wins, otherwise
+the most severe gene decides. Nothing here iterates over the catalogue, so a
+request costs the same whether the snapshot holds six drugs or six hundred.
+
+The tables live on the snapshot (kb.tables) and are rebuilt with it.
+"""
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Sequence, Tuple
+
+from app.models.schemas import RiskAssessment
+from app.utils.knowledge_base import ALLELE_FUNCTIONS
+
+if TYPE_CHECKING:
+    from app.utils.knowledge_base import KnowledgeBase
+
+# Allele function → code; the order is only an index, not a severity.
+# The snapshot rejects any function outside this vocabulary at build time.
+FUNCTIONS = ALLELE_FUNCTIONS
+FUNCTION_CODE = {func: code for code, func in enumerate(FUNCTIONS)}
+N_FUNCTIONS = len(FUNCTIONS)
+NORMAL = FUNCTION_CODE["normal"]
+
+DEFAULT_RULE = ("Unknown", 0.5, "moderate", "")
+SEVERITY_RANK = {"none": 0, "low": 1, "moderate": 2, "high": 3, "critical": 4}
+
+
+class Decision(NamedTuple):
+    phenotype: str
+    risk: RiskAssessment      # shared, treat as read-only
+    clinical_rec: dict        # shared, treat as read-only
+
+
+class Verdict(NamedTuple):
+    driver: int                  # index into kb.drug_genes[drug] of the deciding gene
+    decision: Decision
+    per_gene: Tuple[Decision, ...]
+
+
+class DecisionTables(NamedTuple):
+    gene_phenotypes: Dict[str, List[str]]                       # indexed by pair code
+    gene_decisions: Dict[Tuple[str, str], List[Decision]]       # (drug, gene), indexed by pair code
+    combinations: Dict[str, Dict[Tuple[str, ...], Decision]]    # drug → per-gene phenotypes → override
+    clinical_recs: Dict[Tuple[str, str, str], dict]             # (drug, gene, phenotype), defaults filled in
+    allele_codes: Dict[Tuple[str, str], int]
+
+
+def _risk(rule: Tuple[str, float, str, str]) -> RiskAssessment:
+    risk_label, confidence, severity, _ = rule
+    return RiskAssessment(risk_label=risk_label, confidence_score=confidence, severity=severity)
+
+
+def _risk_for(kb: "KnowledgeBase", drug: str, gene: str, phenotype: str) -> RiskAssessment:
+    gene_rules = kb.risk_rules.get(drug, {}).get(gene, {})
+    return _risk(gene_rules.get(phenotype, gene_rules.get("Unknown", DEFAULT_RULE)))
+
+
+def _compile_combinations(kb: "KnowledgeBase") -> Dict[str, Dict[Tuple[str, ...], Decision]]:
+    combinations: Dict[str, Dict[Tuple[str, ...], Decision]] = {}
+    for drug, rules in kb.combination_rules.items():
+        genes = kb.drug_genes.get(drug)
+        if genes is None:
+            raise ValueError(f"Combination rule for unknown drug {drug}")
+        for phenotypes, rule, rec in rules:
+            if set(phenotypes) != set(genes):
+                raise ValueError(f"Combination rule for {drug} must give a phenotype for each of {list(genes)}")
+            key = tuple(phenotypes[gene] for gene in genes)
+            # Reported phenotype is the primary gene's; risk and advice come from the rule
+            combinations.setdefault(drug, {})[key] = Decision(
+                key[0], _risk(rule), rec or kb.get_clinical_rec(drug, key[0], genes[0])
+            )
+    return combinations
+
+
+def compile_tables(kb: "KnowledgeBase") -> DecisionTables:
+    pairs = [(f1, f2) for f1 in FUNCTIONS for f2 in FUNCTIONS]
+    phenotypes = {
+        gene: [kb.diplotype_to_phenotype(gene, f1, f2) for f1, f2 in pairs]
+        for gene in kb.supported_genes
+    }
+
+    recs: Dict[Tuple[str, str, str], dict] = {}
+    gene_decisions: Dict[Tuple[str, str], List[Decision]] = {}
+    for drug, genes in kb.drug_genes.items():
+        for gene in genes:
+            by_phenotype = {}
+            for phenotype in set(phenotypes[gene]) | set(kb.risk_rules.get(drug, {}).get(gene, {})):
+                rec = recs[(drug, gene, phenotype)] = kb.get_clinical_rec(drug, phenotype, gene)
+                by_phenotype[phenotype] = Decision(phenotype, _risk_for(kb, drug, gene, phenotype), rec)
+            gene_decisions[(drug, gene)] = [by_phenotype[p] for p in phenotypes[gene]]
+
+    allele_codes = {key: FUNCTION_CODE[function] for key, (function, _) in kb.allele_functions.items()}
+    return DecisionTables(phenotypes, gene_decisions, _compile_combinations(kb), recs, allele_codes)
+
+
+def allele_code(kb: "KnowledgeBase", gene: str, star: str) -> int:
+    return kb.tables.allele_codes.get((gene, star), NORMAL)
+
+
+def diplotype_code(kb: "KnowledgeBase", gene: str, diplotype: str) -> int:
+    # Two dict reads; never memoized, since the snapshot is shared and immutable
+    # and diplotype strings come from user input
+    parts = diplotype.split("/")
+    a1, a2 = parts[0], parts[1] if len(parts) > 1 else "*1"
+    return allele_code(kb, gene, a1) * N_FUNCTIONS + allele_code(kb, gene, a2)
+
+
+def combine(kb: "KnowledgeBase", drug_upper: str, per_gene: Sequence[Decision]) -> Verdict:
+    """
+    Resolve per-gene decisions (ordered as kb.drug_genes[drug]) to one verdict:
+    a combination rule for the exact phenotype tuple overrides; otherwise the
+    highest severity wins, then the highest confidence, then the primary gene.
+    """
+    per_gene = tuple(per_gene)
+    if len(per_gene) == 1:
+        return Verdict(0, per_gene[0], per_gene)
+    combo = kb.tables.combinations.get(drug_upper)
+    if combo:
+        hit = combo.get(tuple(d.phenotype for d in per_gene))
+        if hit is not None:
+            return Verdict(0, hit, per_gene)
+    driver = 0
+    best = (-1, -1.0)
+    for i, d in enumerate(per_gene):
+        rank = (SEVERITY_RANK.get(d.risk.severity, 0), d.risk.confidence_score)
+        if rank > best:
+            driver, best = i, rank
+    return Verdict(driver, per_gene[driver], per_gene)
+
+
+def clinical_rec_for(kb: "KnowledgeBase", drug: str, phenotype: str, gene: str = "") -> dict:
+    gene = gene or kb.drug_gene_map.get(drug, "")
+    rec = kb.tables.clinical_recs.get((drug, gene, phenotype))
+    return rec if rec is not None else kb.get_clinical_rec(drug, phenotype, gene)
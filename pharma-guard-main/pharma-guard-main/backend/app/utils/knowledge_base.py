@@ -1,65 +1,59 @@
 """
 PharmaGuard Knowledge Base
-CPIC-aligned pharmacogenomics data for 6 genes and 6 drugs.
-No external API needed — all rules encoded here.
+CPIC-aligned pharmacogenomics data, loaded from versioned data files.
+No external API needed — all rules live in app/data/knowledge_base/.
+
+The data files (CPIC table shapes: gene–drug pairs, allele functionality and
+allele definitions as CSV; genes, risk rules, recommendations and multi-gene
+combination rules as JSON) are compiled into an immutable KnowledgeBase
+snapshot with every lookup index and decision table prebuilt. Compiled
+snapshots are cached on disk as a pickle keyed by the data files' content
+fingerprint, so cold starts skip parsing.
+
+A drug may depend on several genes (warfarin: CYP2C9 + VKORC1). Each row of
+gene_drug_pairs.csv has a role, primary or modifier; the snapshot indexes the
+pairs in both directions (gene_drug_map, drug_genes) and risk rules are keyed
+drug → gene → phenotype.
+
+current() returns the active snapshot; reload() builds a new one and swaps it
+in with a single assignment. Requests resolve the snapshot once and keep
+using it, so a reload never changes the rules under an in-flight analysis.
 """
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+import csv
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+KB_DATA_DIR = os.getenv(
+    "KB_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "knowledge_base")
+)
+KB_SNAPSHOT_PATH = os.getenv("KB_SNAPSHOT_PATH", "")   # empty = <KB_DATA_DIR>/.snapshot.pickle
+KB_SNAPSHOTS_KEPT = 4                                    # recent snapshots resolvable by fingerprint
+
+DATA_FILES = (
+    "manifest.json", "genes.json", "gene_drug_pairs.csv", "allele_functionality.csv",
+    "allele_definitions.csv", "risk_rules.json", "recommendations.json", "combination_rules.json",
+)
+SNAPSHOT_FORMAT = 2   # bump when the KnowledgeBase layout changes
+
+NORMAL_ALLELE = ("normal", 1.0)
+# Function vocabulary the phenotype logic and decision tables understand
+ALLELE_FUNCTIONS = ("nonfunctional", "decreased", "normal", "increased")
+
+_current: Optional["KnowledgeBase"] = None
+_recent: Dict[str, "KnowledgeBase"] = {}
+_lock = threading.Lock()
 
-# ─── GENE → DRUG INTERACTION MAP ─────────────────────────────────────────────
-GENE_DRUG_MAP = {
-    "CYP2D6":  ["CODEINE"],
-    "CYP2C19": ["CLOPIDOGREL"],
-    "CYP2C9":  ["WARFARIN"],
-    "SLCO1B1": ["SIMVASTATIN"],
-    "TPMT":    ["AZATHIOPRINE"],
-    "DPYD":    ["FLUOROURACIL"],
-}
-
-DRUG_GENE_MAP = {v: k for k, values in GENE_DRUG_MAP.items() for v in values}
-
-SUPPORTED_DRUGS = list(DRUG_GENE_MAP.keys())
-SUPPORTED_GENES = list(GENE_DRUG_MAP.keys())
-
-# ─── STAR ALLELE → PHENOTYPE MAP ─────────────────────────────────────────────
-STAR_ALLELE_FUNCTION = {
-    # CYP2D6
-    "*1":  "normal",
-    "*2":  "normal",
-    "*4":  "nonfunctional",
-    "*5":  "nonfunctional",
-    "*6":  "nonfunctional",
-    "*9":  "decreased",
-    "*10": "decreased",
-    "*17": "decreased",
-    "*41": "decreased",
-    "*1xN": "increased",  # gene duplication
-    # CYP2C19
-    "*2":  "nonfunctional",
-    "*3":  "nonfunctional",
-    "*17": "increased",
-    # CYP2C9
-    "*2":  "decreased",
-    "*3":  "nonfunctional",
-    # SLCO1B1
-    "*5":  "decreased",
-    "*15": "decreased",
-    # TPMT
-    "*3A": "nonfunctional",
-    "*3B": "nonfunctional",
-    "*3C": "nonfunctional",
-    "*2":  "nonfunctional",
-    # DPYD
-    "*2A": "nonfunctional",
-    "*13": "nonfunctional",
-}
-
-def get_allele_function(star: str) -> str:
-    return STAR_ALLELE_FUNCTION.get(star, "normal")
 
 # ─── DIPLOTYPE → PHENOTYPE LOGIC ─────────────────────────────────────────────
-def diplotype_to_phenotype(gene: str, allele1_func: str, allele2_func: str) -> str:
+def phenotype_from_functions(model: str, allele1_func: str, allele2_func: str) -> str:
     funcs = sorted([allele1_func, allele2_func])
 
-    if gene in ("CYP2D6", "CYP2C19", "CYP2C9", "TPMT", "DPYD"):
+    if model == "metabolizer":
         if funcs == ["nonfunctional", "nonfunctional"]:
             return "PM"   # Poor Metabolizer
         elif "nonfunctional" in funcs and "decreased" in funcs:
@@ -76,7 +70,7 @@ def diplotype_to_phenotype(gene: str, allele1_func: str, allele2_func: str) -> s
             return "URM"  # Ultra-Rapid Metabolizer
         else:
             return "NM"
-    elif gene == "SLCO1B1":
+    elif model in ("transporter", "sensitivity"):
         if "nonfunctional" in funcs or funcs == ["decreased", "decreased"]:
             return "PM"
         elif "decreased" in funcs:
@@ -85,129 +79,362 @@ def diplotype_to_phenotype(gene: str, allele1_func: str, allele2_func: str) -> s
             return "NM"
     return "Unknown"
 
-# ─── PHENOTYPE → RISK RULES ───────────────────────────────────────────────────
-RISK_RULES = {
-    "CODEINE": {
-        "PM":  ("Ineffective", 0.91, "moderate", "Codeine is a prodrug requiring CYP2D6 to convert to morphine. PMs cannot activate it."),
-        "IM":  ("Adjust Dosage", 0.78, "low",      "Reduced conversion to morphine; consider dose adjustment or alternative analgesic."),
-        "NM":  ("Safe", 0.95, "none",              "Normal CYP2D6 activity; standard codeine dosing appropriate."),
-        "URM": ("Toxic", 0.97, "critical",         "Ultra-rapid conversion to morphine; risk of life-threatening respiratory depression."),
-        "Unknown": ("Unknown", 0.50, "moderate",   "Phenotype undetermined; exercise caution."),
-    },
-    "WARFARIN": {
-        "PM":  ("Adjust Dosage", 0.93, "high",     "Reduced CYP2C9 metabolism; warfarin accumulates causing serious bleeding risk."),
-        "IM":  ("Adjust Dosage", 0.82, "moderate", "Intermediate metabolism; start with reduced dose and monitor INR closely."),
-        "NM":  ("Safe", 0.94, "none",              "Normal CYP2C9 activity; standard warfarin dosing appropriate."),
-        "URM": ("Safe", 0.72, "low",               "Slightly faster metabolism; standard or slightly higher dose may be needed."),
-        "Unknown": ("Unknown", 0.50, "moderate",   "Phenotype undetermined; start low and titrate with INR monitoring."),
-    },
-    "CLOPIDOGREL": {
-        "PM":  ("Ineffective", 0.96, "critical",   "CYP2C19 PMs cannot convert clopidogrel to active form; high risk of stent thrombosis."),
-        "IM":  ("Adjust Dosage", 0.80, "high",     "Reduced activation; consider prasugrel or ticagrelor as alternative antiplatelet."),
-        "NM":  ("Safe", 0.93, "none",              "Normal CYP2C19 activation of clopidogrel; standard dosing appropriate."),
-        "URM": ("Adjust Dosage", 0.70, "low",      "Possibly enhanced platelet inhibition; monitor for bleeding."),
-        "Unknown": ("Unknown", 0.50, "high",       "Phenotype undetermined; consider alternative antiplatelet therapy."),
-    },
-    "SIMVASTATIN": {
-        "PM":  ("Toxic", 0.92, "high",             "SLCO1B1 deficiency causes simvastatin accumulation; high myopathy/rhabdomyolysis risk."),
-        "IM":  ("Adjust Dosage", 0.84, "moderate", "Reduced hepatic uptake; use lower simvastatin dose or switch to pravastatin/rosuvastatin."),
-        "NM":  ("Safe", 0.95, "none",              "Normal SLCO1B1 transport; standard simvastatin dosing appropriate."),
-        "URM": ("Safe", 0.88, "none",              "Normal to enhanced transport; standard dosing appropriate."),
-        "Unknown": ("Unknown", 0.50, "moderate",   "Transport function undetermined; monitor for muscle symptoms."),
-    },
-    "AZATHIOPRINE": {
-        "PM":  ("Toxic", 0.98, "critical",         "TPMT-deficient patients accumulate toxic thioguanine nucleotides; risk of severe myelosuppression."),
-        "IM":  ("Adjust Dosage", 0.87, "high",     "Reduced TPMT activity; start at 30-70% of standard dose with CBC monitoring."),
-        "NM":  ("Safe", 0.94, "none",              "Normal TPMT activity; standard azathioprine dosing appropriate."),
-        "URM": ("Safe", 0.80, "low",               "High TPMT activity; may need higher doses for therapeutic effect."),
-        "Unknown": ("Unknown", 0.50, "high",       "TPMT status unknown; start low and monitor CBC weekly."),
-    },
-    "FLUOROURACIL": {
-        "PM":  ("Toxic", 0.99, "critical",         "DPYD deficiency causes 5-FU accumulation; risk of life-threatening toxicity including neutropenia, mucositis, neurotoxicity."),
-        "IM":  ("Adjust Dosage", 0.90, "high",     "Partial DPYD deficiency; reduce 5-FU dose by 25-50% and monitor toxicity closely."),
-        "NM":  ("Safe", 0.93, "none",              "Normal DPYD activity; standard 5-FU dosing appropriate."),
-        "URM": ("Safe", 0.85, "none",              "Normal DPYD activity; standard dosing appropriate."),
-        "Unknown": ("Unknown", 0.50, "high",       "DPYD status unknown; consider upfront genotyping before starting therapy."),
-    },
-}
-
-# ─── CLINICAL RECOMMENDATIONS ─────────────────────────────────────────────────
-CLINICAL_RECS = {
-    ("CODEINE", "PM"): {
-        "action": "Avoid Codeine",
-        "dosing_guidance": "Codeine is contraindicated. Switch to non-opioid analgesic (e.g. NSAIDs, acetaminophen) or titrate with tramadol cautiously.",
-        "alternative_drugs": ["Acetaminophen", "NSAIDs", "Tramadol (with caution)", "Morphine (direct)"],
-        "monitoring_required": False,
-        "cpic_guideline": "CPIC Guideline for Codeine and CYP2D6 — DOI: 10.1002/cpt.1132",
-    },
-    ("CODEINE", "URM"): {
-        "action": "Contraindicated — Toxicity Risk",
-        "dosing_guidance": "Codeine is contraindicated in ultra-rapid metabolizers. Morphine forms at dangerous rates causing respiratory depression.",
-        "alternative_drugs": ["Acetaminophen", "NSAIDs", "Hydromorphone"],
-        "monitoring_required": True,
-        "cpic_guideline": "CPIC Guideline for Codeine and CYP2D6 — DOI: 10.1002/cpt.1132",
-    },
-    ("CODEINE", "IM"): {
-        "action": "Use with Caution / Reduce Dose",
-        "dosing_guidance": "Consider 75% of standard dose. Monitor for inadequate analgesia. Prefer non-opioid first line.",
-        "alternative_drugs": ["Acetaminophen", "NSAIDs"],
-        "monitoring_required": True,
-        "cpic_guideline": "CPIC Guideline for Codeine and CYP2D6 — DOI: 10.1002/cpt.1132",
-    },
-    ("WARFARIN", "PM"): {
-        "action": "Reduce Initial Dose Significantly",
-        "dosing_guidance": "Start at 50% of standard initial dose. Target INR 2.0–3.0. Weekly INR monitoring for first month.",
-        "alternative_drugs": ["Apixaban", "Rivaroxaban", "Dabigatran"],
-        "monitoring_required": True,
-        "cpic_guideline": "CPIC Guideline for Warfarin — DOI: 10.1038/clpt.2011.10",
-    },
-    ("CLOPIDOGREL", "PM"): {
-        "action": "Switch to Alternative Antiplatelet",
-        "dosing_guidance": "Clopidogrel cannot be adequately activated. Switch to prasugrel 10mg or ticagrelor 90mg BID.",
-        "alternative_drugs": ["Prasugrel", "Ticagrelor"],
-        "monitoring_required": False,
-        "cpic_guideline": "CPIC Guideline for Clopidogrel and CYP2C19 — DOI: 10.1002/cpt.1559",
-    },
-    ("SIMVASTATIN", "PM"): {
-        "action": "Switch Statin",
-        "dosing_guidance": "Use pravastatin, rosuvastatin, or fluvastatin which are not SLCO1B1-dependent. Avoid simvastatin.",
-        "alternative_drugs": ["Pravastatin", "Rosuvastatin", "Fluvastatin"],
-        "monitoring_required": True,
-        "cpic_guideline": "CPIC Guideline for Simvastatin and SLCO1B1 — DOI: 10.1002/cpt.205",
-    },
-    ("AZATHIOPRINE", "PM"): {
-        "action": "Contraindicated — Use Alternative",
-        "dosing_guidance": "Start with 10% of standard dose OR switch to mycophenolate mofetil. Monitor CBC twice weekly.",
-        "alternative_drugs": ["Mycophenolate Mofetil", "Cyclosporine"],
-        "monitoring_required": True,
-        "cpic_guideline": "CPIC Guideline for Thiopurines and TPMT/NUDT15 — DOI: 10.1002/cpt.1681",
-    },
-    ("FLUOROURACIL", "PM"): {
-        "action": "Contraindicated — Life-Threatening Toxicity",
-        "dosing_guidance": "Avoid 5-FU and capecitabine. If no alternatives, reduce dose by ≥50% with intensive monitoring.",
-        "alternative_drugs": ["Irinotecan (if applicable)", "Oxaliplatin-based regimen"],
-        "monitoring_required": True,
-        "cpic_guideline": "CPIC Guideline for Fluoropyrimidines and DPYD — DOI: 10.1002/cpt.1930",
-    },
-}
-
-def get_clinical_rec(drug: str, phenotype: str) -> dict:
-    key = (drug, phenotype)
-    default = {
+
+def default_clinical_rec(drug: str) -> dict:
+    return {
         "action": "Standard Dosing",
         "dosing_guidance": "No dose adjustment required based on current pharmacogenomic profile.",
         "alternative_drugs": [],
         "monitoring_required": False,
         "cpic_guideline": f"See CPIC guidelines at cpicpgx.org for {drug}",
     }
-    return CLINICAL_RECS.get(key, default)
-
-# ─── BIOLOGICAL MECHANISM EXPLANATIONS ───────────────────────────────────────
-MECHANISMS = {
-    "CYP2D6": "CYP2D6 is a cytochrome P450 enzyme in the liver responsible for metabolizing ~25% of all clinical drugs. It oxidizes opioids (codeine→morphine), antidepressants, and beta-blockers.",
-    "CYP2C19": "CYP2C19 catalyzes the bioactivation of clopidogrel to its active thiol metabolite, which irreversibly inhibits platelet P2Y12 receptors. Loss of function abolishes antiplatelet effect.",
-    "CYP2C9": "CYP2C9 is the primary enzyme metabolizing S-warfarin, the more potent enantiomer. Reduced activity causes warfarin accumulation and dramatically elevated bleeding risk.",
-    "SLCO1B1": "SLCO1B1 encodes OATP1B1, a hepatic uptake transporter. Variants (especially *5) reduce simvastatin clearance from blood into liver, causing plasma accumulation and myotoxicity.",
-    "TPMT": "Thiopurine methyltransferase inactivates 6-mercaptopurine (azathioprine metabolite). TPMT-deficient patients shunt drug toward toxic thioguanine nucleotides that cause myelosuppression.",
-    "DPYD": "Dihydropyrimidine dehydrogenase degrades 80-85% of administered fluorouracil. DPYD deficiency causes catastrophic drug accumulation leading to neutropenia, mucositis, and neurotoxicity.",
-}
+
+
+# ─── INDEX BUILDERS ──────────────────────────────────────────────────────────
+def _build_region_index(regions: Dict[str, Tuple[str, int, int]]) -> Dict[str, Tuple[List[int], List[int], List[str]]]:
+    """
+    Compile gene regions into per-chromosome sorted (starts, ends, genes)
+    arrays, registered under both "22" and "chr22" style names.
+    Regions on a chromosome must not overlap.
+    """
+    by_chrom: Dict[str, List[Tuple[int, int, str]]] = {}
+    for gene, (chrom, start, end) in regions.items():
+        for name in (chrom, "chr" + chrom):
+            by_chrom.setdefault(name, []).append((start, end, gene))
+
+    index = {}
+    for name, intervals in by_chrom.items():
+        intervals.sort()
+        index[name] = (
+            [start for start, _, _ in intervals],
+            [end for _, end, _ in intervals],
+            [gene for _, _, gene in intervals],
+        )
+    return index
+
+
+def _build_star_indexes(definitions):
+    """
+    Hash the definitions by (chrom, pos, ref, alt) → (gene, star, rsid),
+    under both "22" and "chr22" names, and by rsid → (gene, star, ref, alt).
+    """
+    by_position: Dict[Tuple[str, int, str, str], Tuple[str, str, str]] = {}
+    by_rsid: Dict[str, Tuple[str, str, str, str]] = {}
+    for gene, star, rsid, chrom, pos, ref, alt in definitions:
+        for name in (chrom, "chr" + chrom):
+            by_position[(name, pos, ref, alt)] = (gene, star, rsid)
+        by_rsid[rsid] = (gene, star, ref, alt)
+    return by_position, by_rsid
+
+
+def _build_allele_function_index(rows) -> Dict[Tuple[str, str], Tuple[str, float]]:
+    """
+    (gene, star) → (function, activity score); duplicate keys and functions
+    outside ALLELE_FUNCTIONS (e.g. CPIC's "uncertain function") are an error,
+    so a bad data file fails the build instead of a later lookup. Star names are only unique within a gene (CYP2D6 *2 is normal function,
+    TPMT *2 is nonfunctional), so every lookup is keyed by (gene, star).
+    """
+    index: Dict[Tuple[str, str], Tuple[str, float]] = {}
+    for gene, star, function, activity in rows:
+        if (gene, star) in index:
+            raise ValueError(f"Duplicate allele function for {gene} {star}")
+        if function not in ALLELE_FUNCTIONS:
+            raise ValueError(
+                f"allele_functionality.csv: unknown function {function!r} for {gene} {star} "
+                f"(expected one of {', '.join(ALLELE_FUNCTIONS)})"
+            )
+        index[(gene, star)] = (function, activity)
+    return index
+
+
+# ─── SNAPSHOT ────────────────────────────────────────────────────────────────
+class KnowledgeBase:
+    """
+    Immutable compiled knowledge base. Treat every attribute as read-only:
+    snapshots are shared between concurrent requests.
+    """
+
+    __slots__ = (
+        "version", "fingerprint", "gene_drug_map", "drug_gene_map", "drug_genes", "supported_drugs",
+        "supported_genes", "regions", "region_index", "phenotype_models", "mechanisms",
+        "allele_functions", "star_definitions", "star_by_position", "star_by_rsid",
+        "risk_rules", "clinical_recs", "combination_rules", "tables",
+    )
+
+    def __init__(self, version: str, fingerprint: str, data: Dict[str, Any]):
+        genes = data["genes"]
+        self.version = version
+        self.fingerprint = fingerprint
+
+        # gene → drugs it informs (any role); drug → its genes, primary first
+        self.gene_drug_map: Dict[str, List[str]] = {gene: [] for gene in genes}
+        primary: Dict[str, str] = {}
+        modifiers: Dict[str, List[str]] = {}
+        for gene, drug, role in data["gene_drug_pairs"]:
+            self.gene_drug_map[gene].append(drug)
+            if role != "primary":
+                modifiers.setdefault(drug, []).append(gene)
+            elif primary.setdefault(drug, gene) != gene:
+                raise ValueError(f"Drug {drug} has more than one primary gene")
+        missing = set(modifiers) - set(primary)
+        if missing:
+            raise ValueError(f"Drugs without a primary gene: {sorted(missing)}")
+        self.drug_genes: Dict[str, Tuple[str, ...]] = {
+            drug: (gene,) + tuple(modifiers.get(drug, ())) for drug, gene in primary.items()
+        }
+        self.drug_gene_map = {d: g[0] for d, g in self.drug_genes.items()}   # primary gene
+        self.supported_drugs = list(self.drug_genes)
+        self.supported_genes = list(self.gene_drug_map)
+
+        # GRCh37 gene spans (1-based, inclusive) padded by ~10 kb of flank so that
+        # upstream promoter variants and CYP2D6 structural variants are included.
+        self.regions = {g: (info["chrom"], info["start"], info["end"]) for g, info in genes.items()}
+        self.region_index = _build_region_index(self.regions)
+        self.phenotype_models = {g: info["phenotype_model"] for g, info in genes.items()}
+        self.mechanisms = {g: info["mechanism"] for g, info in genes.items()}
+
+        self.allele_functions = _build_allele_function_index(data["allele_functionality"])
+        self.star_definitions = data["allele_definitions"]
+        self.star_by_position, self.star_by_rsid = _build_star_indexes(self.star_definitions)
+
+        self.risk_rules = data["risk_rules"]               # drug → gene → phenotype → rule
+        self.clinical_recs = data["recommendations"]       # (drug, gene, phenotype) → rec
+        self.combination_rules = data["combination_rules"]  # drug → [(gene phenotypes, rule, rec)]
+
+        from app.utils.decision_tables import compile_tables
+        self.tables = compile_tables(self)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if hasattr(self, "tables"):
+            raise AttributeError("KnowledgeBase snapshots are immutable")
+        object.__setattr__(self, name, value)
+
+    # pickle restores slots through __setattr__; bypass the immutability guard
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def gene_at(self, chrom: str, pos: int) -> Optional[str]:
+        """Pharmacogene whose locus contains chrom:pos, or None."""
+        intervals = self.region_index.get(chrom)
+        if intervals is None:
+            return None
+        starts, ends, genes = intervals
+        i = bisect_right(starts, pos) - 1
+        if i >= 0 and pos <= ends[i]:
+            return genes[i]
+        return None
+
+    def lookup_star_allele(
+        self, chrom: str, pos: int, ref: str, alt: str, rsid: str = ""
+    ) -> Optional[Tuple[str, str, str]]:
+        """
+        Resolve a variant to (gene, star_allele, rsid) by exact position/allele
+        match, falling back to rsID (with matching alleles, so other assemblies
+        still resolve). Multi-allelic ALTs match on any listed allele.
+        """
+        for a in alt.split(","):
+            hit = self.star_by_position.get((chrom, pos, ref, a))
+            if hit is not None:
+                return hit
+        defn = self.star_by_rsid.get(rsid)
+        if defn is not None and defn[2] == ref and defn[3] in alt.split(","):
+            return defn[0], defn[1], rsid
+        return None
+
+    def get_allele_function(self, gene: str, star: str) -> str:
+        return self.allele_functions.get((gene, star), NORMAL_ALLELE)[0]
+
+    def get_activity_score(self, gene: str, star: str) -> float:
+        return self.allele_functions.get((gene, star), NORMAL_ALLELE)[1]
+
+    def diplotype_to_phenotype(self, gene: str, allele1_func: str, allele2_func: str) -> str:
+        return phenotype_from_functions(self.phenotype_models.get(gene, ""), allele1_func, allele2_func)
+
+    def get_clinical_rec(self, drug: str, phenotype: str, gene: Optional[str] = None) -> dict:
+        """Recommendation for a gene's phenotype (default: the drug's primary gene)."""
+        gene = gene or self.drug_gene_map.get(drug, "")
+        return self.clinical_recs.get((drug, gene, phenotype)) or default_clinical_rec(drug)
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "fingerprint": self.fingerprint,
+            "genes": len(self.supported_genes),
+            "drugs": len(self.supported_drugs),
+            "gene_drug_pairs": sum(len(genes) for genes in self.drug_genes.values()),
+            "allele_definitions": len(self.star_definitions),
+        }
+
+
+# ─── LOADING ─────────────────────────────────────────────────────────────────
+def _read_csv(path: str) -> List[Dict[str, str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def _read_json(path: str) -> Any:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _rule(r: Dict[str, Any]) -> Tuple[str, float, str, str]:
+    return r["risk_label"], r["confidence"], r["severity"], r["detail"]
+
+
+def data_fingerprint(data_dir: str = KB_DATA_DIR) -> str:
+    """Content hash of the knowledge base data files."""
+    digest = hashlib.sha256(str(SNAPSHOT_FORMAT).encode())
+    for name in DATA_FILES:
+        digest.update(name.encode())
+        with open(os.path.join(data_dir, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def compile_knowledge_base(data_dir: str = KB_DATA_DIR, fingerprint: Optional[str] = None) -> KnowledgeBase:
+    """Parse the data files and build a snapshot (no snapshot cache involved)."""
+    def path(name: str) -> str:
+        return os.path.join(data_dir, name)
+
+    manifest = _read_json(path("manifest.json"))
+    data = {
+        "genes": _read_json(path("genes.json")),
+        "gene_drug_pairs": [
+            (r["gene"], r["drug"], r.get("role") or "primary") for r in _read_csv(path("gene_drug_pairs.csv"))
+        ],
+        "allele_functionality": [
+            (r["gene"], r["allele"], r["function"], float(r["activity_score"]))
+            for r in _read_csv(path("allele_functionality.csv"))
+        ],
+        "allele_definitions": [
+            (r["gene"], r["allele"], r["rsid"], r["chrom"], int(r["pos"]), r["ref"], r["alt"])
+            for r in _read_csv(path("allele_definitions.csv"))
+        ],
+        "risk_rules": {
+            drug: {
+                gene: {phenotype: _rule(r) for phenotype, r in rules.items()}
+                for gene, rules in by_gene.items()
+            }
+            for drug, by_gene in _read_json(path("risk_rules.json")).items()
+        },
+        "recommendations": {
+            (r["drug"], r["gene"], r["phenotype"]): {
+                k: v for k, v in r.items() if k not in ("drug", "gene", "phenotype")
+            }
+            for r in _read_json(path("recommendations.json"))
+        },
+        "combination_rules": {},
+    }
+    for r in _read_json(path("combination_rules.json")):
+        data["combination_rules"].setdefault(r["drug"], []).append(
+            (r["phenotypes"], _rule(r), r.get("recommendation"))
+        )
+    return KnowledgeBase(manifest["version"], fingerprint or data_fingerprint(data_dir), data)
+
+
+def _snapshot_path(data_dir: str) -> str:
+    return KB_SNAPSHOT_PATH or os.path.join(data_dir, ".snapshot.pickle")
+
+
+def load_knowledge_base(data_dir: str = KB_DATA_DIR) -> KnowledgeBase:
+    """
+    Snapshot for the current data files: from the pickle cache when its
+    fingerprint matches, otherwise compiled and written back to the cache.
+    """
+    fingerprint = data_fingerprint(data_dir)
+    snapshot_path = _snapshot_path(data_dir)
+    try:
+        with open(snapshot_path, "rb") as f:
+            kb = pickle.load(f)
+        if isinstance(kb, KnowledgeBase) and kb.fingerprint == fingerprint:
+            return kb
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError):
+        pass
+
+    kb = compile_knowledge_base(data_dir, fingerprint)
+    tmp = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump(kb, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, snapshot_path)   # atomic: concurrent workers never see a partial file
+    except OSError as e:
+        print(f"[KB] Could not write snapshot cache {snapshot_path} ({e}).")
+    return kb
+
+
+def _activate(kb: KnowledgeBase) -> None:
+    global _current
+    _recent[kb.fingerprint] = kb
+    while len(_recent) > KB_SNAPSHOTS_KEPT:
+        del _recent[next(iter(_recent))]
+    _current = kb
+
+
+def current() -> KnowledgeBase:
+    """The active snapshot, loaded on first use."""
+    if _current is None:
+        with _lock:
+            if _current is None:
+                _activate(load_knowledge_base())
+    return _current
+
+
+def reload(data_dir: str = KB_DATA_DIR) -> Tuple[KnowledgeBase, bool]:
+    """
+    Load the data files again and make the result the active snapshot.
+    Returns (snapshot, changed); in-flight requests keep their old snapshot.
+    """
+    kb = load_knowledge_base(data_dir)
+    with _lock:
+        changed = _current is None or kb.fingerprint != _current.fingerprint
+        if changed:
+            _activate(kb)
+            print(f"[KB] Loaded knowledge base {kb.version} ({kb.fingerprint}).")
+    return _current, changed
+
+
+def resolve(fingerprint: Optional[str] = None) -> KnowledgeBase:
+    """
+    Snapshot with the given fingerprint, for jobs started under it. A worker
+    process that has not seen it yet reloads from disk; if the files have
+    moved on meanwhile, the newest snapshot is returned (its version is what
+    gets reported).
+    """
+    kb = current()
+    if fingerprint is None or kb.fingerprint == fingerprint:
+        return kb
+    recent = _recent.get(fingerprint)
+    if recent is not None:
+        return recent
+    return reload()[0]
+
+
+# ─── CONVENIENCE LOOKUPS (active snapshot) ───────────────────────────────────
+def gene_at(chrom: str, pos: int) -> Optional[str]:
+    return current().gene_at(chrom, pos)
+
+
+def lookup_star_allele(
+    chrom: str, pos: int, ref: str, alt: str, rsid: str = ""
+) -> Optional[Tuple[str, str, str]]:
+    return current().lookup_star_allele(chrom, pos, ref, alt, rsid)
+
+
+def get_allele_function(gene: str, star: str) -> str:
+    return current().get_allele_function(gene, star)
+
+
+def get_activity_score(gene: str, star: str) -> float:
+    return current().get_activity_score(gene, star)
+
+
+def diplotype_to_phenotype(gene: str, allele1_func: str, allele2_func: str) -> str:
+    return current().diplotype_to_phenotype(gene, allele1_func, allele2_func)
+
+
+def get_clinical_rec(drug: str, phenotype: str, gene: Optional[str] = None) -> dict:
+    return current().get_clinical_rec(drug, phenotype, gene)
@@ -0,0 +1,121 @@
+"""
+Catalogue-size benchmark — per-request cost vs. knowledge-base size.
+
+Builds knowledge bases with the shipped data plus N synthetic genes (each with
+star alleles, allele definitions and a few drugs, every other drug having a
+modifier gene), then times parsing the sample VCF and assessing a fixed set of
+requested drugs against each. Per-request time should stay flat as the
+catalogue grows and scale only with the number of requested drugs.
+
+Run from backend/:
+    python -m benchmarks.bench_catalogue [--sizes 0,100,1000] [--repeat 200]
+"""
+from typing import List
+import argparse
+import csv
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from app.services.pgx_engine import assess_drug
+from app.services.vcf_parser import parse_vcf_lines
+from app.utils.knowledge_base import KB_DATA_DIR, compile_knowledge_base
+
+SAMPLE_VCF = os.path.join(os.path.dirname(os.path.dirname(__file__)), "sample_vcf", "sample_patient.vcf")
+REQUESTED = ["CODEINE", "CLOPIDOGREL", "WARFARIN", "SIMVASTATIN", "AZATHIOPRINE", "FLUOROURACIL"]
+DRUGS_PER_GENE = 3
+STARS_PER_GENE = 4
+FUNCTIONS = ("normal", "decreased", "nonfunctional", "increased")
+PHENOTYPES = {"PM": "high", "IM": "moderate", "NM": "none", "URM": "low"}
+
+
+def synthesize_catalogue(data_dir: str, n_genes: int) -> None:
+    """Append n_genes synthetic genes (and their drugs/alleles/rules) to a copy of the shipped data."""
+    with open(os.path.join(data_dir, "genes.json")) as f:
+        genes = json.load(f)
+    with open(os.path.join(data_dir, "risk_rules.json")) as f:
+        rules = json.load(f)
+    pairs, functions, definitions = [], [], []
+
+    for g in range(n_genes):
+        gene = f"SYN{g:05d}"
+        chrom, start = f"S{g // 1000}", 1_000_000 + (g % 1000) * 100_000
+        genes[gene] = {
+            "chrom": chrom, "start": start, "end": start + 50_000,
+            "phenotype_model": "metabolizer", "mechanism": f"Synthetic gene {gene}.",
+        }
+        for s in range(1, STARS_PER_GENE + 1):
+            functions.append((gene, f"*{s}", FUNCTIONS[(s - 1) % len(FUNCTIONS)], "1.0"))
+            if s > 1:
+                definitions.append((gene, f"*{s}", f"rs{9_000_000_000 + g * 10 + s}", chrom, start + s * 100, "A", "G"))
+        for d in range(DRUGS_PER_GENE):
+            drug = f"SYNDRUG{g:05d}{d}"
+            pairs.append((gene, drug, "primary"))
+            rules[drug] = {gene: {
+                ph: {"risk_label": "Adjust Dosage", "confidence": 0.8, "severity": sev, "detail": ""}
+                for ph, sev in PHENOTYPES.items()
+            }}
+            if g and d == 0:   # modifier: the previous synthetic gene
+                modifier = f"SYN{g - 1:05d}"
+                pairs.append((modifier, drug, "modifier"))
+                rules[drug][modifier] = rules[drug][gene]
+
+    with open(os.path.join(data_dir, "genes.json"), "w") as f:
+        json.dump(genes, f)
+    with open(os.path.join(data_dir, "risk_rules.json"), "w") as f:
+        json.dump(rules, f)
+    for name, rows in (
+        ("gene_drug_pairs.csv", pairs),
+        ("allele_functionality.csv", functions),
+        ("allele_definitions.csv", definitions),
+    ):
+        with open(os.path.join(data_dir, name), "a", newline="") as f:
+            csv.writer(f, lineterminator="\n").writerows(rows)
+
+
+def bench(sizes: List[int], repeat: int) -> List[dict]:
+    with open(SAMPLE_VCF) as f:
+        vcf_lines = f.read().splitlines()
+
+    results = []
+    for n_genes in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = os.path.join(tmp, "kb")
+            shutil.copytree(KB_DATA_DIR, data_dir, ignore=shutil.ignore_patterns(".snapshot*"))
+            synthesize_catalogue(data_dir, n_genes)
+            t0 = time.perf_counter()
+            kb = compile_knowledge_base(data_dir)
+            compile_s = time.perf_counter() - t0
+
+        for n_drugs in (1, len(REQUESTED)):
+            drugs = REQUESTED[:n_drugs]
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                variants, _, _ = parse_vcf_lines(iter(vcf_lines), kb)
+                for drug in drugs:
+                    assess_drug(drug, variants, kb)
+            per_request = (time.perf_counter() - t0) / repeat
+            results.append({
+                "catalogue_drugs": len(kb.supported_drugs),
+                "catalogue_genes": len(kb.supported_genes),
+                "allele_definitions": len(kb.star_definitions),
+                "compile_ms": round(compile_s * 1000, 1),
+                "requested_drugs": n_drugs,
+                "per_request_us": round(per_request * 1e6, 1),
+            })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default="0,100,1000", help="synthetic genes to add, comma-separated")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    for row in bench([int(n) for n in args.sizes.split(",")], args.repeat):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
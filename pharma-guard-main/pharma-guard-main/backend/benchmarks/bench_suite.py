@@ -0,0 +1,504 @@
+"""
+Benchmark suite — parse throughput, per-drug latency and end-to-end load.
+
+Every input is a synthetic VCF (benchmarks/synthetic_vcf.py), generated
+deterministically and cached under --data-dir, so runs on different commits
+measure the same bytes. Results go to one JSON file (--out) that
+benchmarks/compare.py can diff against another run.
+
+  parse   parse + per-gene calls for each file, in a fresh child process:
+          records/s, MB/s and peak RSS (plus the RSS after loading the KB)
+  drug    assess_drug latency per supported drug, and the whole panel
+  e2e     POST /api/analyze through an in-process ASGI client at several
+          concurrency levels: req/s and latency percentiles, with unique
+          uploads (parse every time) and with a repeated upload (parse cache)
+  serve   the production server (gunicorn.conf.py) at 1, 2, 4 ... CPU-count
+          workers under concurrent load over real HTTP: req/s, latency,
+          scaling against one worker, and private memory per worker
+  startup cold start of a fresh uvicorn process: time until /api/ready
+          answers 200 and until the first /api/analyze succeeds, plus the
+          import / lifespan split measured in a bare interpreter
+
+Explanations are rule-based (OPENAI_API_KEY is ignored), so no network
+calls are made.
+
+Run from backend/:
+    python -m benchmarks.bench_suite [--profile quick|full] [--out results.json]
+"""
+from typing import Callable, List, Optional, Tuple
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.synthetic_vcf import parse_size, write_vcf
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATA_DIR = os.path.join(BACKEND_DIR, "benchmarks", ".data")
+
+# (size, samples, annotated, compression) per parse case
+PROFILES = {
+    "quick": {
+        "parse": [
+            ("1KB", 1, True, "none"), ("1MB", 1, True, "none"), ("10MB", 1, True, "none"),
+            ("10MB", 1, False, "none"), ("10MB", 1, True, "gzip"), ("10MB", 1, True, "bgzip"),
+            ("10MB", 100, True, "none"),
+        ],
+        "drug_repeat": 2000,
+        "e2e": {"size": "1MB", "requests": 100, "concurrency": [1, 8, 32]},
+        "serve": {"size": "1MB", "requests_per_worker": 40},
+        "startup_repeat": 5,
+    },
+    "full": {
+        "parse": [
+            ("1KB", 1, True, "none"), ("1MB", 1, True, "none"), ("100MB", 1, True, "none"),
+            ("100MB", 1, False, "none"), ("100MB", 1, True, "gzip"), ("100MB", 1, True, "bgzip"),
+            ("1GB", 1, True, "none"), ("4GB", 1, True, "gzip"),
+            ("100MB", 100, True, "none"), ("1GB", 1000, True, "gzip"),
+        ],
+        "drug_repeat": 20000,
+        "e2e": {"size": "4MB", "requests": 2000, "concurrency": [1, 8, 32, 128]},
+        "serve": {"size": "4MB", "requests_per_worker": 200},
+        "startup_repeat": 20,
+    },
+}
+SUFFIX = {"none": ".vcf", "gzip": ".vcf.gz", "bgzip": ".vcf.bgz"}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _peak_rss_mb() -> float:
+    """
+    Peak RSS of this process. Prefers VmHWM: Linux carries ru_maxrss across
+    exec, so a child would report the parent's peak if that were higher.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 ** 2 if sys.platform == "darwin" else maxrss / 1024
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset(data_dir: str, size: str, samples: int = 1, annotated: bool = True, compression: str = "none") -> dict:
+    """Path and description of a synthetic VCF, generating it on first use."""
+    name = f"synthetic_{size}_{samples}s_{'ann' if annotated else 'bare'}{SUFFIX[compression]}"
+    path = os.path.join(data_dir, name)
+    meta_path = path + ".json"
+    if not os.path.exists(meta_path):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"[BENCH] Generating {name}...", file=sys.stderr)
+        meta = write_vcf(path, parse_size(size), samples, annotated, compression)
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+# ─── PARSE (child process) ───────────────────────────────────────────────────
+
+def _parse_worker(meta: dict) -> dict:
+    """Runs in a fresh interpreter so ru_maxrss belongs to this parse alone."""
+    from app.services.pipeline import parse_vcf_upload
+    from app.services.vcf_parser import open_vcf_lines, parse_vcf_cohort
+    from app.utils import knowledge_base
+
+    kb = knowledge_base.current()
+    baseline = _peak_rss_mb()
+    path = meta["path"]
+    index_path = path + ".tbi"
+    start = time.perf_counter()
+    with open(path, "rb") as stream:
+        index = open(index_path, "rb") if os.path.exists(index_path) else None
+        try:
+            if meta["samples"] > 1:
+                retained = len(parse_vcf_cohort(open_vcf_lines(stream, index=index, kb=kb), kb).variants)
+            else:
+                retained = len(parse_vcf_upload(stream, index=index).variants)
+        finally:
+            if index is not None:
+                index.close()
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "retained": retained, "baseline_rss_mb": baseline, "peak_rss_mb": _peak_rss_mb()}
+
+
+def bench_parse(cases: list, data_dir: str) -> List[dict]:
+    results = []
+    for size, samples, annotated, compression in cases:
+        meta = dataset(data_dir, size, samples, annotated, compression)
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_suite", "--parse-worker", json.dumps(meta)],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        )
+        run = json.loads(out.stdout.strip().splitlines()[-1])
+        file_mb = os.path.getsize(meta["path"]) / 1024 ** 2
+        results.append({
+            "benchmark": "parse",
+            "name": f"parse/{size}/{samples}s/{'annotated' if annotated else 'unannotated'}/{compression}",
+            "params": {
+                "size": size, "samples": samples, "annotated": annotated, "compression": compression,
+                "records": meta["records"], "file_mb": round(file_mb, 2),
+            },
+            "metrics": {
+                "records_per_sec": round(meta["records"] / run["seconds"], 1),
+                "mb_per_sec": round(file_mb / run["seconds"], 2),
+                "seconds": round(run["seconds"], 4),
+                "peak_rss_mb": round(run["peak_rss_mb"], 1),
+                "rss_over_baseline_mb": round(run["peak_rss_mb"] - run["baseline_rss_mb"], 1),
+            },
+            "retained_variants": run["retained"],
+        })
+        print(f"[BENCH] {results[-1]['name']}: {results[-1]['metrics']}", file=sys.stderr)
+    return results
+
+
+# ─── PER-DRUG LATENCY ────────────────────────────────────────────────────────
+
+def bench_drugs(data_dir: str, repeat: int) -> List[dict]:
+    from app.services.pgx_engine import assess_drug, assess_panel
+    from app.services.vcf_parser import parse_vcf_file
+    from app.utils import knowledge_base
+
+    kb = knowledge_base.current()
+    variants, _, _ = parse_vcf_file(dataset(data_dir, "1MB")["path"])
+
+    def timings(fn) -> dict:
+        fn()   # warm the memo tables
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        return {
+            "mean_us": round(statistics.fmean(samples) * 1e6, 2),
+            "p50_us": round(_percentile(samples, 0.5) * 1e6, 2),
+            "p95_us": round(_percentile(samples, 0.95) * 1e6, 2),
+        }
+
+    results = [
+        {"benchmark": "drug", "name": f"drug/{drug}", "params": {"variants": len(variants), "repeat": repeat},
+         "metrics": timings(lambda: assess_drug(drug, variants, kb))}
+        for drug in kb.supported_drugs
+    ]
+    results.append({
+        "benchmark": "drug", "name": "drug/panel",
+        "params": {"variants": len(variants), "drugs": len(kb.supported_drugs), "repeat": repeat},
+        "metrics": timings(lambda: assess_panel(kb.supported_drugs, variants, kb)),
+    })
+    return results
+
+
+# ─── END-TO-END ──────────────────────────────────────────────────────────────
+
+async def _load(
+    body: Callable[[int], bytes], requests: int, concurrency: int, app=None, base_url: str = "http://bench"
+) -> dict:
+    """Drive POST /api/analyze: in-process through app's ASGI interface, else over HTTP to base_url."""
+    import httpx
+
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app) if app is not None else None
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=None, limits=limits) as client:
+        async def one(i: int) -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                resp = await client.post(
+                    "/api/analyze", files={"vcf_file": ("bench.vcf", body(i))}, data={"drugs": "ALL"}
+                )
+                latencies.append(time.perf_counter() - start)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"/api/analyze returned {resp.status_code}: {resp.text[:200]}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    return {
+        "requests_per_sec": round(requests / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 0.5) * 1e3, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1e3, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1e3, 2),
+    }
+
+
+def bench_e2e(data_dir: str, size: str, requests: int, concurrency: List[int]) -> List[dict]:
+    from app.main import app
+    from app.routers import analysis
+    from app.services.parse_cache import get_parse_cache
+    from app.utils import knowledge_base
+
+    knowledge_base.current()   # ASGITransport does not run the lifespan hook
+    analysis.MAX_VCF_BYTES = 0
+    with open(dataset(data_dir, size)["path"], "rb") as f:
+        content = f.read()
+    header, rest = content.split(b"\n", 1)
+
+    results = []
+    for level in concurrency:
+        for mode in ("unique", "repeated"):
+            get_parse_cache().clear()
+            if mode == "unique":
+                # A distinct header line per request defeats the parse cache
+                body = lambda i: header + b"\n##bench_request=%d\n" % i + rest
+            else:
+                body = lambda i: content
+            metrics = asyncio.run(_load(body, requests, level, app=app))
+            results.append({
+                "benchmark": "e2e",
+                "name": f"e2e/{mode}/c{level}",
+                "params": {"size": size, "requests": requests, "concurrency": level, "drugs": "ALL", "uploads": mode},
+                "metrics": metrics,
+            })
+            print(f"[BENCH] {results[-1]['name']}: {metrics}", file=sys.stderr)
+    return results
+
+
+# ─── STARTUP ─────────────────────────────────────────────────────────────────
+
+# Runs in a bare interpreter: importing this module would pre-import app code
+STARTUP_SPLIT = """
+import asyncio, json, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+async def startup():
+    async with app.router.lifespan_context(app):
+        return time.perf_counter()
+ready = asyncio.run(startup())
+print(json.dumps({"import_ms": (imported - start) * 1e3, "lifespan_ms": (ready - imported) * 1e3}))
+"""
+STARTUP_TIMEOUT = 60.0   # seconds
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _request(port: int, method: str, path: str, body: Optional[bytes] = None, headers: Optional[dict] = None) -> int:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=STARTUP_TIMEOUT)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def _multipart(vcf: bytes) -> Tuple[bytes, dict]:
+    boundary = "pharmaguard-bench"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"drugs\"\r\n\r\nALL\r\n"
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"vcf_file\"; filename=\"bench.vcf\"\r\n"
+        f"Content-Type: text/plain\r\n\r\n"
+    ).encode() + vcf + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def _wait_ready(server: subprocess.Popen, port: int, start: float) -> None:
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with {server.returncode} during start-up")
+        if time.perf_counter() - start > STARTUP_TIMEOUT:
+            raise RuntimeError("server did not become ready in time")
+        try:
+            if _request(port, "GET", "/api/ready") == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.005)
+
+
+def _cold_start(vcf: bytes, env: dict) -> dict:
+    """Spawn uvicorn; milliseconds until /api/ready is 200 and until the first analysis succeeds."""
+    port = _free_port()
+    body, headers = _multipart(vcf)
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        _wait_ready(server, port, start)
+        ready = time.perf_counter() - start
+        status = _request(port, "POST", "/api/analyze", body, headers)
+        if status != 200:
+            raise RuntimeError(f"/api/analyze returned {status}")
+        return {"ready_ms": ready * 1e3, "first_analyze_ms": (time.perf_counter() - start) * 1e3}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_startup(data_dir: str, repeat: int) -> List[dict]:
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    with open(dataset(data_dir, "1MB")["path"], "rb") as f:
+        vcf = f.read()
+
+    def median(runs: List[dict]) -> dict:
+        return {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+
+    split = [
+        json.loads(subprocess.run(
+            [sys.executable, "-c", STARTUP_SPLIT], cwd=BACKEND_DIR, env=env,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1])
+        for _ in range(repeat)
+    ]
+    server = [_cold_start(vcf, env) for _ in range(repeat)]
+    results = [
+        {"benchmark": "startup", "name": "startup/in_process", "params": {"repeat": repeat}, "metrics": median(split)},
+        {"benchmark": "startup", "name": "startup/uvicorn", "params": {"repeat": repeat, "size": "1MB"},
+         "metrics": median(server)},
+    ]
+    for result in results:
+        print(f"[BENCH] {result['name']}: {result['metrics']}", file=sys.stderr)
+    return results
+
+
+# ─── MULTI-WORKER SERVER ─────────────────────────────────────────────────────
+
+def _worker_counts() -> List[int]:
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cpus:
+        counts.append(counts[-1] * 2)
+    return counts + [cpus] if cpus > 1 else counts
+
+
+def _workers_of(master: int) -> List[int]:
+    try:
+        with open(f"/proc/{master}/task/{master}/children") as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def _private_mb(pid: int) -> Optional[float]:
+    """Memory only this process holds (USS); pages shared copy-on-write with the master are excluded."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            kb = sum(int(line.split()[1]) for line in f if line.startswith(("Private_Clean:", "Private_Dirty:")))
+    except OSError:
+        return None
+    return kb / 1024
+
+
+def bench_serve(data_dir: str, size: str, requests_per_worker: int) -> List[dict]:
+    with open(dataset(data_dir, size)["path"], "rb") as f:
+        content = f.read()
+    header, rest = content.split(b"\n", 1)
+    body = lambda i: header + b"\n##bench_request=%d\n" % i + rest
+
+    results, single = [], None
+    for workers in _worker_counts():
+        port = _free_port()
+        env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+        env.update(WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{port}")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py", "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            start = time.perf_counter()
+            _wait_ready(server, port, start)
+            while len(_workers_of(server.pid)) < workers and time.perf_counter() - start < STARTUP_TIMEOUT:
+                time.sleep(0.05)
+            base_url = f"http://127.0.0.1:{port}"
+            asyncio.run(_load(body, 2 * workers, workers, base_url=base_url))   # every worker past first use
+            requests = requests_per_worker * workers
+            metrics = asyncio.run(_load(body, requests, 4 * workers, base_url=base_url))
+            private = [mb for mb in map(_private_mb, _workers_of(server.pid)) if mb is not None]
+        finally:
+            server.terminate()
+            server.wait()
+        single = single or metrics["requests_per_sec"]
+        metrics["scaling"] = round(metrics["requests_per_sec"] / (single * workers), 3)   # 1.0 = linear
+        if private:
+            metrics["worker_private_mb"] = round(statistics.fmean(private), 1)
+        results.append({
+            "benchmark": "serve",
+            "name": f"serve/w{workers}",
+            "params": {"size": size, "workers": workers, "requests": requests, "concurrency": 4 * workers, "uploads": "unique"},
+            "metrics": metrics,
+        })
+        print(f"[BENCH] {results[-1]['name']}: {metrics}", file=sys.stderr)
+    return results
+
+
+def run_suite(profile: str, data_dir: str, only: Optional[List[str]] = None) -> dict:
+    os.environ.pop("OPENAI_API_KEY", None)
+    config = PROFILES[profile]
+    only = only or ["parse", "drug", "e2e", "serve", "startup"]
+    results: List[dict] = []
+    if "parse" in only:
+        results += bench_parse(config["parse"], data_dir)
+    if "drug" in only:
+        results += bench_drugs(data_dir, config["drug_repeat"])
+    if "e2e" in only:
+        e2e = config["e2e"]
+        results += bench_e2e(data_dir, e2e["size"], e2e["requests"], e2e["concurrency"])
+    if "serve" in only:
+        serve = config["serve"]
+        results += bench_serve(data_dir, serve["size"], serve["requests_per_worker"])
+    if "startup" in only:
+        results += bench_startup(data_dir, config["startup_repeat"])
+    return {
+        "suite": "pharmaguard",
+        "profile": profile,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--only", help="comma-separated subset of parse,drug,e2e,serve,startup")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="where generated VCFs are cached")
+    parser.add_argument("--out", help="results file (default: bench-<commit>-<profile>.json)")
+    parser.add_argument("--parse-worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.parse_worker:
+        print(json.dumps(_parse_worker(json.loads(args.parse_worker))))
+        return
+
+    report = run_suite(args.profile, args.data_dir, args.only.split(",") if args.only else None)
+    out = args.out or f"bench-{(report['git_commit'] or 'unknown')[:12]}-{args.profile}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Wrote {len(report['results'])} results to {out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare two bench_suite result files, e.g. a base commit against a branch.
+
+Metrics are matched by result name. *_per_sec metrics are better when
+higher; *_ms, *_us and *_mb metrics are better when lower; anything else
+(seconds, counts) is shown but never flagged. A change worse than
+--threshold (relative) is a regression, and the exit status is 1 if any
+were found, so the comparison can gate CI.
+
+Run from backend/:
+    python -m benchmarks.compare base.json head.json [--threshold 0.10]
+"""
+from typing import List, Optional, Tuple
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = ("_per_sec",)
+LOWER_IS_BETTER = ("_ms", "_us", "_mb")
+
+
+def direction(metric: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if not compared."""
+    if metric.endswith(HIGHER_IS_BETTER):
+        return 1
+    if metric.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(base: dict, head: dict, threshold: float) -> Tuple[List[tuple], List[tuple]]:
+    """(rows, regressions); a row is (name, metric, base, head, relative change)."""
+    base_results = {r["name"]: r["metrics"] for r in base["results"]}
+    rows, regressions = [], []
+    for result in head["results"]:
+        before = base_results.get(result["name"])
+        if before is None:
+            continue
+        for metric, value in result["metrics"].items():
+            old = before.get(metric)
+            if old is None:
+                continue
+            change = (value - old) / old if old else 0.0
+            row = (result["name"], metric, old, value, change)
+            rows.append(row)
+            if direction(metric) * change < -threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description=__doc__.split("\n")[1])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change flagged as a regression")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    rows, regressions = compare(base, head, args.threshold)
+
+    print(f"base {(base.get('git_commit') or '?')[:12]}  head {(head.get('git_commit') or '?')[:12]}")
+    for name, metric, old, new, change in rows:
+        flag = "  REGRESSION" if (name, metric, old, new, change) in regressions else ""
+        print(f"{name:<45} {metric:<22} {old:>12g} {new:>12g} {change:>+8.1%}{flag}")
+    print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
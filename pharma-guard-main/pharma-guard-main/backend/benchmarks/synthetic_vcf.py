@@ -0,0 +1,211 @@
+"""
+Synthetic VCF generator — deterministic VCF files of any size for benchmarks.
+
+Files look like whole-genome call sets: coordinate-sorted background records
+across chromosomes 1-22 (GRCh37 lengths) outside the pharmacogene regions,
+plus pharmacogene records: every star-allele defining variant of the
+knowledge base and novel sites inside each gene region (about pgx_fraction of
+all records). The same arguments and seed always produce the same bytes.
+
+  - target_bytes: approximate uncompressed size, from 1 KB to many GB; lines
+    are streamed to disk, so memory stays flat
+  - samples: 1 for a single-sample file, more for a joint-called cohort
+  - annotated: GENE/STAR/RS INFO tags on pharmacogene records (and the
+    ##INFO=<ID=GENE> header), or bare records the parser must place itself
+  - compression: "none", "gzip", or "bgzip" (also writes a .tbi index)
+
+Run from backend/:
+    python -m benchmarks.synthetic_vcf out.vcf.gz --size 100MB --samples 1 --compression gzip
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import gzip
+import json
+import random
+
+from app.services.tabix import write_bgzf_vcf
+from app.utils import knowledge_base
+from app.utils.knowledge_base import KnowledgeBase
+
+CHROM_LENGTHS = {
+    "1": 249250621, "2": 243199373, "3": 198022430, "4": 191154276, "5": 180915260, "6": 171115067,
+    "7": 159138663, "8": 146364022, "9": 141213431, "10": 135534747, "11": 135006516, "12": 133851895,
+    "13": 115169878, "14": 107349540, "15": 102531392, "16": 90354753, "17": 81195210, "18": 78077248,
+    "19": 59128983, "20": 63025520, "21": 48129895, "22": 51304566,
+}
+GENOME_LENGTH = sum(CHROM_LENGTHS.values())
+BASES = "ACGT"
+GENOTYPES = ("0/0", "0/1", "1/1")
+GENOTYPE_WEIGHTS = (0.2, 0.5, 0.3)     # most called sites carry the alt allele
+COMPRESSIONS = ("none", "gzip", "bgzip")
+UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "B": 1}
+
+
+def parse_size(text: str) -> int:
+    """'64KB' / '1.5GB' / '1000' → bytes."""
+    text = text.strip().upper()
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[: -len(unit)]) * factor)
+    return int(text)
+
+
+def format_size(n: int) -> str:
+    for unit in ("GB", "MB", "KB"):
+        if n >= UNITS[unit] and n % UNITS[unit] == 0:
+            return f"{n // UNITS[unit]}{unit}"
+    return f"{n}B"
+
+
+def _header(samples: List[str], annotated: bool) -> List[str]:
+    lines = [
+        "##fileformat=VCFv4.2",
+        "##source=pharmaguard-synthetic",
+        '##FILTER=<ID=PASS,Description="All filters passed">',
+        '##INFO=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+        '##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">',
+    ]
+    if annotated:
+        lines += [
+            '##INFO=<ID=GENE,Number=1,Type=String,Description="Gene symbol">',
+            '##INFO=<ID=STAR,Number=1,Type=String,Description="Star allele">',
+            '##INFO=<ID=RS,Number=1,Type=String,Description="dbSNP rsID">',
+        ]
+    lines.append('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">')
+    lines.append("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + samples))
+    return lines
+
+
+def _pgx_sites(kb: KnowledgeBase, rng: random.Random, novel_per_gene: int) -> Dict[str, List[Tuple[int, str, str, str, str, str]]]:
+    """chrom → sorted (pos, rsid, ref, alt, gene, star) for defining variants and novel in-region sites."""
+    sites: Dict[str, Dict[int, Tuple[int, str, str, str, str, str]]] = {}
+    for gene, star, rsid, chrom, pos, ref, alt in kb.star_definitions:
+        sites.setdefault(chrom, {})[pos] = (pos, rsid, ref, alt, gene, star)
+    for gene, (chrom, start, end) in sorted(kb.regions.items()):
+        for _ in range(novel_per_gene):
+            pos = rng.randint(start, end)
+            ref = rng.choice(BASES)
+            alt = rng.choice(BASES.replace(ref, ""))
+            sites.setdefault(chrom, {}).setdefault(pos, (pos, ".", ref, alt, gene, ""))
+    return {chrom: sorted(by_pos.values()) for chrom, by_pos in sites.items()}
+
+
+def _in_regions(kb: KnowledgeBase) -> Dict[str, List[Tuple[int, int]]]:
+    spans: Dict[str, List[Tuple[int, int]]] = {}
+    for chrom, start, end in kb.regions.values():
+        spans.setdefault(chrom, []).append((start, end))
+    return spans
+
+
+def generate_lines(
+    target_bytes: int,
+    samples: int = 1,
+    annotated: bool = True,
+    seed: int = 0,
+    pgx_fraction: float = 0.001,
+    kb: Optional[KnowledgeBase] = None,
+    stats: Optional[dict] = None,
+) -> Iterator[str]:
+    """
+    Yield the VCF lines (without newlines). If given, stats is filled with
+    record counts once the generator is exhausted.
+    """
+    kb = kb or knowledge_base.current()
+    rng = random.Random(seed)
+    sample_names = ["PATIENT_001"] if samples == 1 else [f"SAMPLE_{i:05d}" for i in range(1, samples + 1)]
+
+    # Estimate the background record count that fills target_bytes
+    line_bytes = 52 + 4 * samples
+    n_background = max(1, target_bytes // line_bytes)
+    novel_per_gene = max(2, int(n_background * pgx_fraction / max(1, len(kb.regions))))
+    pgx = _pgx_sites(kb, rng, novel_per_gene)
+    regions = _in_regions(kb)
+    step = max(1, GENOME_LENGTH // n_background)
+
+    def genotypes() -> str:
+        return "\t".join(rng.choices(GENOTYPES, GENOTYPE_WEIGHTS, k=samples))
+
+    counts = {"background_records": 0, "pgx_records": 0}
+    for line in _header(sample_names, annotated):
+        yield line
+
+    for chrom, length in CHROM_LENGTHS.items():
+        chrom_pgx = pgx.get(chrom, [])
+        spans = regions.get(chrom, [])
+        next_pgx = 0
+        pos = rng.randint(1, step)
+        while pos <= length or next_pgx < len(chrom_pgx):
+            if next_pgx < len(chrom_pgx) and (pos > length or chrom_pgx[next_pgx][0] <= pos):
+                site_pos, rsid, ref, alt, gene, star = chrom_pgx[next_pgx]
+                next_pgx += 1
+                if annotated:
+                    info = f"GENE={gene};STAR={star};RS={rsid}" if star else f"GENE={gene}"
+                else:
+                    info = f"DP={rng.randint(10, 60)}"
+                counts["pgx_records"] += 1
+                yield f"{chrom}\t{site_pos}\t{rsid}\t{ref}\t{alt}\t.\tPASS\t{info}\tGT\t{genotypes()}"
+                continue
+
+            if not any(start <= pos <= end for start, end in spans):
+                ref = rng.choice(BASES)
+                alt = rng.choice(BASES.replace(ref, ""))
+                rsid = f"rs{rng.randrange(1_000_000_000, 2_000_000_000)}" if rng.random() < 0.6 else "."
+                counts["background_records"] += 1
+                yield (
+                    f"{chrom}\t{pos}\t{rsid}\t{ref}\t{alt}\t{rng.randint(20, 99)}\tPASS\t"
+                    f"DP={rng.randint(10, 60)};AF={rng.random():.3f}\tGT\t{genotypes()}"
+                )
+            pos += rng.randint(1, 2 * step - 1)
+
+    if stats is not None:
+        stats.update(counts, records=counts["background_records"] + counts["pgx_records"], samples=samples)
+
+
+def write_vcf(
+    path: str,
+    target_bytes: int,
+    samples: int = 1,
+    annotated: bool = True,
+    compression: str = "none",
+    seed: int = 0,
+    pgx_fraction: float = 0.001,
+) -> dict:
+    """Write a synthetic VCF (and path + ".tbi" for bgzip); returns its description."""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"compression must be one of {COMPRESSIONS}")
+    stats: dict = {}
+    lines = generate_lines(target_bytes, samples, annotated, seed, pgx_fraction, stats=stats)
+    if compression == "bgzip":
+        with open(path, "wb") as out:
+            tbi = write_bgzf_vcf(lines, out)
+        with open(path + ".tbi", "wb") as out:
+            out.write(tbi)
+    else:
+        opener = gzip.open if compression == "gzip" else open
+        with opener(path, "wt", newline="\n") as out:
+            for line in lines:
+                out.write(line + "\n")
+    return {
+        "path": path, "target_bytes": target_bytes, "annotated": annotated, "compression": compression,
+        "seed": seed, "pgx_fraction": pgx_fraction, **stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("path")
+    parser.add_argument("--size", default="1MB", help="approximate uncompressed size, e.g. 64KB, 100MB, 2GB")
+    parser.add_argument("--samples", type=int, default=1)
+    parser.add_argument("--unannotated", action="store_true", help="omit GENE/STAR/RS INFO tags")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="none")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pgx-fraction", type=float, default=0.001)
+    args = parser.parse_args()
+    print(json.dumps(write_vcf(
+        args.path, parse_size(args.size), args.samples, not args.unannotated,
+        args.compression, args.seed, args.pgx_fraction,
+    )))
+
+
+if __name__ == "__main__":
+    main()
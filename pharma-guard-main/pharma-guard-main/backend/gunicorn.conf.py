@@ -0,0 +1,85 @@
+"""
+Gunicorn configuration — multi-process production server.
+
+    gunicorn app.main:app -c gunicorn.conf.py
+
+WEB_CONCURRENCY uvicorn workers (default: one per CPU) serve the app behind
+one listening socket. The app is imported once in the master (preload_app)
+and the knowledge-base snapshot is built there before the first fork, so
+every worker starts with it already in memory and shares those pages
+copy-on-write instead of holding its own copy. gc.freeze() keeps the
+collector from touching (and so un-sharing) the preloaded objects.
+
+Restarts are graceful: on SIGHUP the master reloads the knowledge base from
+its data files, forks fresh workers from the result, and lets the old ones
+finish their in-flight requests (up to GRACEFUL_TIMEOUT seconds). SIGTERM
+drains the same way before exiting; /api/ready answers 503 meanwhile.
+
+Each worker has its own analysis executor and caches; use PARSE_CACHE_PATH /
+EXPLANATION_CACHE_PATH for cache tiers shared by all. /metrics is answered by
+whichever worker accepts the scrape, so the workers share METRICS_DIR (a
+fresh temporary directory unless set) and every scrape reports the sum over
+all of them (see app/services/metrics.py). When a worker exits, its totals
+are folded into one retired file so the directory does not grow with
+replaced workers.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+# Parallelism comes from the worker processes; a couple of analysis-executor
+# threads per worker (not one per CPU each) keep the event loop free while one
+# upload is being parsed. Set ANALYSIS_WORKERS to override.
+os.environ.setdefault("ANALYSIS_WORKERS", "2")
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))            # silent worker → killed and replaced
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))           # recycle workers after N requests (0 = never)
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+accesslog = os.getenv("ACCESS_LOG") or None                  # "-" for stdout
+
+# Must be set before the app (and app.services.metrics) is preloaded; kept
+# across SIGHUP, when this file is read again
+_METRICS_DIR_PREFIX = "pharmaguard_metrics_"
+if not os.getenv("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix=_METRICS_DIR_PREFIX)
+
+
+def _share_knowledge_base(server, reload: bool) -> None:
+    from app.utils import knowledge_base
+    try:
+        kb = knowledge_base.reload()[0] if reload else knowledge_base.current()
+    except (OSError, ValueError, KeyError) as e:
+        # Broken data files: new workers keep the snapshot already loaded
+        server.log.warning("Knowledge base reload failed, keeping current snapshot (%s)", e)
+        kb = knowledge_base.current()
+    gc.freeze()
+    server.log.info("Knowledge base %s (%s) loaded in master", kb.version, kb.fingerprint)
+
+
+def when_ready(server):
+    # Master, after preloading the app and before forking the first workers
+    _share_knowledge_base(server, reload=False)
+
+
+def on_reload(server):
+    # Master, on SIGHUP: workers forked after this see the new data files
+    _share_knowledge_base(server, reload=True)
+
+
+def child_exit(server, worker):
+    # Master, after reaping a worker: keep its counters, drop its file
+    from app.services import metrics
+    metrics.retire(worker.pid)
+
+
+def on_exit(server):
+    # Remove the metrics directory only if it is the temporary one made above
+    metrics_dir = os.environ["METRICS_DIR"]
+    if os.path.basename(metrics_dir).startswith(_METRICS_DIR_PREFIX):
+        shutil.rmtree(metrics_dir, ignore_errors=True)
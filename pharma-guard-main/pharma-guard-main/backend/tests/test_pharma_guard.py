@@ -5,7 +5,9 @@ Run: pytest tests/ -v
 import sys, os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-from app.services.vcf_parser import parse_vcf, determine_diplotype
+from app.services.vcf_parser import (
+    parse_vcf, parse_vcf_stream, determine_diplotype, VCFTooLargeError
+)
 from app.services.pgx_engine import analyze_drug
 from app.utils.knowledge_base import diplotype_to_phenotype, get_allele_function
 
@@ -37,6 +39,1253 @@ def test_vcf_patient_id_extraction():
     assert patient_id == "PATIENT_TEST"
 
 
+def test_vcf_stream_parsing_matches_text_parsing():
+    import io
+    # Tiny chunk size forces records to straddle chunk boundaries
+    stream = io.BytesIO(SAMPLE_VCF.encode())
+    variants, patient_id, success = parse_vcf_stream(stream, chunk_size=7)
+    expected, _, _ = parse_vcf(SAMPLE_VCF)
+    assert success
+    assert patient_id == "PATIENT_TEST"
+    assert variants == expected
+
+
+def test_vcf_stream_size_limit():
+    import io
+    stream = io.BytesIO(SAMPLE_VCF.encode())
+    try:
+        parse_vcf_stream(stream, max_bytes=64, chunk_size=16)
+    except VCFTooLargeError:
+        pass
+    else:
+        raise AssertionError("Expected VCFTooLargeError")
+
+
+def test_vcf_gzip_stream():
+    import gzip, io
+    stream = io.BytesIO(gzip.compress(SAMPLE_VCF.encode()))
+    variants, patient_id, success = parse_vcf_stream(stream)
+    assert success
+    assert patient_id == "PATIENT_TEST"
+    assert len(variants) == 2
+
+
+def test_vcf_tabix_region_seek():
+    import io
+    from app.services.tabix import write_bgzf_vcf
+    lines = SAMPLE_VCF.splitlines()
+    # Annotated records far outside any pharmacogene locus
+    lines.insert(7, "22\t50000000\trs_far2\tC\tT\t.\tPASS\tGENE=CYP2D6;STAR=*4\tGT\t0/1")
+    lines.insert(6, "1\t1000\trs_far\tA\tG\t.\tPASS\tGENE=DPYD;STAR=*2A\tGT\t0/1")
+    vcf = io.BytesIO()
+    tbi = write_bgzf_vcf(lines, vcf)
+
+    vcf.seek(0)
+    full, _, _ = parse_vcf_stream(vcf)
+    assert len(full) == 4  # bgzip without index: full scan
+
+    vcf.seek(0)
+    variants, patient_id, success = parse_vcf_stream(vcf, index=io.BytesIO(tbi))
+    assert success
+    assert patient_id == "PATIENT_TEST"
+    assert sorted(v.rsid for v in variants) == ["rs3892097", "rs4244285"]
+
+
+UNANNOTATED_VCF = """\
+##fileformat=VCFv4.2
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tRAW_SAMPLE
+chr1\t1000\t.\tA\tG\t50\tPASS\tDP=30\tGT\t0/1
+chr10\t96702047\trs1799853\tC\tT\t50\tPASS\tDP=30\tGT\t0/1
+chr22\t42524947\trs3892097\tC\tT\t50\tPASS\tDP=30\tGT\t1/1
+chr22\t50000000\t.\tC\tT\t50\tPASS\tDP=30\tGT\t0/1
+"""
+
+
+def test_gene_region_lookup():
+    from app.utils.knowledge_base import gene_at
+    assert gene_at("22", 42524947) == "CYP2D6"
+    assert gene_at("chr10", 96702047) == "CYP2C9"
+    assert gene_at("10", 96541616) == "CYP2C19"
+    assert gene_at("10", 96650000) is None
+    assert gene_at("X", 1) is None
+
+
+def test_vcf_unannotated_records_assigned_by_coordinate():
+    variants, patient_id, success = parse_vcf(UNANNOTATED_VCF)
+    assert success
+    assert patient_id == "RAW_SAMPLE"
+    assert [(v.rsid, v.gene) for v in variants] == [
+        ("rs1799853", "CYP2C9"), ("rs3892097", "CYP2D6")
+    ]
+
+
+def test_vcf_gene_tag_kept_off_region_without_header_declaration():
+    from app.services.vcf_parser import VCFReader
+    lines = UNANNOTATED_VCF.splitlines()
+    # No ##INFO=<ID=GENE header; the record is outside every indexed locus
+    lines.append("chr1\t5000\trs_tagged\tA\tG\t50\tPASS\tGENE=DPYD;STAR=*2A\tGT\t0/1")
+    reader = VCFReader(lines)
+    variants = list(reader)
+    assert ("rs_tagged", "DPYD", "*2A") in [(v.rsid, v.gene, v.star_allele) for v in variants]
+    assert reader.skipped["off_target"] == 2   # chr1:1000 and chr22:50000000, both untagged
+
+
+def test_vcf_unannotated_star_alleles_called_inline():
+    variants, _, _ = parse_vcf(UNANNOTATED_VCF)
+    stars = {v.rsid: (v.gene, v.star_allele) for v in variants}
+    assert stars["rs1799853"] == ("CYP2C9", "*2")
+    assert stars["rs3892097"] == ("CYP2D6", "*4")
+    assert determine_diplotype(variants, "CYP2D6") == "*4/*4"
+
+
+def test_star_allele_lookup_by_rsid():
+    from app.utils.knowledge_base import lookup_star_allele
+    # GRCh38 coordinate for CYP2C19*2: resolved through the rsID table
+    assert lookup_star_allele("chr10", 94781859, "G", "A", "rs4244285") == (
+        "CYP2C19", "*2", "rs4244285"
+    )
+    assert lookup_star_allele("10", 96541616, "G", "A,T") == ("CYP2C19", "*2", "rs4244285")
+    assert lookup_star_allele("10", 96541616, "G", "C") is None
+
+
+COHORT_VCF = """\
+##fileformat=VCFv4.2
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Depth">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\tS3\tS4
+10\t96541616\trs4244285\tG\tA\t50\tPASS\t.\tGT:DP\t0/0:30\t0/1:28\t1/1:31\t0|1:25
+10\t96521657\trs12248560\tC\tT\t50\tPASS\t.\tGT:DP\t0/1:30\t0/0:28\t0/0:31\t1|0:25
+22\t42524947\trs3892097\tC\tT\t50\tPASS\t.\tGT:DP\t0/0:30\t1/1:28\t0/1:31\t./.:25
+"""
+
+
+def _single_sample_vcf(vcf: str, column: int) -> str:
+    keep = list(range(9)) + [9 + column]
+    return "\n".join(
+        line if line.startswith("##") else "\t".join(line.split("\t")[i] for i in keep)
+        for line in vcf.splitlines()
+    )
+
+
+def test_cohort_matrix_parsing():
+    from app.services.vcf_parser import parse_vcf_cohort
+    matrix = parse_vcf_cohort(COHORT_VCF.splitlines())
+    assert matrix.samples == ["S1", "S2", "S3", "S4"]
+    assert [v.star_allele for v in matrix.variants] == ["*2", "*17", "*4"]
+    assert list(matrix.dosages[0]) == [0, 1, 2, 1]
+    assert matrix.gene_rows("CYP2C19") == [0, 1]
+
+
+def test_cohort_analysis_matches_single_sample():
+    from app.services.vcf_parser import parse_vcf_cohort
+    from app.services.pgx_engine import analyze_drug_cohort
+    matrix = parse_vcf_cohort(COHORT_VCF.splitlines())
+    for drug in ("CLOPIDOGREL", "CODEINE"):
+        batched = analyze_drug_cohort(drug, matrix)
+        assert len(batched) == 4
+        for j in range(4):
+            variants, _, _ = parse_vcf(_single_sample_vcf(COHORT_VCF, j))
+            risk, profile = analyze_drug(drug, variants)
+            assert len(batched[j]) == 3
+            assert batched[j][0] == risk
+            assert batched[j][1].diplotype == profile.diplotype
+            assert batched[j][1].phenotype == profile.phenotype
+
+
+def test_cohort_endpoint():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    client = TestClient(app)
+    resp = client.post(
+        "/api/analyze/cohort",
+        files={"vcf_file": ("cohort.vcf", COHORT_VCF.encode())},
+        data={"drugs": "CLOPIDOGREL"},
+    )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [s["sample_id"] for s in body] == ["S1", "S2", "S3", "S4"]
+    s3 = body[2]["results"][0]
+    assert s3["patient_id"] == "S3"
+    assert s3["pharmacogenomic_profile"]["phenotype"] == "PM"
+    assert s3["risk_assessment"]["risk_label"] == "Ineffective"
+
+
+def test_cohort_explanations_not_shared_across_driving_genes():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    # Same diplotype, phenotype and risk label, but driven by CYP2C9 in A and VKORC1 in B
+    vcf = (
+        "##fileformat=VCFv4.2\n"
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tA\tB\n"
+        "10\t96702047\trs1799853\tC\tT\t.\tPASS\t.\tGT\t0/1\t0/0\n"
+        "16\t31107689\trs9923231\tC\tT\t.\tPASS\t.\tGT\t0/0\t0/1\n"
+    )
+    resp = TestClient(app).post(
+        "/api/analyze/cohort", files={"vcf_file": ("w.vcf", vcf.encode())}, data={"drugs": "WARFARIN"}
+    )
+    assert resp.status_code == 200
+    a, b = (sample["results"][0] for sample in resp.json())
+    for result, gene in ((a, "CYP2C9"), (b, "VKORC1")):
+        profile = result["pharmacogenomic_profile"]
+        assert (profile["primary_gene"], profile["diplotype"], profile["phenotype"]) == (gene, "*1/*2", "IM")
+        assert f"in {gene}" in result["llm_generated_explanation"]["summary"]
+    assert a["risk_assessment"]["risk_label"] == b["risk_assessment"]["risk_label"]
+
+
+def test_batch_endpoint_reports_per_file_errors():
+    import gzip
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as client:
+        resp = client.post(
+            "/api/analyze/batch",
+            files=[
+                ("vcf_files", ("a.vcf", SAMPLE_VCF.encode())),
+                ("vcf_files", ("b.vcf.gz", gzip.compress(UNANNOTATED_VCF.encode()))),
+                ("vcf_files", ("empty.vcf", b"##fileformat=VCFv4.2\n")),
+                ("vcf_files", ("notes.txt", b"hello")),
+            ],
+            data={"drugs": "CODEINE,CLOPIDOGREL"},
+        )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [r["filename"] for r in body] == ["a.vcf", "b.vcf.gz", "empty.vcf", "notes.txt"]
+    assert [r["status"] for r in body] == ["ok", "ok", "error", "error"]
+    assert body[0]["results"][0]["patient_id"] == "PATIENT_TEST"
+    assert body[1]["results"][0]["pharmacogenomic_profile"]["diplotype"] == "*4/*4"
+    assert [r["drug"] for r in body[1]["results"]] == ["CODEINE", "CLOPIDOGREL"]
+    assert body[3]["results"] == []
+
+
+def test_batch_endpoint_goes_through_analysis_executor():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services import executor as executor_module
+    from app.services.executor import BoundedExecutor
+
+    client = TestClient(app)
+    files = [("vcf_files", (f"{i}.vcf", SAMPLE_VCF.encode())) for i in range(3)]
+    try:
+        executor_module._executor = BoundedExecutor("process", max_workers=1, max_queue=0)
+        resp = client.post("/api/analyze/batch", files=files, data={"drugs": "CODEINE"})
+        assert resp.status_code == 200
+        assert [r["status"] for r in resp.json()] == ["ok"] * 3   # one at a time, never rejected
+        assert executor_module._executor.stats()["completed"] == 3
+
+        executor_module._executor.pending = 1  # simulate a busy worker
+        resp = client.post("/api/analyze/batch", files=files, data={"drugs": "CODEINE"})
+        assert resp.status_code == 503
+        assert resp.headers["retry-after"] == "2"
+    finally:
+        executor_module._executor.pending = 0
+        executor_module.shutdown_analysis_executor()
+
+
+def test_executor_rejects_when_queue_full():
+    import asyncio, threading
+    from app.services.executor import BoundedExecutor, ExecutorSaturated
+
+    async def scenario():
+        executor = BoundedExecutor("thread", max_workers=1, max_queue=1, retry_after=7)
+        release = threading.Event()
+        running = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert executor.stats()["running"] == 1
+        assert executor.stats()["queued"] == 1
+        try:
+            await executor.run(len, "x")
+        except ExecutorSaturated as e:
+            assert e.retry_after == 7
+        else:
+            raise AssertionError("Expected ExecutorSaturated")
+        release.set()
+        await asyncio.gather(*running)
+        stats = executor.stats()
+        executor.shutdown()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["completed"] == 2
+    assert stats["rejected"] == 1
+    assert stats["queued"] == 0
+
+
+def test_executor_keeps_cancelled_running_job_pending():
+    import asyncio, threading
+    from app.services.executor import BoundedExecutor, ExecutorSaturated
+
+    async def scenario():
+        executor = BoundedExecutor("thread", max_workers=1, max_queue=0)
+        started, release = threading.Event(), threading.Event()
+
+        def job():
+            started.set()
+            release.wait()
+
+        task = asyncio.ensure_future(executor.run(job))
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, started.wait)
+            task.cancel()   # e.g. the client disconnected
+            await asyncio.gather(task, return_exceptions=True)
+            # The worker is still busy: its slot stays taken until the job ends
+            assert executor.pending == 1
+            try:
+                await executor.run(len, "x")
+            except ExecutorSaturated:
+                pass
+            else:
+                raise AssertionError("Expected ExecutorSaturated")
+        finally:
+            release.set()
+        for _ in range(100):
+            if executor.pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert executor.pending == 0
+        assert await executor.run(len, "x") == 1
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_analyze_endpoint_process_executor_and_backpressure():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services import executor as executor_module
+    from app.services.executor import BoundedExecutor
+    from app.services.parse_cache import get_parse_cache
+
+    client = TestClient(app)
+    upload = {"vcf_file": ("p.vcf", SAMPLE_VCF.encode())}
+    try:
+        executor_module._executor = BoundedExecutor("process", max_workers=1, max_queue=0)
+        resp = client.post("/api/analyze", files=upload, data={"drugs": "CODEINE"})
+        assert resp.status_code == 200
+        assert resp.json()[0]["pharmacogenomic_profile"]["diplotype"] == "*1/*4"
+        # A parse-cache hit skips parsing but still runs its drug assessment in the executor
+        resp = client.post("/api/analyze", files=upload, data={"drugs": "CODEINE,WARFARIN"})
+        assert resp.status_code == 200 and len(resp.json()) == 2
+        assert executor_module._executor.completed == 2
+
+        executor_module._executor.pending = 1  # simulate a busy worker
+        get_parse_cache().clear()
+        resp = client.post("/api/analyze", files=upload, data={"drugs": "CODEINE"})
+        assert resp.status_code == 503
+        assert resp.headers["retry-after"] == "2"
+        assert client.get("/api/health").json()["analysis_executor"]["rejected"] == 1
+    finally:
+        executor_module._executor.pending = 0
+        executor_module.shutdown_analysis_executor()
+
+
+def test_metrics_aggregated_across_worker_processes():
+    import json, tempfile
+    from app.services import metrics
+
+    def worker_file(directory, pid, assessments, parse_seconds, in_flight):
+        series = [0] * (len(metrics.STAGE_SECONDS.buckets) + 1) + [parse_seconds]
+        series[-2] = 1   # one observation in the +Inf bucket
+        with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+            json.dump({"pid": pid, "series": {
+                "pharmaguard_drug_assessments_total": [[[], assessments]],
+                "pharmaguard_stage_duration_seconds": [[["parse"], series]],
+            }, "gauges": [["pharmaguard_http_requests_in_flight", "gauge", "In flight.", [[{}, in_flight]]]]}, f)
+
+    saved = metrics.METRICS_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        alive, exited = os.getppid(), 2 ** 31 - 1
+        worker_file(tmp, alive, 5, 40.0, 3)
+        worker_file(tmp, exited, 7, 50.0, 9)
+        assessments = metrics.DRUG_ASSESSMENTS.value()
+        parses = metrics.STAGE_SECONDS.count(stage="parse")
+        metrics.METRICS_DIR = tmp
+        try:
+            text = metrics.render()
+        finally:
+            metrics.METRICS_DIR = saved
+        assert os.path.exists(os.path.join(tmp, f"{os.getpid()}.json"))   # this worker's own file
+
+    lines = text.splitlines()
+    # Counters and histograms: summed over every worker, exited ones (not yet retired) included
+    assert f"pharmaguard_drug_assessments_total {int(assessments) + 12}" in lines
+    assert f'pharmaguard_stage_duration_seconds_count{{stage="parse"}} {parses + 2}' in lines
+    # Gauges: one series per live worker
+    assert f'pharmaguard_http_requests_in_flight{{worker="{alive}"}} 3' in lines
+    assert not any(f'worker="{exited}"' in line for line in lines)
+    assert any(line.startswith(f'pharmaguard_executor_jobs{{state="running",worker="{os.getpid()}"}}') for line in lines)
+    assert sum(line.startswith("# TYPE pharmaguard_http_requests_in_flight ") for line in lines) == 1
+
+
+def test_metrics_exited_worker_retired_into_one_file():
+    import json, tempfile
+    from app.services import metrics
+
+    def worker_file(directory, pid, assessments):
+        with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+            json.dump({"pid": pid, "series": {"pharmaguard_drug_assessments_total": [[[], assessments]]},
+                       "gauges": [["pharmaguard_http_requests_in_flight", "gauge", "In flight.", [[{}, 4]]]]}, f)
+
+    def total(text):
+        return float(next(
+            line.split()[1] for line in text.splitlines() if line.startswith("pharmaguard_drug_assessments_total ")
+        ))
+
+    saved = metrics.METRICS_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics.METRICS_DIR = tmp
+        try:
+            before = total(metrics.render())
+            # Two workers exit in turn; the second reuses the first one's pid
+            recycled = 2 ** 31 - 1
+            worker_file(tmp, recycled, 7)
+            metrics.retire(recycled)
+            worker_file(tmp, recycled, 5)
+            metrics.retire(recycled)
+            metrics.retire(recycled)   # already gone: no-op
+            assert sorted(os.listdir(tmp)) == sorted([f"{os.getpid()}.json", metrics.RETIRED_FILE])
+            text = metrics.render()
+        finally:
+            metrics.METRICS_DIR = saved
+    assert total(text) == before + 12   # retired totals are kept, not dropped or double counted
+    assert 'worker="None"' not in text
+
+
+def test_metrics_endpoint_reports_stages_and_counters():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services import executor as executor_module, metrics
+    from app.services.executor import BoundedExecutor
+    from app.services.parse_cache import get_parse_cache
+
+    def scrape():
+        values = {}
+        for line in client.get("/metrics").text.splitlines():
+            if line and not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                values[name] = float(value)
+        return values
+
+    client = TestClient(app)
+    get_parse_cache().clear()
+    before = scrape()
+    vcf = SAMPLE_VCF + "1\t100\trs1\tA\tG\t.\tPASS\t.\tGT\t0/1\nbroken line\n"
+    try:
+        # Process mode: stage timings recorded in the worker reach the parent
+        executor_module._executor = BoundedExecutor("process", max_workers=1, max_queue=0)
+        resp = client.post("/api/analyze", files={"vcf_file": ("p.vcf", vcf.encode())}, data={"drugs": "CODEINE"})
+    finally:
+        executor_module.shutdown_analysis_executor()
+    assert resp.status_code == 200
+    after = scrape()
+    delta = lambda name: after.get(name, 0) - before.get(name, 0)
+
+    for stage in ("upload", "hash", "queue_wait", "parse", "analyze", "explain", "serialize"):
+        assert delta(f'pharmaguard_stage_duration_seconds_count{{stage="{stage}"}}') == 1, stage
+    assert delta('pharmaguard_http_requests_total{endpoint="analyze",method="POST",status="200"}') == 1
+    assert delta("pharmaguard_variants_parsed_total") == len(parse_vcf(SAMPLE_VCF)[0])
+    assert delta('pharmaguard_vcf_records_skipped_total{reason="off_target"}') == 1
+    assert delta('pharmaguard_vcf_records_skipped_total{reason="malformed"}') == 1
+    assert delta("pharmaguard_drug_assessments_total") == 1
+    assert after['pharmaguard_llm_circuit_state{state="closed"}'] == 1
+    assert after['pharmaguard_stage_duration_seconds_bucket{stage="parse",le="+Inf"}'] == after[
+        'pharmaguard_stage_duration_seconds_count{stage="parse"}'
+    ]
+    assert client.get("/metrics").headers["content-type"] == metrics.CONTENT_TYPE
+
+
+def test_explanations_run_concurrently_with_timeout_fallback():
+    import asyncio, time
+    from app.models.schemas import LLMExplanation
+    from app.services import llm_service
+
+    llm_service.get_explanation_cache().clear()
+    async def fake_openai(api_key, drug, *args):
+        await asyncio.sleep(5 if drug == "SLOW" else 0.2)
+        return LLMExplanation(summary=f"llm:{drug}", mechanism="", variant_impact="", clinical_significance="")
+
+    requests = [
+        dict(drug=d, gene="CYP2D6", phenotype="NM", diplotype="*1/*1",
+             risk_label="Safe", severity="none", dosing_guidance="")
+        for d in ("A", "B", "C", "SLOW")
+    ]
+    saved = (llm_service._openai_explanation, llm_service.LLM_TIMEOUT, os.environ.get("OPENAI_API_KEY"))
+    llm_service._openai_explanation = fake_openai
+    llm_service.LLM_TIMEOUT = 0.5
+    os.environ["OPENAI_API_KEY"] = "test-key"
+    try:
+        start = time.perf_counter()
+        results = asyncio.run(llm_service.generate_explanations(requests, concurrency=4))
+        elapsed = time.perf_counter() - start
+    finally:
+        llm_service._openai_explanation, llm_service.LLM_TIMEOUT = saved[0], saved[1]
+        if saved[2] is None:
+            os.environ.pop("OPENAI_API_KEY")
+        else:
+            os.environ["OPENAI_API_KEY"] = saved[2]
+
+    assert [r.summary for r in results[:3]] == ["llm:A", "llm:B", "llm:C"]
+    assert results[3].summary.startswith("This patient carries")  # rule-based fallback
+    assert elapsed < 1.5  # bounded by the timeout, not the sum of calls
+
+
+def test_batched_explanations_one_call_per_round_with_fallback():
+    import asyncio
+    from app.models.schemas import LLMExplanation
+    from app.services import llm_service
+
+    llm_service.get_explanation_cache().clear()
+    calls = []
+
+    async def fake_batch(api_key, batch):
+        calls.append([r["drug"] for r in batch])
+        # Model "forgets" drug B
+        return {
+            r["drug"]: LLMExplanation(summary=f"llm:{r['drug']}", mechanism="", variant_impact="", clinical_significance="")
+            for r in batch if r["drug"] != "B"
+        }
+
+    requests = [
+        dict(drug=d, gene="CYP2D6", phenotype=p, diplotype="*1/*1",
+             risk_label="Safe", severity="none", dosing_guidance="")
+        for d, p in (("A", "NM"), ("B", "NM"), ("A", "PM"))
+    ]
+    saved = (llm_service._openai_batch_explanation, llm_service.LLM_BATCH_MODE, os.environ.get("OPENAI_API_KEY"))
+    llm_service._openai_batch_explanation = fake_batch
+    llm_service.LLM_BATCH_MODE = True
+    os.environ["OPENAI_API_KEY"] = "test-key"
+    try:
+        results = asyncio.run(llm_service.generate_explanations(requests))
+    finally:
+        llm_service._openai_batch_explanation, llm_service.LLM_BATCH_MODE = saved[0], saved[1]
+        if saved[2] is None:
+            os.environ.pop("OPENAI_API_KEY")
+        else:
+            os.environ["OPENAI_API_KEY"] = saved[2]
+
+    assert sorted(calls) == [["A"], ["A", "B"]]  # drug keys are unique within a round
+    assert results[0].summary == "llm:A" and results[2].summary == "llm:A"
+    assert results[1].summary.startswith("This patient carries")  # missing from reply
+
+
+def test_explanation_cache_io_runs_off_the_event_loop():
+    import asyncio, threading
+    from app.services import llm_service
+
+    cache = llm_service.get_explanation_cache()
+    cache.clear()
+    threads = []
+    saved = (cache.get_many, cache.put, os.environ.pop("OPENAI_API_KEY", None))
+    cache.get_many = lambda keys: threads.append(threading.current_thread()) or saved[0](keys)
+    cache.put = lambda key, value: threads.append(threading.current_thread()) or saved[1](key, value)
+    requests = [dict(drug="CODEINE", gene="CYP2D6", phenotype="PM", diplotype="*4/*4",
+                     risk_label="Ineffective", severity="high", dosing_guidance="Avoid")]
+    try:
+        asyncio.run(llm_service.generate_explanations(requests))   # miss, then store
+        asyncio.run(llm_service.generate_explanations(requests))   # hit
+    finally:
+        del cache.get_many, cache.put
+        if saved[2] is not None:
+            os.environ["OPENAI_API_KEY"] = saved[2]
+    assert len(threads) == 3 and threading.main_thread() not in threads
+
+
+def test_explanation_cache_tiers_ttl_and_model_version():
+    import asyncio, tempfile, time
+    from app.services import llm_service
+    from app.services.explanation_cache import ExplanationCache, cache_key
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "explanations.db")
+        worker_a = ExplanationCache(max_entries=2, path=path, ttl=60)
+        worker_b = ExplanationCache(max_entries=2, path=path, ttl=60)
+        explanation = llm_service._rule_based_explanation("CODEINE", "CYP2D6", "PM", "*4/*4", "Ineffective")
+        key = cache_key("gpt-4o-mini/prompt-2", "CODEINE", "CYP2D6", "*4/*4", "PM", "Ineffective", "high", "Avoid")
+
+        assert worker_b.get(key) is None
+        worker_a.put(key, explanation)
+        assert worker_b.get(key) == explanation   # shared through SQLite
+        assert worker_b.get(key) == explanation   # now in worker_b's LRU
+        assert (worker_b.disk_hits, worker_b.memory_hits, worker_b.misses) == (1, 1, 1)
+
+        # A new model version never sees the old entry
+        assert worker_b.get(cache_key("gpt-4o/prompt-2", "CODEINE", "CYP2D6", "*4/*4", "PM", "Ineffective", "high", "Avoid")) is None
+        # Same single-gene outcome, different severity / guidance (combination rule): separate entries
+        assert worker_b.get(cache_key("gpt-4o-mini/prompt-2", "CODEINE", "CYP2D6", "*4/*4", "PM", "Ineffective", "critical", "Avoid")) is None
+        assert worker_b.get(cache_key("gpt-4o-mini/prompt-2", "CODEINE", "CYP2D6", "*4/*4", "PM", "Ineffective", "high", "Other")) is None
+
+        worker_b.ttl = 0.01
+        time.sleep(0.02)
+        assert worker_b.get(key) is None and worker_b.expired >= 1
+        assert worker_b.purge_expired() == 1
+
+    # Rule-based explanations are cached in the process-wide cache
+    cache = llm_service.get_explanation_cache()
+    cache.clear()
+    saved = os.environ.pop("OPENAI_API_KEY", None)
+    try:
+        kwargs = dict(drug="WARFARIN", gene="CYP2C9", phenotype="IM", diplotype="*1/*2",
+                      risk_label="Adjust Dosage", severity="moderate", dosing_guidance="")
+        hits_before = cache.memory_hits
+        first = asyncio.run(llm_service.generate_explanation(**kwargs))
+        second = asyncio.run(llm_service.generate_explanation(**kwargs))
+    finally:
+        if saved is not None:
+            os.environ["OPENAI_API_KEY"] = saved
+    assert first == second
+    assert cache.memory_hits == hits_before + 1
+
+
+def _start_stub_llm_server(statuses, delays=()):
+    """
+    Local chat-completions stub answering with the given HTTP statuses in turn
+    (last one repeats), the n-th reply after delays[n] seconds if given.
+    """
+    import json, threading, time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            seen.append(self.path)
+            n = len(seen)
+            status = statuses[min(n, len(statuses)) - 1]
+            if n <= len(delays):
+                time.sleep(delays[n - 1])
+            body = json.dumps({"choices": [{"message": {"content": '{"summary": "stub"}'}}]}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1", seen
+
+
+def test_llm_client_retries_transient_errors():
+    import asyncio
+    from app.services.llm_client import LLMClient
+
+    server, base_url, seen = _start_stub_llm_server([503, 500, 200])
+
+    async def run():
+        client = LLMClient(base_url=base_url, max_retries=2, backoff_base=0.001)
+        try:
+            return await client.chat("k", "m", [{"role": "user", "content": "hi"}], 0.3, 10), client.stats()
+        finally:
+            await client.aclose()
+
+    try:
+        content, stats = asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert content == '{"summary": "stub"}'
+    assert seen == ["/v1/chat/completions"] * 3
+    assert stats["retries"] == 2 and stats["circuit"]["state"] == "closed"
+
+
+def test_llm_client_splits_budget_across_attempts():
+    import asyncio, time
+    from app.services.llm_client import LLMClient, LLMError
+
+    async def call(base_url, budget, backoff):
+        client = LLMClient(base_url=base_url, max_retries=2, read_timeout=8)
+        client._backoff = lambda attempt, response: backoff   # no jitter
+        try:
+            return await client.chat("k", "m", [{"role": "user", "content": "hi"}], 0.3, 10, timeout=budget), client
+        except LLMError as e:
+            return e, client
+        finally:
+            await client.aclose()
+
+    # First attempt hangs longer than the whole budget; the retry still fits
+    hung, hung_url, hung_seen = _start_stub_llm_server([200], delays=[2.0])
+    # Backoff longer than the budget: give up instead of retrying
+    busy, busy_url, busy_seen = _start_stub_llm_server([503])
+    try:
+        start = time.monotonic()
+        content, _ = asyncio.run(call(hung_url, 1.2, 0.001))
+        elapsed = time.monotonic() - start
+        error, client = asyncio.run(call(busy_url, 0.5, 5))
+    finally:
+        hung.shutdown()
+        busy.shutdown()
+    assert content == '{"summary": "stub"}' and len(hung_seen) == 2 and elapsed < 1.2
+    assert isinstance(error, LLMError) and len(busy_seen) == 1 and client.retries == 0
+
+
+def test_llm_client_circuit_breaker_opens_and_recovers():
+    import asyncio, time
+    from app.services.llm_client import CircuitBreaker, CircuitOpenError, LLMClient, LLMError
+
+    server, base_url, seen = _start_stub_llm_server([500, 500, 200], delays=[0, 0, 0.1])
+    breaker = CircuitBreaker(threshold=2, cooldown=0.2)
+
+    async def call(client):
+        return await client.chat("k", "m", [{"role": "user", "content": "hi"}], 0.3, 10)
+
+    async def run():
+        client = LLMClient(base_url=base_url, max_retries=0, breaker=breaker)
+        try:
+            for _ in range(2):
+                try:
+                    await call(client)
+                    assert False, "expected LLMError"
+                except LLMError as e:
+                    assert not isinstance(e, CircuitOpenError)
+            assert breaker.state == "open"
+            try:
+                await call(client)
+                assert False, "expected CircuitOpenError"
+            except CircuitOpenError:
+                pass
+            assert len(seen) == 2              # open circuit never reached the server
+            time.sleep(0.25)
+            assert breaker.state == "half-open"
+            # One trial call at a time; concurrent callers fail fast meanwhile
+            return await asyncio.gather(call(client), call(client), return_exceptions=True)
+        finally:
+            await client.aclose()
+
+    try:
+        trial, concurrent = asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert trial == '{"summary": "stub"}'
+    assert isinstance(concurrent, CircuitOpenError) and len(seen) == 3
+    assert breaker.state == "closed" and breaker.short_circuited == 2
+    assert not breaker.trial_in_flight
+
+
+def test_decision_tables_match_knowledge_base():
+    from app.utils.decision_tables import FUNCTIONS, N_FUNCTIONS, diplotype_code
+    from app.utils.knowledge_base import current, get_clinical_rec
+
+    kb = current()
+    for drug, genes in kb.drug_genes.items():
+        for gene in genes:
+            for i, f1 in enumerate(FUNCTIONS):
+                for k, f2 in enumerate(FUNCTIONS):
+                    decision = kb.tables.gene_decisions[(drug, gene)][i * N_FUNCTIONS + k]
+                    phenotype = diplotype_to_phenotype(gene, f1, f2)
+                    label, confidence, severity, _ = kb.risk_rules[drug][gene][phenotype]
+                    assert decision.phenotype == phenotype
+                    assert (decision.risk.risk_label, decision.risk.confidence_score, decision.risk.severity) == \
+                        (label, confidence, severity)
+                    assert decision.clinical_rec == get_clinical_rec(drug, phenotype, gene)
+
+    codeine = kb.tables.gene_decisions[("CODEINE", "CYP2D6")]
+    decision = codeine[diplotype_code(kb, "CYP2D6", "*4/*4")]
+    assert decision.phenotype == "PM" and decision.risk.risk_label == "Ineffective"
+    assert diplotype_code(kb, "CYP2D6", "*1") == diplotype_code(kb, "CYP2D6", "*1/*1")
+    # Lookups never write to the shared snapshot's tables
+    tables = tuple(len(t) for t in kb.tables)
+    diplotype_code(kb, "CYP2D6", "*123/*456")
+    assert tuple(len(t) for t in kb.tables) == tables
+
+
+def test_allele_function_is_gene_scoped():
+    from app.models.schemas import DetectedVariant
+    from app.utils.knowledge_base import current, get_activity_score
+    from app.utils.decision_tables import diplotype_code
+
+    assert get_allele_function("CYP2D6", "*2") == "normal"
+    assert get_allele_function("TPMT", "*2") == "nonfunctional"
+    assert get_allele_function("CYP2C9", "*2") == "decreased"
+    assert get_allele_function("CYP2D6", "*17") == "decreased"
+    assert get_allele_function("CYP2C19", "*17") == "increased"
+    assert get_allele_function("CYP2D6", "*99") == "normal"
+    assert get_activity_score("CYP2D6", "*10") == 0.25
+    assert get_activity_score("CYP2D6", "*4") == 0.0
+
+    # CYP2D6 *1/*2 is a normal metabolizer (was PM-scored via TPMT *2)
+    kb = current()
+    assert kb.tables.gene_phenotypes["CYP2D6"][diplotype_code(kb, "CYP2D6", "*1/*2")] == "NM"
+    assert kb.tables.gene_phenotypes["TPMT"][diplotype_code(kb, "TPMT", "*1/*2")] == "IM"
+
+    variants = [
+        DetectedVariant(rsid="rs16947", chromosome="22", position=42523943, ref="G", alt="A",
+                        gene="CYP2D6", star_allele="*2", genotype="0/1"),
+        DetectedVariant(rsid="rs3892097", chromosome="22", position=42524947, ref="C", alt="T",
+                        gene="CYP2D6", star_allele="*4", genotype="0/1"),
+    ]
+    assert determine_diplotype(variants, "CYP2D6") == "*1/*4"
+
+
+def _variant(gene, star, rsid, chrom, pos, ref, alt, genotype):
+    from app.models.schemas import DetectedVariant
+    return DetectedVariant(rsid=rsid, gene=gene, star_allele=star, chromosome=chrom, position=pos,
+                           ref=ref, alt=alt, genotype=genotype)
+
+
+def test_multi_gene_drugs():
+    from app.services.pgx_engine import assess_drug
+    from app.utils.knowledge_base import current
+
+    kb = current()
+    assert kb.drug_genes["WARFARIN"] == ("CYP2C9", "VKORC1")
+    assert kb.drug_genes["AZATHIOPRINE"] == ("TPMT", "NUDT15")
+    assert kb.drug_gene_map["WARFARIN"] == "CYP2C9"
+    assert kb.gene_drug_map["VKORC1"] == ["WARFARIN"]
+
+    # VKORC1 alone drives warfarin when CYP2C9 is normal
+    vkorc1 = _variant("VKORC1", "*2", "rs9923231", "16", 31107689, "C", "T", "1/1")
+    risk, profile, rec = assess_drug("WARFARIN", [vkorc1])
+    assert profile.primary_gene == "VKORC1" and profile.phenotype == "PM"
+    assert risk.risk_label == "Adjust Dosage" and risk.severity == "high"
+    assert [(g.gene, g.diplotype, g.phenotype) for g in profile.gene_results] == \
+        [("CYP2C9", "*1/*1", "NM"), ("VKORC1", "*2/*2", "PM")]
+
+    # CYP2C9 PM + VKORC1 PM hits the combination rule
+    cyp2c9 = _variant("CYP2C9", "*3", "rs1057910", "10", 96741053, "A", "C", "1/1")
+    risk, profile, rec = assess_drug("WARFARIN", [cyp2c9, vkorc1])
+    assert risk.severity == "critical" and profile.primary_gene == "CYP2C9"
+    assert rec["action"].startswith("Reduce Initial Dose Substantially")
+    assert len(profile.detected_variants) == 2
+
+    # NUDT15 deficiency outranks normal TPMT for thiopurines
+    nudt15 = _variant("NUDT15", "*3", "rs116855232", "13", 48619855, "C", "T", "1/1")
+    risk, profile, rec = assess_drug("AZATHIOPRINE", [nudt15])
+    assert risk.risk_label == "Toxic" and profile.primary_gene == "NUDT15"
+    assert "NUDT15" in rec["cpic_guideline"]
+
+    # Single-gene drugs are unchanged
+    risk, profile, _ = assess_drug("CODEINE", [vkorc1])
+    assert profile.primary_gene == "CYP2D6" and profile.gene_results == []
+
+
+def test_panel_mode_calls_each_gene_once():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services import pgx_engine
+    from app.utils.knowledge_base import current
+
+    kb = current()
+    variants, _, _ = parse_vcf(SAMPLE_VCF)
+    calls = []
+    original = pgx_engine.diplotype_from_gene_variants
+    pgx_engine.diplotype_from_gene_variants = lambda gene_vars, gene, kb=None: (
+        calls.append(gene) or original(gene_vars, gene, kb)
+    )
+    try:
+        panel = pgx_engine.assess_panel(kb.supported_drugs, variants, kb)
+    finally:
+        pgx_engine.diplotype_from_gene_variants = original
+
+    # One call per gene, shared by every drug that uses it
+    assert sorted(calls) == sorted(set(calls)) == sorted(kb.supported_genes)
+    for drug, risk, profile, rec in panel:
+        assert (risk, profile, rec) == pgx_engine.assess_drug(drug, variants, kb)
+
+    resp = TestClient(app).post(
+        "/api/analyze",
+        data={"drugs": "all"},
+        files={"vcf_file": ("p.vcf", SAMPLE_VCF.encode())},
+    )
+    assert resp.status_code == 200
+    assert [r["drug"] for r in resp.json()] == kb.supported_drugs
+
+
+def test_compact_variant_records():
+    import pickle
+    from app.models.schemas import DetectedVariant
+    from app.services.pgx_engine import assess_panel
+    from app.services.vcf_parser import Variant
+
+    variants, _, _ = parse_vcf(SAMPLE_VCF)
+    again, _, _ = parse_vcf(SAMPLE_VCF)
+    assert all(type(v) is Variant for v in variants)
+    assert not hasattr(variants[0], "__dict__")
+    assert variants[0].gene is again[0].gene   # interned
+    assert pickle.loads(pickle.dumps(variants)) == variants
+
+    # Models are materialized only for returned variants, once per record per
+    # analysis, and never stored on the (cacheable) record itself
+    model = variants[0].to_model()
+    assert isinstance(model, DetectedVariant) and model.model_dump()["position"] == variants[0].position
+    (_, _, codeine, _), (_, _, clopidogrel, _), (_, _, again, _) = assess_panel(
+        ["CODEINE", "CLOPIDOGREL", "CODEINE"], variants
+    )
+    assert codeine.detected_variants == [model] and clopidogrel.detected_variants == [variants[1].to_model()]
+    assert again.detected_variants[0] is codeine.detected_variants[0]
+    assert not hasattr(variants[0], "_model")
+
+
+def test_parse_cache_skips_reparse_and_serves_by_hash():
+    import hashlib, io, tempfile
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services import pipeline
+    from app.services.tabix import write_bgzf_vcf
+    from app.services.parse_cache import ParseCache, get_parse_cache
+
+    client = TestClient(app)
+    get_parse_cache().clear()
+    misses, hits = get_parse_cache().misses, get_parse_cache().stats()["memory_hits"]
+    vcf_hash = hashlib.sha256(SAMPLE_VCF.encode()).hexdigest()
+    resp = client.post("/api/analyze/cached", data={"vcf_hash": vcf_hash, "drugs": "CODEINE"})
+    assert resp.status_code == 404
+    assert get_parse_cache().misses == misses + 1   # one lookup, one miss
+
+    upload = {"vcf_file": ("p.vcf", SAMPLE_VCF.encode())}
+    first = client.post("/api/analyze", files=upload, data={"drugs": "CODEINE"})
+    assert first.status_code == 200 and first.headers["x-vcf-hash"] == vcf_hash
+
+    parses = []
+    original = pipeline.parse_vcf_lines
+    pipeline.parse_vcf_lines = lambda *a: parses.append(1) or original(*a)
+    try:
+        again = client.post("/api/analyze", files=upload, data={"drugs": "CODEINE"})
+        cached = client.post("/api/analyze/cached", data={"vcf_hash": vcf_hash, "drugs": "CLOPIDOGREL,WARFARIN"})
+    finally:
+        pipeline.parse_vcf_lines = original
+    assert parses == []
+    assert again.json()[0]["pharmacogenomic_profile"] == first.json()[0]["pharmacogenomic_profile"]
+    assert cached.status_code == 200 and [r["drug"] for r in cached.json()] == ["CLOPIDOGREL", "WARFARIN"]
+    assert cached.json()[0]["pharmacogenomic_profile"]["diplotype"] == "*2/*2"
+    assert client.post("/api/analyze/cached", data={"vcf_hash": "xyz", "drugs": "CODEINE"}).status_code == 400
+    assert get_parse_cache().stats()["memory_hits"] == hits + 2
+
+    # Tabix-indexed uploads are read by region: never hashed or cached
+    bgzf = io.BytesIO()
+    tbi = write_bgzf_vcf(SAMPLE_VCF.splitlines(), bgzf)
+    stores = get_parse_cache().stores
+    indexed = client.post("/api/analyze", data={"drugs": "CODEINE"}, files={
+        "vcf_file": ("p.vcf.gz", bgzf.getvalue()), "index_file": ("p.vcf.gz.tbi", tbi),
+    })
+    assert indexed.status_code == 200 and "x-vcf-hash" not in indexed.headers
+    assert indexed.json()[0]["pharmacogenomic_profile"]["diplotype"] == "*1/*4"
+    assert get_parse_cache().stores == stores
+
+    # Bounded by total variants; the SQLite tier is shared across processes
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "parses.db")
+        cache = ParseCache(max_entries=10, max_variants=5, path=path)
+        cache.put("a", "A", size=3)
+        cache.put("b", "B", size=3)
+        assert cache.stats()["entries"] == 1 and cache.stats()["evictions"] == 1
+        assert ParseCache(path=path).get("a") == "A"
+
+
+def test_compact_response_shape():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    upload = {"vcf_file": ("p.vcf", SAMPLE_VCF.encode())}
+    full = client.post("/api/analyze", files=upload, data={"drugs": "ALL"})
+    compact = client.post("/api/analyze", files=upload, data={"drugs": "ALL", "compact": "true"})
+    assert full.status_code == compact.status_code == 200
+    assert compact.headers["x-vcf-hash"] == full.headers["x-vcf-hash"]
+    assert len(compact.content) < len(full.content)
+
+    # Same per-drug content, with the shared fields hoisted to the top level
+    report = compact.json()
+    assert report["patient_id"] == full.json()[0]["patient_id"]
+    assert report["quality_metrics"] == full.json()[0]["quality_metrics"]
+    for entry, result in zip(report["results"], full.json()):
+        assert {**entry, "patient_id": report["patient_id"], "timestamp": result["timestamp"],
+                "quality_metrics": report["quality_metrics"]} == result
+
+    batch = client.post(
+        "/api/analyze/batch",
+        files=[("vcf_files", ("a.vcf", SAMPLE_VCF.encode())), ("vcf_files", ("b.vcf", b"not a vcf"))],
+        data={"drugs": "CODEINE", "compact": "true"},
+    ).json()
+    assert batch[0]["status"] == "ok" and batch[0]["report"]["results"][0]["drug"] == "CODEINE"
+    assert batch[1]["status"] == "error" and batch[1]["report"] is None
+
+
+def test_stream_sends_risk_first_then_explanations_as_ready():
+    import asyncio, json
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.models.schemas import LLMExplanation
+    from app.services import llm_service
+
+    llm_service.get_explanation_cache().clear()
+    delays = {"CODEINE": 0.3, "CLOPIDOGREL": 0.1, "WARFARIN": 0.2}
+    async def fake_openai(api_key, drug, *args):
+        await asyncio.sleep(delays[drug])
+        return LLMExplanation(summary=f"llm:{drug}", mechanism="", variant_impact="", clinical_significance="")
+
+    client = TestClient(app)
+    upload = {"vcf_file": ("p.vcf", SAMPLE_VCF.encode())}
+    saved = (llm_service._openai_explanation, os.environ.get("OPENAI_API_KEY"))
+    llm_service._openai_explanation = fake_openai
+    os.environ["OPENAI_API_KEY"] = "test-key"
+    try:
+        resp = client.post("/api/analyze/stream", files=upload, data={"drugs": "CODEINE,CLOPIDOGREL,WARFARIN"})
+        sse = client.post("/api/analyze/stream", files=upload, data={"drugs": "CODEINE", "format": "sse"})
+    finally:
+        llm_service._openai_explanation = saved[0]
+        if saved[1] is None:
+            os.environ.pop("OPENAI_API_KEY")
+        else:
+            os.environ["OPENAI_API_KEY"] = saved[1]
+    full = client.post("/api/analyze", files=upload, data={"drugs": "CODEINE,CLOPIDOGREL,WARFARIN"}).json()
+
+    assert resp.status_code == 200 and resp.headers["content-type"] == "application/x-ndjson"
+    assert "x-vcf-hash" in resp.headers
+    events = [json.loads(line) for line in resp.text.splitlines()]
+    assert [e["event"] for e in events] == ["risk"] * 3 + ["explanation"] * 3 + ["done"]
+    # Explanations go out in completion order, not request order
+    assert [e["drug"] for e in events[3:6]] == ["CLOPIDOGREL", "WARFARIN", "CODEINE"]
+    assert [e["index"] for e in events[3:6]] == [1, 2, 0]
+    assert events[3]["llm_generated_explanation"]["summary"] == "llm:CLOPIDOGREL"
+    for risk, expected in zip(events[:3], full):
+        assert risk["result"]["risk_assessment"] == expected["risk_assessment"]
+        assert risk["result"]["pharmacogenomic_profile"] == expected["pharmacogenomic_profile"]
+        assert risk["result"]["clinical_recommendation"] == expected["clinical_recommendation"]
+
+    assert sse.headers["content-type"].startswith("text/event-stream")
+    assert sse.text.startswith("event: risk\ndata: {") and sse.text.endswith("event: done\ndata: {\"event\":\"done\",\"count\":1}\n\n")
+    assert client.post("/api/analyze/stream", files=upload, data={"drugs": "CODEINE", "format": "xml"}).status_code == 400
+
+
+def test_bulk_cli_writes_rows_and_resumes():
+    import csv, json, tempfile
+    from app import batch
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "in", "sub"))
+        for name in ("a.vcf", os.path.join("sub", "b.vcf")):
+            with open(os.path.join(tmp, "in", name), "w") as f:
+                f.write(SAMPLE_VCF)
+        with open(os.path.join(tmp, "in", "bad.vcf"), "w") as f:
+            f.write("not a vcf\n")
+        out = os.path.join(tmp, "out.ndjson")
+        argv = [os.path.join(tmp, "in"), "--drugs", "CODEINE,WARFARIN", "--out", out, "--workers", "2"]
+
+        assert batch.main(argv) == 0
+        with open(out) as f:
+            rows = [json.loads(line) for line in f]
+        assert len(rows) == 5
+        assert sorted((r["file"].rsplit(os.sep, 1)[1], r.get("drug")) for r in rows if r["status"] == "ok") == [
+            ("a.vcf", "CODEINE"), ("a.vcf", "WARFARIN"), ("b.vcf", "CODEINE"), ("b.vcf", "WARFARIN"),
+        ]
+        assert [r["file"].endswith("bad.vcf") for r in rows if r["status"] == "error"] == [True]
+        ok = next(r for r in rows if r["status"] == "ok" and r["drug"] == "CODEINE")
+        assert ok["pharmacogenomic_profile"]["diplotype"] == "*1/*4"
+
+        # Interrupted after the first file, mid-way through the next one
+        with open(out + ".progress") as f:
+            header, first = f.readline(), f.readline()
+        assert json.loads(header[2:])["drugs"] == ["CODEINE", "WARFARIN"]
+        with open(out + ".progress", "w") as f:
+            f.write(header + first + "17")
+        with open(out, "a") as f:
+            f.write('{"file": "torn')
+        assert batch.run(batch.discover([os.path.join(tmp, "in")]), ["CODEINE", "WARFARIN"], out)["processed"] == 2
+        with open(out) as f:
+            resumed = [json.loads(line) for line in f]
+        strip = lambda rs: sorted(json.dumps({**r, "timestamp": ""}, sort_keys=True) for r in rs)
+        assert strip(resumed) == strip(rows)
+        assert batch.run(batch.discover([os.path.join(tmp, "in")]), ["CODEINE", "WARFARIN"], out)["processed"] == 0
+        # Resuming with other parameters would mix incompatible rows
+        try:
+            batch.run(batch.discover([os.path.join(tmp, "in")]), ["CODEINE"], out)
+            assert False, "expected RunMismatchError"
+        except batch.RunMismatchError as e:
+            assert "drugs" in str(e)
+        assert batch.main(argv + ["--format", "csv"]) == 2
+        with open(out) as f:
+            assert strip(json.loads(line) for line in f) == strip(rows)   # untouched
+
+        out_csv = os.path.join(tmp, "out.csv")
+        assert batch.main(argv[:-4] + ["--out", out_csv, "--workers", "1"]) == 0
+        with open(out_csv) as f:
+            table = list(csv.DictReader(f))
+        assert len(table) == 5 and table[0]["drug"] == "CODEINE" and table[0]["phenotype"] == "IM"
+        assert batch.main(argv[:-4] + ["--out", out_csv]) == 0   # resumes, nothing left to do
+        with open(out_csv) as f:
+            assert len(list(csv.DictReader(f))) == 5
+
+
+def test_synthetic_vcf_generator_is_deterministic_and_parses():
+    import tempfile
+    from benchmarks import bench_suite, synthetic_vcf
+    from app.services.vcf_parser import parse_vcf_cohort, parse_vcf_file
+
+    first = list(synthetic_vcf.generate_lines(64 * 1024, seed=7))
+    assert first == list(synthetic_vcf.generate_lines(64 * 1024, seed=7))
+    assert first != list(synthetic_vcf.generate_lines(64 * 1024, seed=8))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for annotated, compression in ((True, "none"), (False, "none"), (True, "gzip"), (True, "bgzip")):
+            meta = bench_suite.dataset(tmp, "256KB", 1, annotated, compression)
+            assert 64 * 1024 < os.path.getsize(meta["path"]) and meta["records"] > 1000
+            variants, patient_id, success = parse_vcf_file(meta["path"])
+            # Background records all fall outside the pharmacogene regions
+            assert success and patient_id == "PATIENT_001" and len(variants) == meta["pgx_records"]
+        assert os.path.exists(meta["path"] + ".tbi")
+
+        cohort = bench_suite.dataset(tmp, "256KB", 20)
+        with open(cohort["path"]) as f:
+            matrix = parse_vcf_cohort(f)
+        assert len(matrix.samples) == 20 and len(matrix.variants) == cohort["pgx_records"]
+
+
+def test_readiness_follows_lifespan_and_warm_up_is_not_counted():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routers import health
+    from app.services import metrics
+    from app.services.llm_client import get_llm_client
+
+    health.set_state("starting")
+    client = TestClient(app)   # no lifespan: start-up has not run
+    assert client.get("/api/live").status_code == 200
+    resp = client.get("/api/ready")
+    assert resp.status_code == 503 and resp.json() == {"status": "starting"}
+
+    parsed = metrics.STAGE_SECONDS.count(stage="parse")
+    with TestClient(app) as client:
+        resp = client.get("/api/ready")
+        assert resp.status_code == 200 and resp.json()["status"] == "ready"
+        assert metrics.STAGE_SECONDS.count(stage="parse") == parsed   # warm-up analysis discarded
+        assert client.get("/api/health").json()["llm_client"]["requests"] == 0
+        assert get_llm_client()._http is None   # no HTTP client until the first LLM call
+    assert TestClient(app).get("/api/ready").json() == {"status": "stopping"}
+
+
+def test_gunicorn_config_preloads_knowledge_base_in_master():
+    import gc, runpy
+    from app.utils import knowledge_base
+
+    class Log:
+        def __init__(self):
+            self.lines = []
+
+        def info(self, msg, *args):
+            self.lines.append(msg % args)
+
+        warning = info
+
+    class Server:
+        log = Log()
+
+    saved = {k: os.environ.get(k) for k in ("WEB_CONCURRENCY", "ANALYSIS_WORKERS", "METRICS_DIR")}
+    os.environ["WEB_CONCURRENCY"] = "3"
+    os.environ.pop("ANALYSIS_WORKERS", None)
+    os.environ.pop("METRICS_DIR", None)
+    try:
+        conf = runpy.run_path(os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py"))
+        assert conf["workers"] == 3 and conf["preload_app"] and conf["worker_class"] == "uvicorn.workers.UvicornWorker"
+        assert os.environ["ANALYSIS_WORKERS"] == "2"
+        metrics_dir = os.environ["METRICS_DIR"]
+        assert os.path.isdir(metrics_dir)
+        conf["on_exit"](None)   # removes the temporary metrics directory it made
+        assert not os.path.exists(metrics_dir)
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    assert "child_exit" in conf   # folds an exited worker's metrics file into retired.json
+    conf["when_ready"](Server)
+    conf["on_reload"](Server)
+    kb = knowledge_base.current()
+    assert Server.log.lines == [f"Knowledge base {kb.version} ({kb.fingerprint}) loaded in master"] * 2
+    assert gc.get_freeze_count() > 0
+
+
+def test_knowledge_base_rejects_unknown_allele_function():
+    import shutil, tempfile
+    from app.utils import knowledge_base
+
+    old = knowledge_base.current()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, "kb")
+        shutil.copytree(knowledge_base.KB_DATA_DIR, data_dir, ignore=shutil.ignore_patterns(".snapshot*"))
+        with open(os.path.join(data_dir, "allele_functionality.csv"), "a") as f:
+            f.write("CYP2D6,*99,uncertain function,0.5\n")
+        try:
+            knowledge_base.reload(data_dir)
+            assert False, "unknown allele function should fail the build"
+        except ValueError as e:
+            assert "allele_functionality.csv" in str(e) and "CYP2D6 *99" in str(e)
+            assert "uncertain function" in str(e)
+    assert knowledge_base.current() is old
+
+
+def test_kb_reload_requires_configured_admin_token():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routers import knowledge_base as kb_router
+
+    client = TestClient(app)
+    saved = kb_router.KB_ADMIN_TOKEN
+    try:
+        kb_router.KB_ADMIN_TOKEN = ""
+        resp = client.post("/api/kb/reload", headers={"X-Admin-Token": ""})
+        assert resp.status_code == 403 and "disabled" in resp.json()["detail"]
+
+        kb_router.KB_ADMIN_TOKEN = "s3cret"
+        assert client.post("/api/kb/reload").status_code == 403
+        assert client.post("/api/kb/reload", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        resp = client.post("/api/kb/reload", headers={"X-Admin-Token": "s3cret"})
+        assert resp.status_code == 200 and resp.json()["reloaded"] is False
+    finally:
+        kb_router.KB_ADMIN_TOKEN = saved
+
+
+def test_knowledge_base_hot_reload_keeps_old_snapshot():
+    import json, shutil, tempfile
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.utils import knowledge_base
+
+    old = knowledge_base.current()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, "kb")
+        shutil.copytree(knowledge_base.KB_DATA_DIR, data_dir, ignore=shutil.ignore_patterns(".snapshot*"))
+        manifest = json.load(open(os.path.join(data_dir, "manifest.json")))
+        manifest["version"] = "9.9.9-test"
+        json.dump(manifest, open(os.path.join(data_dir, "manifest.json"), "w"))
+        rules = json.load(open(os.path.join(data_dir, "risk_rules.json")))
+        rules["CODEINE"]["CYP2D6"]["PM"]["risk_label"] = "Avoid"
+        json.dump(rules, open(os.path.join(data_dir, "risk_rules.json"), "w"))
+
+        try:
+            new, changed = knowledge_base.reload(data_dir)
+            assert changed and knowledge_base.current() is new
+            assert os.path.exists(os.path.join(data_dir, ".snapshot.pickle"))
+            assert knowledge_base.load_knowledge_base(data_dir).fingerprint == new.fingerprint  # from cache
+
+            # In-flight work keeps the snapshot it started with
+            assert knowledge_base.resolve(old.fingerprint) is old
+            assert old.risk_rules["CODEINE"]["CYP2D6"]["PM"][0] == "Ineffective"
+            assert new.risk_rules["CODEINE"]["CYP2D6"]["PM"][0] == "Avoid"
+            try:
+                new.version = "x"
+                assert False, "snapshot should be immutable"
+            except AttributeError:
+                pass
+
+            resp = TestClient(app).post(
+                "/api/analyze",
+                files={"vcf_file": ("p.vcf", SAMPLE_VCF.encode())},
+                data={"drugs": "CODEINE"},
+            )
+            assert resp.status_code == 200
+            assert resp.json()[0]["quality_metrics"]["knowledge_base_version"] == "9.9.9-test"
+        finally:
+            knowledge_base.reload()
+    assert knowledge_base.current().fingerprint == old.fingerprint
+
+
 def test_diplotype_determination():
     variants, _, _ = parse_vcf(SAMPLE_VCF)
     dip = determine_diplotype(variants, "CYP2D6")
@@ -124,6 +1373,49 @@ def test_json_schema_fields():
 if __name__ == "__main__":
     test_vcf_parsing()
     test_vcf_patient_id_extraction()
+    test_vcf_stream_parsing_matches_text_parsing()
+    test_vcf_stream_size_limit()
+    test_vcf_gzip_stream()
+    test_vcf_tabix_region_seek()
+    test_gene_region_lookup()
+    test_vcf_unannotated_records_assigned_by_coordinate()
+    test_vcf_gene_tag_kept_off_region_without_header_declaration()
+    test_vcf_unannotated_star_alleles_called_inline()
+    test_star_allele_lookup_by_rsid()
+    test_cohort_matrix_parsing()
+    test_cohort_analysis_matches_single_sample()
+    test_cohort_endpoint()
+    test_cohort_explanations_not_shared_across_driving_genes()
+    test_batch_endpoint_reports_per_file_errors()
+    test_batch_endpoint_goes_through_analysis_executor()
+    test_executor_rejects_when_queue_full()
+    test_executor_keeps_cancelled_running_job_pending()
+    test_analyze_endpoint_process_executor_and_backpressure()
+    test_metrics_aggregated_across_worker_processes()
+    test_metrics_exited_worker_retired_into_one_file()
+    test_metrics_endpoint_reports_stages_and_counters()
+    test_explanations_run_concurrently_with_timeout_fallback()
+    test_batched_explanations_one_call_per_round_with_fallback()
+    test_explanation_cache_io_runs_off_the_event_loop()
+    test_explanation_cache_tiers_ttl_and_model_version()
+    test_llm_client_retries_transient_errors()
+    test_llm_client_splits_budget_across_attempts()
+    test_llm_client_circuit_breaker_opens_and_recovers()
+    test_decision_tables_match_knowledge_base()
+    test_allele_function_is_gene_scoped()
+    test_multi_gene_drugs()
+    test_panel_mode_calls_each_gene_once()
+    test_compact_variant_records()
+    test_parse_cache_skips_reparse_and_serves_by_hash()
+    test_compact_response_shape()
+    test_stream_sends_risk_first_then_explanations_as_ready()
+    test_bulk_cli_writes_rows_and_resumes()
+    test_synthetic_vcf_generator_is_deterministic_and_parses()
+    test_readiness_follows_lifespan_and_warm_up_is_not_counted()
+    test_gunicorn_config_preloads_knowledge_base_in_master()
+    test_knowledge_base_rejects_unknown_allele_function()
+    test_kb_reload_requires_configured_admin_token()
+    test_knowledge_base_hot_reload_keeps_old_snapshot()
     test_diplotype_determination()
     test_phenotype_pm()
     test_phenotype_im()